@@ -24,6 +24,8 @@ load_dotenv()
 class ChatAppGUI:
     # Global connection ID counter
     connection_id = 0
+    # accounts fetched per RPCListAccount request, more are fetched when the list is scrolled down
+    ACCOUNTS_PAGE_SIZE = 50
 
     def __init__(self, root, protocol_version=None):
         self.root = root
@@ -286,22 +288,28 @@ class ChatAppGUI:
             messagebox.showerror("Error", "Search string is required!")
             return
 
-        # get accounts
-        accounts = self.client.list_accounts(username)
+        # get the first page of accounts
+        page = self.client.list_accounts_page(username, self.ACCOUNTS_PAGE_SIZE)
 
         # check if accounts were returned
-        if accounts is not None:
+        if page is not None:
+            accounts, cursor = page
             if len(accounts) == 0:
                 messagebox.showinfo("Success", "No accounts found")
 
             else:
                 messagebox.showinfo("Success", "Searched accounts were returned")
-                self.display_accounts(accounts)
+                self.display_accounts(accounts, username, cursor)
         else:
             messagebox.showerror("Error", "Account search failed.")
 
-    def display_accounts(self, accounts):
-        """Lists accounts under the GUI"""
+    def display_accounts(self, accounts, search_string=None, cursor=None):
+        """Lists accounts under the GUI, fetching the next page once the list is scrolled to the end"""
+        # search and cursor of the next page, None once every page is shown
+        self.accounts_search = search_string
+        self.accounts_cursor = cursor
+        self.fetching_accounts = False
+
         msg_window = tk.Toplevel(self.root)
         msg_window.title("Accounts")
         msg_window.geometry("450x400")
@@ -311,21 +319,50 @@ class ChatAppGUI:
         listbox_frame.pack(pady=10, fill="both", expand=True)
 
         scrollbar = tk.Scrollbar(listbox_frame, orient="vertical")
-        self.listbox = tk.Listbox(
+
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            # the end of the list is visible, so the next page is fetched once Tk is idle
+            if float(last) >= 1.0 and self.accounts_cursor is not None and not self.fetching_accounts:
+                self.fetching_accounts = True
+                self.root.after_idle(self.fetch_more_accounts)
+
+        self.accounts_listbox = tk.Listbox(
             listbox_frame,
             selectmode=tk.MULTIPLE,
             width=60,
             height=15,
-            yscrollcommand=scrollbar.set,
+            yscrollcommand=on_scroll,
         )
 
-        scrollbar.config(command=self.listbox.yview)
+        scrollbar.config(command=self.accounts_listbox.yview)
         scrollbar.pack(side="right", fill="y")
-        self.listbox.pack(side="left", fill="both", expand=True)
+        self.accounts_listbox.pack(side="left", fill="both", expand=True)
 
+        self.insert_accounts(accounts)
+
+    def insert_accounts(self, accounts):
+        """Appends accounts to the account list"""
         for acc in accounts:
             display_text = f"{acc}"  # Show preview
-            self.listbox.insert("end", display_text)
+            self.accounts_listbox.insert("end", display_text)
+
+    def fetch_more_accounts(self):
+        """Fetches the next page of accounts and appends it to the account list"""
+        # the account window may have been closed in the meantime
+        if not self.accounts_listbox.winfo_exists():
+            return
+        page = self.client.list_accounts_page(
+            self.accounts_search, self.ACCOUNTS_PAGE_SIZE, self.accounts_cursor
+        )
+        if page is None:
+            # stops fetching so a failing server is not asked again on every scroll
+            self.accounts_cursor = None
+            messagebox.showerror("Error", "Fetching more accounts failed.")
+        else:
+            accounts, self.accounts_cursor = page
+            self.insert_accounts(accounts)
+        self.fetching_accounts = False
 
     def create_account_menu(self):
         """Account creation screen."""
@@ -462,13 +499,15 @@ class ChatAppGUI:
         self.unread_messages.clear()
         self.notification_text.delete(1.0, tk.END)
 
-        messages = self.client.read_message()
+        # the latest message comes with the number of messages, so only the messages
+        # the user asks for are downloaded
+        page = self.client.read_message_page(1)
 
-        if messages is None:
+        if page is None:
             messagebox.showerror("Error", "Failed to retrieve messages.")
             return
 
-        total_messages = len(messages)
+        messages, cursor, total_messages = page
         if total_messages == 0:
             messagebox.showinfo("Messages", "No messages.")
             return
@@ -483,6 +522,15 @@ class ChatAppGUI:
 
         if num_to_read is None or num_to_read == 0:
             return  # User canceled input
+
+        # older messages are fetched page by page until there are enough
+        while cursor is not None and len(messages) < num_to_read:
+            page = self.client.read_message_page(num_to_read - len(messages), before_id=cursor)
+            if page is None:
+                messagebox.showerror("Error", "Failed to retrieve messages.")
+                return
+            older, cursor, _ = page
+            messages[:0] = older
         # Create a new window for messages
         self.display_messages(messages[-num_to_read:])
 
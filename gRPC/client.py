@@ -163,6 +163,35 @@ class Client:
             logging.error("Listing accounts failed!")
             return
 
+    def list_accounts_page(self, search_string, limit, after=None):
+        """
+        Gets a page of the accounts that start with the search string, in alphabetical order.
+
+        Args:
+            search_string: The search string to search for in the accounts
+            limit: The most accounts to return
+            after: The cursor returned with the previous page, None for the first page
+
+        Returns:
+            tuple: The accounts of the page and the cursor of the next page, which is None
+                after the last page, or None if the listing failed
+        """
+        try:
+            request = app_pb2.Request(info=[search_string, str(limit), after or ""])
+            request_size = request.ByteSize()
+            print("--------------------------------")
+            print(f"OPERATION: LIST ACCOUNTS")
+            print(f"SERIALIZED DATA LENGTH: {request_size} ")
+            print("--------------------------------")
+            res = self.stub.RPCListAccount(request)
+            status = res.operation
+            if status == app_pb2.SUCCESS:
+                return list(res.info), res.cursor or None
+
+        except:
+            logging.error("Listing accounts failed!")
+            return
+
     def send_message(self, receiver, msg):
         """
         Handles the message sending process for the client application.
@@ -223,6 +252,37 @@ class Client:
             logging.error("Unexpected error in read_message")
             return
 
+    def read_message_page(self, limit, before_id=None, since_id=None):
+        """
+        Gets the latest messages of the current user between two message IDs, in time order.
+
+        Args:
+            limit: The most messages to return
+            before_id: The cursor returned with the previous page, None for the latest messages
+            since_id: Only messages newer than this message ID are returned
+
+        Returns:
+            tuple: The messages of the page, the cursor of the page of older messages, which
+                is None after the oldest page, and the number of messages of the user, or
+                None if reading failed
+        """
+        try:
+            request = app_pb2.Request(info=[self.username, str(limit), before_id or "", since_id or ""])
+            request_size = request.ByteSize()
+            print("--------------------------------")
+            print(f"OPERATION: READ MESSAGE")
+            print(f"SERIALIZED DATA LENGTH: {request_size} ")
+            print("--------------------------------")
+            res = self.stub.RPCReadMessage(request)
+            if res.operation == app_pb2.SUCCESS:
+                return list(res.messages), res.cursor or None, res.total
+
+            logging.error("Reading message failed")
+
+        except:
+            logging.error("Unexpected error in read_message")
+            return
+
     def delete_messages(self, messages):
         """
         Deletes a list of messages from the server.
@@ -240,7 +300,7 @@ class Client:
                 receiver = message.receiver
                 timestamp = message.timestamp
                 msg = message.message
-                if not self.delete_message(sender, receiver, msg, timestamp):
+                if not self.delete_message(sender, receiver, msg, timestamp, message.id):
                     logging.error(
                         f"message from {sender} to {receiver} on {timestamp} could not be deleted"
                     )
@@ -251,7 +311,7 @@ class Client:
 
         return True
 
-    def delete_message(self, sender, receiver, msg, timestamp):
+    def delete_message(self, sender, receiver, msg, timestamp, message_id=""):
         """
         Deletes a single message from the server.
 
@@ -260,12 +320,17 @@ class Client:
             receiver: The receiver of the message
             msg: The message content
             timestamp: The timestamp of the message
+            message_id: The ID the server assigned to the message, if it sent one
 
         Returns:
             bool: True if the message is deleted successfully, False otherwise
         """
         try:
-            request = app_pb2.Request(info=[sender, receiver, msg, timestamp])
+            # the server finds a message by its ID without comparing the other fields
+            if message_id:
+                request = app_pb2.Request(info=[sender, receiver, message_id])
+            else:
+                request = app_pb2.Request(info=[sender, receiver, msg, timestamp])
             request_size = request.ByteSize()
             print("--------------------------------")
             print(f"OPERATION: DELETE MESSAGE")
@@ -1,12 +1,81 @@
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+
+# message IDs start with the microseconds since this epoch
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# bits of an ID after the microseconds, for messages assigned within the same microsecond
+SEQUENCE_BITS = 8
+# bits of an ID holding the node number of the server that assigned it
+NODE_BITS = 8
+# IDs are hex strings of a fixed width so they sort as strings in the order of their values
+ID_DIGITS = 18
+
+
+def format_message_id(value):
+    """Returns the ID string of an integer ID"""
+    return f"{value:0{ID_DIGITS}x}"
+
+
+def parse_message_id(message_id):
+    """
+    Returns the integer value of an ID string.
+
+    Args:
+        message_id: the ID string
+
+    Returns:
+        int: the value of the ID, None if message_id is not an ID in its canonical form
+    """
+    try:
+        value = int(message_id, 16)
+    except (TypeError, ValueError):
+        return None
+    if value < 0 or format_message_id(value) != message_id:
+        return None
+    return value
+
+
+class MessageIds:
+    """
+    Assigns message IDs that sort in the order of the message timestamps.
+
+    An ID holds the microseconds of the message timestamp, a sequence number and the
+    node number of the server, so servers with different node numbers never assign the
+    same ID. The IDs of a server only ever increase, even if the clock is set back, and
+    can be assigned from several threads at once.
+    """
+
+    def __init__(self, node=0):
+        """
+        Args:
+            node: the node number of the server, below 2 ** NODE_BITS
+        """
+        self.node = node
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def assign(self, timestamp):
+        """
+        Returns a new ID for a message.
+
+        Args:
+            timestamp: the timestamp of the message
+        """
+        with self.lock:
+            tick = max(((timestamp - EPOCH) // MICROSECOND) << SEQUENCE_BITS, self.last + 1)
+            self.last = tick
+        return format_message_id(tick << NODE_BITS | self.node)
 
 
 class Message:
-    def __init__(self, sender, receiver, message, timestamp=None):
+    def __init__(self, sender, receiver, message, timestamp=None, message_id=None):
         self.sender = sender
         self.receiver = receiver
         self.message = message
         self.timestamp = timestamp if timestamp else datetime.now()
+        # assigned by the server that stores the message
+        self.id = message_id
 
     def __lt__(self, other):
         """Compare messages based on their timestamp."""
@@ -19,4 +88,5 @@ class Message:
             "receiver": self.receiver,
             "message": self.message,
             "timestamp": self.timestamp.isoformat(),
+            "id": self.id,
         }
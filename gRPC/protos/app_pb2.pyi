@@ -58,10 +58,13 @@ class Message(google.protobuf.message.Message):
     RECEIVER_FIELD_NUMBER: builtins.int
     TIMESTAMP_FIELD_NUMBER: builtins.int
     MESSAGE_FIELD_NUMBER: builtins.int
+    ID_FIELD_NUMBER: builtins.int
     sender: builtins.str
     receiver: builtins.str
     timestamp: builtins.str
     message: builtins.str
+    id: builtins.str
+    """assigned by the server, names the message in DELETE_MESSAGE requests"""
     def __init__(
         self,
         *,
@@ -69,8 +72,9 @@ class Message(google.protobuf.message.Message):
         receiver: builtins.str = ...,
         timestamp: builtins.str = ...,
         message: builtins.str = ...,
+        id: builtins.str = ...,
     ) -> None: ...
-    def ClearField(self, field_name: typing.Literal["message", b"message", "receiver", b"receiver", "sender", b"sender", "timestamp", b"timestamp"]) -> None: ...
+    def ClearField(self, field_name: typing.Literal["id", b"id", "message", b"message", "receiver", b"receiver", "sender", b"sender", "timestamp", b"timestamp"]) -> None: ...
 
 global___Message = Message
 
@@ -97,7 +101,13 @@ class Response(google.protobuf.message.Message):
     OPERATION_FIELD_NUMBER: builtins.int
     INFO_FIELD_NUMBER: builtins.int
     MESSAGES_FIELD_NUMBER: builtins.int
+    CURSOR_FIELD_NUMBER: builtins.int
+    TOTAL_FIELD_NUMBER: builtins.int
     operation: global___Operation.ValueType
+    cursor: builtins.str
+    """passed back to get the next page of a paginated reply, empty after the last page"""
+    total: builtins.int
+    """number of messages a paginated READ_MESSAGE reply was taken from"""
     @property
     def info(self) -> google.protobuf.internal.containers.RepeatedScalarFieldContainer[builtins.str]: ...
     @property
@@ -108,7 +118,9 @@ class Response(google.protobuf.message.Message):
         operation: global___Operation.ValueType = ...,
         info: collections.abc.Iterable[builtins.str] | None = ...,
         messages: collections.abc.Iterable[global___Message] | None = ...,
+        cursor: builtins.str = ...,
+        total: builtins.int = ...,
     ) -> None: ...
-    def ClearField(self, field_name: typing.Literal["info", b"info", "messages", b"messages", "operation", b"operation"]) -> None: ...
+    def ClearField(self, field_name: typing.Literal["cursor", b"cursor", "info", b"info", "messages", b"messages", "operation", b"operation", "total", b"total"]) -> None: ...
 
 global___Response = Response
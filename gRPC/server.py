@@ -1,6 +1,7 @@
 from dotenv import load_dotenv
-from user import User
-from message import Message
+from account_index import AccountIndex
+from user import Mailbox, User
+from message import Message, MessageIds
 from datetime import datetime
 
 from protos import app_pb2_grpc, app_pb2
@@ -10,12 +11,18 @@ from util import hash_password
 class Server(app_pb2_grpc.AppServicer):
     HEADER = 64
     FORMAT = "utf-8"
+    # most rows a paginated reply holds, whatever limit the request asks for
+    MAX_PAGE_SIZE = 1000
 
     def __init__(self):
         load_dotenv()
         # all users and their associated data stored in the User object
         self.user_login_database = {}
+        # usernames of user_login_database in sorted order for prefix searches
+        self.account_index = AccountIndex()
         self.active_users = {}
+        # assigns the IDs of the messages stored by this server
+        self.message_ids = MessageIds()
 
     def check_valid_user(self, username):
         """
@@ -90,6 +97,7 @@ class Server(app_pb2_grpc.AppServicer):
         # create the account
         else:
             self.user_login_database[username] = User(username, password)
+            self.account_index.add(username)
             response = app_pb2.Response(operation=app_pb2.SUCCESS, info="")
             response_size = response.ByteSize()
             print("--------------------------------")
@@ -98,25 +106,47 @@ class Server(app_pb2_grpc.AppServicer):
             print("--------------------------------")
             return response
 
+    def page_limit(self, limit):
+        """
+        Returns the number of rows a paginated request asks for.
+
+        limit: The limit of the request, empty if it has none
+
+        Returns:
+            int: The limit capped at MAX_PAGE_SIZE, None if the request asks for every row
+
+        Raises:
+            ValueError: If the limit is not a positive number
+        """
+        if not limit:
+            return None
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError(f"invalid limit {limit}")
+        return min(limit, self.MAX_PAGE_SIZE)
+
     def RPCListAccount(self, request, context):
         """
-        Lists all accounts that start with the search string.
+        Lists the accounts that start with the search string in alphabetical order. If a
+        limit is given and more accounts match than fit on the page, the cursor of the
+        response is set to the last username, which is sent as after to get the next page.
 
         search_string: The string to search for
+        limit: The most accounts to return, optional
+        after: Only accounts after this username are returned, optional
 
         Returns:
             dict: A dictionary representing the data object
         """
         try:
-            if len(request.info) != 1:
+            if len(request.info) not in (1, 3):
                 return app_pb2.Response(operation=app_pb2.FAILURE, info="List Account Request Invalid")
             search_string = request.info[0]
-            accounts = [
-                username
-                for username in self.user_login_database.keys()
-                if username.startswith(search_string)
-            ]
-            response = app_pb2.Response(operation=app_pb2.SUCCESS, info=accounts)
+            # older clients only send the search string
+            limit, after = request.info[1:] if len(request.info) == 3 else ("", "")
+            accounts, more = self.account_index.page(search_string, after or None, self.page_limit(limit))
+            cursor = accounts[-1] if more else ""
+            response = app_pb2.Response(operation=app_pb2.SUCCESS, info=accounts, cursor=cursor)
             response_size = response.ByteSize()
             print("--------------------------------")
             print(f"OPERATION: LIST ACCOUNTS")
@@ -158,17 +188,18 @@ class Server(app_pb2_grpc.AppServicer):
         if not msg:
             return app_pb2.Response(operation=app_pb2.FAILURE, info="Send Message Failed")
 
-        message = Message(sender, receiver, msg)
+        timestamp = datetime.now()
+        message = Message(sender, receiver, msg, timestamp, self.message_ids.assign(timestamp))
 
         # check if the receiver is active and appends to unread messages if not active and regular messages otherwise
         if receiver not in self.active_users:
-            self.user_login_database[receiver].unread_messages.append(message)
+            self.user_login_database[receiver].unread_messages.add(message)
         else:
             self.active_users[receiver].append(message)
-            self.user_login_database[receiver].messages.append(message)
+            self.user_login_database[receiver].messages.add(message)
 
         # append the message to the sender's messages
-        self.user_login_database[sender].messages.append(message)
+        self.user_login_database[sender].messages.add(message)
         
         response = app_pb2.Response(operation=app_pb2.SUCCESS, info="")
         response_size = response.ByteSize()
@@ -199,6 +230,7 @@ class Server(app_pb2_grpc.AppServicer):
                     receiver=msg.receiver,
                     timestamp=str(msg.timestamp),
                     message=msg.message,
+                    id=msg.id,
                 )
                 for msg in incoming_messages
             ]
@@ -207,16 +239,26 @@ class Server(app_pb2_grpc.AppServicer):
 
     def RPCReadMessage(self, request, context):
         """
-        Reads the messages of the user.
+        Reads the messages of the user in time order. If a limit or message ID is given,
+        only the latest messages between the IDs are read, the total of the response is
+        set to the number of messages of the user and, if older messages did not fit on
+        the page, the cursor to the ID of the oldest message, which is sent as before_id
+        to get the previous page.
 
         username: The username of the user
+        limit: The most messages to return, optional
+        before_id: Only messages older than this message ID are returned, optional
+        since_id: Only messages newer than this message ID are returned, optional
 
         Returns:
             dict: A dictionary representing the data object
         """
-        if len(request.info) != 1:
+        if len(request.info) not in (1, 4):
             return app_pb2.Response(operation=app_pb2.FAILURE, info="Read Message Request Invalid")
         username = request.info[0]
+        # older clients only send the username
+        limit, before_id, since_id = request.info[1:] if len(request.info) == 4 else ("", "", "")
+        paginated = limit or before_id or since_id
 
         # check if the user is a valid user
         if username not in self.user_login_database:
@@ -226,11 +268,17 @@ class Server(app_pb2_grpc.AppServicer):
             user = self.user_login_database[username]
             # check if the user has unread messages and appends to messages if they do
             if user.unread_messages:
-                user.messages += user.unread_messages
-                user.unread_messages = []
-
-            # sort the messages by timestamp
-            messages = sorted(user.messages, key=lambda x: x.timestamp)
+                user.messages.extend(user.unread_messages)
+                user.unread_messages = Mailbox()
+
+            # the mailbox keeps the messages in ID order, which is the order they were sent in
+            cursor = ""
+            if paginated:
+                messages, more = user.messages.page(self.page_limit(limit), before_id or None, since_id or None)
+                if more:
+                    cursor = messages[0].id
+            else:
+                messages = user.messages
 
             # create the data object as a list of dictionaries that represent the messages
             message_list = [
@@ -239,12 +287,17 @@ class Server(app_pb2_grpc.AppServicer):
                     receiver=msg.receiver,
                     timestamp=str(msg.timestamp),
                     message=msg.message,
+                    id=msg.id,
                 )
                 for msg in messages
             ]
             self.active_users[username] = []
             response = app_pb2.Response(
-                operation=app_pb2.SUCCESS, info="", messages=message_list
+                operation=app_pb2.SUCCESS,
+                info="",
+                messages=message_list,
+                cursor=cursor,
+                total=len(user.messages),
             )
             response_size = response.ByteSize()
             print("--------------------------------")
@@ -256,46 +309,49 @@ class Server(app_pb2_grpc.AppServicer):
         except:
             return app_pb2.Response(operation=app_pb2.FAILURE, info="Read Message Failed")
 
-    def delete_message_from_user(
-        self, user, sender, receiver, msg, timestamp, unread=False
-    ):
+    def find_message_id(self, sender, receiver, msg, timestamp):
         """
-        Deletes a message from the user's messages and unread messages.
+        Finds the ID of a message by its fields, for requests that do not name the
+        message by its ID.
 
         Args:
-            user: The user object
             sender: The username of the sender
             receiver: The username of the receiver
-            msg: The message to delete
+            msg: The message
             timestamp: The timestamp of the message
 
         Returns:
-            list: A list of messages filtered out of the deleted message
+            str: The ID of the message, None if neither user holds it
+        """
+        timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
+        for username in (sender, receiver):
+            user = self.user_login_database.get(username)
+            if user is None:
+                continue
+            for mailbox in (user.messages, user.unread_messages):
+                for message in mailbox:
+                    if (
+                        message.receiver == receiver
+                        and message.sender == sender
+                        and message.message == msg
+                        and message.timestamp == timestamp
+                    ):
+                        return message.id
+        return None
+
+    def delete_message_from_user(self, user, message_id, unread=False):
+        """
+        Deletes a message from the user's messages and unread messages.
+
+        Args:
+            user: The user object
+            message_id: The ID of the message to delete
+            unread: True to also delete the message from the unread messages
         """
         # checks to see if unread messages should also be deleted from the receiver side
         if unread:
-            user.unread_messages = [
-                message
-                for message in user.unread_messages
-                if not (
-                    message.receiver == receiver
-                    and message.sender == sender
-                    and message.message == msg
-                    and message.timestamp
-                    == datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
-                )
-            ]
-        user.messages = [
-            message
-            for message in user.messages
-            if not (
-                message.receiver == receiver
-                and message.sender == sender
-                and message.message == msg
-                and message.timestamp
-                == datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
-            )
-        ]
+            user.unread_messages.remove(message_id)
+        user.messages.remove(message_id)
 
     def RPCDeleteMessage(self, request, context):
         """
@@ -304,29 +360,34 @@ class Server(app_pb2_grpc.AppServicer):
         Args:
             sender: The username of the sender
             receiver: The username of the receiver
+            id: The ID of the message, or for older clients
             msg: The message to delete
             timestamp: The timestamp of the message
 
         Returns:
             dict: A dictionary representing the data object
         """
-        if len(request.info) != 4:
+        if len(request.info) not in (3, 4):
             return app_pb2.Response(operation=app_pb2.FAILURE, info="Delete Message Request Invalid")
 
-        sender, receiver, msg, timestamp = request.info
         try:
+            # clients name the message by its ID, older clients by its fields
+            if len(request.info) == 3:
+                sender, receiver, message_id = request.info
+            else:
+                sender, receiver, msg, timestamp = request.info
+                message_id = self.find_message_id(sender, receiver, msg, timestamp)
+
             # check if the sender is a valid user
             if sender in self.user_login_database:
                 user = self.user_login_database[sender]
-                # gets the user and searches for the message to delete
-                self.delete_message_from_user(user, sender, receiver, msg, timestamp)
+                # gets the user and deletes the message by its ID
+                self.delete_message_from_user(user, message_id)
 
             # check if the receiver is a valid user and deletes the message from their messages
             if receiver in self.user_login_database:
                 user = self.user_login_database[receiver]
-                self.delete_message_from_user(
-                    user, sender, receiver, msg, timestamp, unread=True
-                )
+                self.delete_message_from_user(user, message_id, unread=True)
             response = app_pb2.Response(operation=app_pb2.SUCCESS, info="")
             response_size = response.ByteSize()
             print("--------------------------------")
@@ -358,6 +419,7 @@ class Server(app_pb2_grpc.AppServicer):
                 return app_pb2.Response(operation=app_pb2.FAILURE, info="Delete Account Failed")
 
             self.user_login_database.pop(username)
+            self.account_index.remove(username)
             if username in self.active_users:
                 self.active_users.pop(username)
             response = app_pb2.Response(operation=app_pb2.SUCCESS, info="")
@@ -7,7 +7,8 @@ import threading
 import socket
 from unittest.mock import patch
 from app import ChatAppGUI  # Assuming you have this import
-from protos import app_pb2_grpc
+from protos import app_pb2, app_pb2_grpc
+from client import Client
 from server import Server
 import grpc
 
@@ -197,6 +198,84 @@ class TestChatAppGUI(unittest.TestCase):
         # Verify login failed because account was deleted
         self.assertFalse(login_result)
 
+    def logged_in_client(self, username, password):
+        """Creates an account and returns a client of the test server logged in to it"""
+        client = Client(self.app.stub)
+        client.create_account(username, password)
+        client.login(username, password)
+        return client
+
+    def test_07_message_ids(self):
+        """Test that returned messages carry the ID the server assigned to them"""
+        sender = self.logged_in_client("id_sender", "pass")
+        receiver = self.logged_in_client("id_receiver", "pass")
+        for i in range(3):
+            sender.send_message("id_receiver", f"id message {i}")
+
+        messages = receiver.read_message()
+        ids = [msg.id for msg in messages]
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(all(len(message_id) == 18 for message_id in ids))
+        # IDs sort in the order the messages were sent
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_08_delete_message_by_id(self):
+        """Test that RPCDeleteMessage removes a message from both users by its ID"""
+        sender = self.logged_in_client("delete_id_sender", "pass")
+        receiver = self.logged_in_client("delete_id_receiver", "pass")
+        sender.send_message("delete_id_receiver", "keep me")
+        sender.send_message("delete_id_receiver", "delete me")
+
+        message = [msg for msg in receiver.read_message() if msg.message == "delete me"][0]
+        res = self.app.stub.RPCDeleteMessage(
+            app_pb2.Request(info=["delete_id_sender", "delete_id_receiver", message.id])
+        )
+        self.assertEqual(res.operation, app_pb2.SUCCESS)
+        for client in (sender, receiver):
+            self.assertEqual([msg.message for msg in client.read_message()], ["keep me"])
+
+    def test_09_list_accounts_pages(self):
+        """Test that paginated RPCListAccount continues after the cursor until the last page"""
+        usernames = [f"page_user{i:02}" for i in range(12)]
+        client = Client(self.app.stub)
+        for username in usernames:
+            client.create_account(username, "pass")
+
+        pages = []
+        after = None
+        while True:
+            accounts, after = client.list_accounts_page("page_user", 5, after)
+            pages.append(accounts)
+            if after is None:
+                break
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(sum(pages, []), usernames)
+
+    def test_10_read_message_pages(self):
+        """Test that paginated RPCReadMessage pages back by cursor and reports the total"""
+        sender = self.logged_in_client("read_page_sender", "pass")
+        receiver = self.logged_in_client("read_page_receiver", "pass")
+        for i in range(7):
+            sender.send_message("read_page_receiver", f"page message {i}")
+
+        messages, cursor, total = receiver.read_message_page(3)
+        self.assertEqual(total, 7)
+        pages = [messages]
+        while cursor is not None:
+            messages, cursor, total = receiver.read_message_page(3, before_id=cursor)
+            self.assertEqual(total, 7)
+            pages.insert(0, messages)
+        self.assertEqual([len(page) for page in pages], [1, 3, 3])
+        self.assertEqual(
+            [msg.message for page in pages for msg in page], [f"page message {i}" for i in range(7)]
+        )
+
+        # since_id only returns the messages after it
+        since_id = pages[-1][0].id
+        messages, cursor, _ = receiver.read_message_page(3, since_id=since_id)
+        self.assertEqual([msg.message for msg in messages], ["page message 5", "page message 6"])
+        self.assertIsNone(cursor)
+
 
 if __name__ == "__main__":
     unittest.main()
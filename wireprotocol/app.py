@@ -6,6 +6,9 @@ import selectors
 from tkinter import scrolledtext
 from protocol_client import Client
 from protocol_server import Server
+from async_server import AsyncServer
+from sharded_server import ShardedServer
+from threaded_server import ThreadedServer
 import time
 import logging
 import sys
@@ -14,8 +17,10 @@ import sys
 class ChatAppGUI:
     # Global connection ID counter
     connection_id = 0
+    # accounts fetched per LIST_ACCOUNTS request, more are fetched when the list is scrolled down
+    ACCOUNTS_PAGE_SIZE = 50
 
-    def __init__(self, root, protocol_version=None):
+    def __init__(self, root, protocol_version=None, compression=False, server_class=Server):
         self.root = root
         self.root.title("Chat App")
         self.main_frame = tk.Frame(root)
@@ -28,6 +33,9 @@ class ChatAppGUI:
 
         # assigned when client and server are initialized 
         self.protocol_version = protocol_version
+        self.compression = compression
+        # server implementation started from the server menu
+        self.server_class = server_class
 
         # create a frame for notifications
         self.notification_frame = tk.Frame(root)
@@ -60,11 +68,12 @@ class ChatAppGUI:
             widget.destroy()
 
 
-    def show_notification(self, message):
-        """Display a popup notification for new messages"""
+    def show_notification(self, messages):
+        """Display a single popup notification for a batch of new messages"""
 
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.unread_messages.append(f"[{timestamp}] {message}")
+        for message in messages:
+            self.unread_messages.append(f"[{timestamp}] {message}")
 
         # update notification widget
         self.notification_text.delete(1.0, tk.END)
@@ -83,8 +92,9 @@ class ChatAppGUI:
         screen_height = self.root.winfo_screenheight()
         notification.geometry(f"300x100+{screen_width-320}+{screen_height-120}")
 
-        # add message to notification
-        tk.Label(notification, text=message, wraplength=250, justify="left").pack(
+        # add the latest message to notification, counting the rest of the batch
+        text = messages[-1] if len(messages) == 1 else f"{messages[-1]}\n(and {len(messages) - 1} more)"
+        tk.Label(notification, text=text, wraplength=250, justify="left").pack(
             padx=10, pady=5
         )
 
@@ -125,7 +135,9 @@ class ChatAppGUI:
 
         # create selector and client object
         sel = selectors.DefaultSelector()
-        self.client = Client(self.connection_id, sel, self.protocol_version)
+        self.client = Client(
+            self.connection_id, sel, self.protocol_version, self.compression
+        )
         self.connection_id += 1
 
         # connect sockets
@@ -148,10 +160,11 @@ class ChatAppGUI:
             try:
                 if self.client.client_socket:
                     try:
-                        message = self.client.client_receive()
-                        if message:
+                        # every message delivered since the last poll is picked up at once
+                        messages = self.client.client_receive()
+                        if messages:
                             # schedule notification on main thread
-                            self.root.after(0, self.show_notification, message)
+                            self.root.after(0, self.show_notification, messages)
                     except BlockingIOError:
                         # no data available, this is normal
                         pass
@@ -273,22 +286,28 @@ class ChatAppGUI:
             messagebox.showerror("Error", "Search string is required!")
             return
 
-        # get accounts
-        accounts = self.client.list_accounts(username)
+        # get the first page of accounts
+        page = self.client.list_accounts_page(username, self.ACCOUNTS_PAGE_SIZE)
 
         # check if accounts were returned
-        if accounts is not None:
+        if page is not None:
+            accounts, cursor = page
             if len(accounts) == 0:
                 messagebox.showinfo("Success", "No accounts found")
 
             else:
                 messagebox.showinfo("Success", "Searched accounts were returned")
-                self.display_accounts(accounts)
+                self.display_accounts(accounts, username, cursor)
         else:
             messagebox.showerror("Error", "Account search failed.")
 
-    def display_accounts(self, accounts):
-        """Lists accounts under the GUI"""
+    def display_accounts(self, accounts, search_string=None, cursor=None):
+        """Lists accounts under the GUI, fetching the next page once the list is scrolled to the end"""
+        # search and cursor of the next page, None once every page is shown
+        self.accounts_search = search_string
+        self.accounts_cursor = cursor
+        self.fetching_accounts = False
+
         msg_window = tk.Toplevel(self.root)
         msg_window.title("Accounts")
         msg_window.geometry("450x400")
@@ -298,21 +317,50 @@ class ChatAppGUI:
         listbox_frame.pack(pady=10, fill="both", expand=True)
 
         scrollbar = tk.Scrollbar(listbox_frame, orient="vertical")
-        self.listbox = tk.Listbox(
+
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            # the end of the list is visible, so the next page is fetched once Tk is idle
+            if float(last) >= 1.0 and self.accounts_cursor is not None and not self.fetching_accounts:
+                self.fetching_accounts = True
+                self.root.after_idle(self.fetch_more_accounts)
+
+        self.accounts_listbox = tk.Listbox(
             listbox_frame,
             selectmode=tk.MULTIPLE,
             width=60,
             height=15,
-            yscrollcommand=scrollbar.set,
+            yscrollcommand=on_scroll,
         )
 
-        scrollbar.config(command=self.listbox.yview)
+        scrollbar.config(command=self.accounts_listbox.yview)
         scrollbar.pack(side="right", fill="y")
-        self.listbox.pack(side="left", fill="both", expand=True)
+        self.accounts_listbox.pack(side="left", fill="both", expand=True)
 
+        self.insert_accounts(accounts)
+
+    def insert_accounts(self, accounts):
+        """Appends accounts to the account list"""
         for acc_dict in accounts:
             display_text = f"{acc_dict['username']}"  # Show preview
-            self.listbox.insert("end", display_text)
+            self.accounts_listbox.insert("end", display_text)
+
+    def fetch_more_accounts(self):
+        """Fetches the next page of accounts and appends it to the account list"""
+        # the account window may have been closed in the meantime
+        if not self.accounts_listbox.winfo_exists():
+            return
+        page = self.client.list_accounts_page(
+            self.accounts_search, self.ACCOUNTS_PAGE_SIZE, self.accounts_cursor
+        )
+        if page is None:
+            # stops fetching so a failing server is not asked again on every scroll
+            self.accounts_cursor = None
+            messagebox.showerror("Error", "Fetching more accounts failed.")
+        else:
+            accounts, self.accounts_cursor = page
+            self.insert_accounts(accounts)
+        self.fetching_accounts = False
 
     def create_account_menu(self):
         """Account creation screen."""
@@ -441,13 +489,15 @@ class ChatAppGUI:
         self.unread_messages.clear()
         self.notification_text.delete(1.0, tk.END)
 
-        messages = self.client.read_message()
+        # the latest message comes with the number of messages, so only the messages
+        # the user asks for are downloaded
+        page = self.client.read_message_page(1)
 
-        if messages is None:
+        if page is None:
             messagebox.showerror("Error", "Failed to retrieve messages.")
             return
 
-        total_messages = len(messages)
+        messages, cursor, total_messages = page
         if total_messages == 0:
             messagebox.showinfo("Messages", "No messages.")
             return
@@ -462,6 +512,16 @@ class ChatAppGUI:
 
         if num_to_read is None or num_to_read == 0:
             return  # User canceled input
+
+        # older messages are fetched page by page until there are enough
+        messages = list(messages)
+        while cursor is not None and len(messages) < num_to_read:
+            page = self.client.read_message_page(num_to_read - len(messages), before_id=cursor)
+            if page is None:
+                messagebox.showerror("Error", "Failed to retrieve messages.")
+                return
+            older, cursor, _ = page
+            messages[:0] = older
         # Create a new window for messages
         self.display_messages(messages[-num_to_read:])
 
@@ -555,7 +615,7 @@ class ChatAppGUI:
     def run_server(self):
         """Runs the server."""
         try:
-            server = Server(self.protocol_version)
+            server = self.server_class(self.protocol_version)
             server.handle_client()
 
         except Exception as e:
@@ -564,11 +624,24 @@ class ChatAppGUI:
 
 if __name__ == "__main__":
     # checks to see if the user would like to run with wire protocol or json (non specified defaults to wire protocol)
-    if len(sys.argv) == 2:
+    if len(sys.argv) >= 2:
         protocol_version = sys.argv[1]
     else:
         protocol_version = None
+    # checks to see if the client should compress its frames
+    compression = "compress" in sys.argv[2:]
+    # checks to see if the server should run on an asyncio event loop instead of selectors,
+    # as one worker process per core sharing the port or with one selector loop per core
+    # in threads of the same process
+    if "asyncio" in sys.argv[2:]:
+        server_class = AsyncServer
+    elif "sharded" in sys.argv[2:]:
+        server_class = ShardedServer
+    elif "threaded" in sys.argv[2:]:
+        server_class = ThreadedServer
+    else:
+        server_class = Server
 
     root = tk.Tk()
-    app = ChatAppGUI(root, protocol_version)
+    app = ChatAppGUI(root, protocol_version, compression, server_class)
     root.mainloop()
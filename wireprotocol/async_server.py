@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+from connection import HIGH_WATER, LOW_WATER, Connection
+from protocol_server import Server
+
+
+class ChatProtocol(asyncio.BufferedProtocol):
+    """
+    asyncio protocol of a single client connection, which hands received bytes to the
+    connection's frame decoder and the decoded requests to the server's handlers.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.data = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # the transport takes the place of the socket in the server's handlers
+        self.data = Connection(
+            transport,
+            transport.get_extra_info("peername"),
+            self.server.wire_protocol_receive,
+            self.server.HEADER,
+            self.server.read_buffer,
+        )
+        self.server.connections[transport] = self.data
+        # the transport calls pause_writing and resume_writing at the same water marks
+        # the selectors server uses for its outbound queues
+        transport.set_write_buffer_limits(high=HIGH_WATER, low=LOW_WATER)
+
+    def get_buffer(self, sizehint):
+        # bytes are received straight into the decoder's read buffer or pooled body buffer
+        return self.data.decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        try:
+            requests = self.data.decoder.buffer_updated(nbytes)
+        except ValueError as e:
+            # the header could not be parsed so the stream cannot be split into frames anymore
+            logging.error(f"Invalid frame header from {self.data.addr}: {e}")
+            self.server.close_connection(self.transport, self.data)
+            return
+        self.server.process_requests(self.transport, self.data, requests)
+
+    def pause_writing(self):
+        # stops reading the client's requests until it catches up with the replies
+        self.server.set_backlogged(self.transport, self.data, True)
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.server.set_backlogged(self.transport, self.data, False)
+        self.transport.resume_reading()
+
+    def eof_received(self):
+        # closes the connection once the client stops sending
+        return False
+
+    def connection_lost(self, exc):
+        self.server.close_connection(self.transport, self.data)
+
+
+class AsyncServer(Server):
+    """
+    Server that runs the operation handlers of Server on an asyncio event loop instead of
+    the selectors loop of handle_client. Every client is a ChatProtocol whose transport
+    is used wherever the handlers expect a socket, and replies, including instant
+    deliveries to other clients, are handed to the transport, which sends them without
+    blocking.
+    """
+
+    def __init__(self, protocol_version=None):
+        super().__init__(protocol_version)
+        # connection objects by transport
+        self.connections = {}
+
+    def connection_data(self, sock):
+        """
+        Returns the connection object of a client transport, such as one in active_users.
+
+        sock: The transport object
+        """
+        return self.connections[sock]
+
+    def flush_connection(self, sock, data):
+        """
+        Hands the connection's outbound queue to the transport, which buffers whatever
+        the socket does not accept right away and sends it once it becomes writable.
+
+        sock: The transport object
+        data: The connection object
+
+        Returns: 0 upon success 1 if the connection was lost
+        """
+        if sock.is_closing():
+            self.close_connection(sock, data)
+            return 1
+        sock.writelines(data.outbound)
+        data.outbound.clear()
+        data.outbound_bytes = 0
+        return 0
+
+    def schedule_deliveries(self, sock, data):
+        asyncio.get_running_loop().call_later(self.DELIVERY_WINDOW, self.send_deliveries, sock, data)
+
+    def close_connection(self, sock, data):
+        """
+        Closes the client transport and removes the user from the active users.
+
+        sock: The transport object
+        data: The connection object
+        """
+        if data.closed:
+            return
+        logging.error(f"Closing connection to {data.addr}")
+        data.closed = True
+        self.connections.pop(sock, None)
+        sock.close()
+        self.remove_active_user(sock, data)
+
+    async def serve(self):
+        """
+        Accepts client connections on the asyncio event loop until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(
+            lambda: ChatProtocol(self), os.getenv("HOST"), int(os.getenv("PORT"))
+        )
+        async with server:
+            await server.serve_forever()
+
+    def handle_client(self):
+        """
+        Starts the server on an asyncio event loop and handles client connections.
+        """
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logging.error("Caught keyboard interrupt, exiting")
@@ -0,0 +1,378 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from codec_registry import CODECS, JSON_BACKEND
+from compression import compress_payload, decompress_payload
+from framing import encode_frame
+from message import MessageIds
+from operations import Operations, Version
+from util import hash_password
+
+# the gRPC variant keeps its generated protobuf messages next to its own sources
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gRPC"))
+try:
+    from protos import app_pb2
+except ImportError:
+    app_pb2 = None
+
+FORMAT = "utf-8"
+DEFAULT_SIZES = (1, 10, 100, 1000)
+# minimum time spent timing every encode or decode
+DEFAULT_MIN_TIME = 0.1
+# relative slowdown or growth against the baseline that counts as a regression
+DEFAULT_TOLERANCE = 0.2
+
+USERNAMES = ["alice", "bob", "charlie", "dana", "eve", "frank", "grace", "heidi"]
+PHRASES = [
+    "hey",
+    "how are you doing today?",
+    "sounds good to me, let me know when you are free",
+    "ok talk soon, bye!",
+    "did you see the problem set that was posted this morning? the second question looks long",
+    "running late, be there in 10",
+    "can we move the meeting to tomorrow afternoon instead? something came up at lunch and "
+    "I will not make it back in time, sorry about that",
+]
+
+
+def _messages(count, seed=0):
+    """Builds count message rows with increasing timestamps and IDs between a few users"""
+    rng = random.Random(seed)
+    timestamp = datetime(2026, 2, 11, 9, 0, 0, 123456)
+    ids = MessageIds()
+    rows = []
+    for _ in range(count):
+        sender, receiver = rng.sample(USERNAMES, 2)
+        timestamp += timedelta(seconds=rng.randint(1, 600), microseconds=rng.randint(0, 999999))
+        rows.append(
+            {
+                "sender": sender,
+                "receiver": receiver,
+                "timestamp": str(timestamp),
+                "message": rng.choice(PHRASES),
+                "id": ids.assign(timestamp),
+            }
+        )
+    return rows
+
+
+def _accounts(count):
+    """Builds count LIST_ACCOUNTS result rows"""
+    return [{"username": f"{USERNAMES[i % len(USERNAMES)]}{i}"} for i in range(count)]
+
+
+# (case name, operation, info builder, whether the builder uses the size)
+CASES = [
+    ("login", Operations.LOGIN, lambda n: [{"username": "alice", "password": hash_password("password123")}], False),
+    ("create_account", Operations.CREATE_ACCOUNT, lambda n: [{"username": "alice", "password": hash_password("password123")}], False),
+    ("delete_account", Operations.DELETE_ACCOUNT, lambda n: [{"username": "alice"}], False),
+    ("list_accounts", Operations.LIST_ACCOUNTS, lambda n: [{"search_string": "al"}], False),
+    ("send_message", Operations.SEND_MESSAGE, lambda n: [{"sender": "alice", "receiver": "bob", "message": PHRASES[2]}], False),
+    ("read_message", Operations.READ_MESSAGE, lambda n: [{"username": "alice"}], False),
+    ("delete_message", Operations.DELETE_MESSAGE, lambda n: _messages(1), False),
+    ("success", Operations.SUCCESS, lambda n: [{"message": "Account created"}], False),
+    ("failure", Operations.FAILURE, lambda n: [{"message": "Login failed"}], False),
+    ("deliver_message_now", Operations.DELIVER_MESSAGE_NOW, lambda n: [{"message": f"From alice: {PHRASES[1]}"}], False),
+    ("hello", Operations.HELLO, lambda n: [{"versions": "1,2,3,4,5", "json": "json"}], False),
+    ("accounts_reply", Operations.SUCCESS, _accounts, True),
+    ("messages_reply", Operations.SUCCESS, _messages, True),
+]
+
+
+def build_payloads(sizes=DEFAULT_SIZES):
+    """
+    Generates a realistic data object for every operation.
+
+    Operations that carry a single dictionary are generated once, and the replies
+    that carry a list of accounts or messages are generated once per size.
+
+    Args:
+        sizes: number of rows in the list replies
+
+    Returns:
+        list: (case name, size, data object) tuples, with "version" left to the codec
+    """
+    payloads = []
+    for name, operation, build, scales in CASES:
+        for size in sizes if scales else (1,):
+            payloads.append((name, size, {"type": operation.value, "info": build(size)}))
+    return payloads
+
+
+def _compressed(encode, decoder):
+    """Wraps an encoder and decoder factory so bodies go through the compression envelope"""
+
+    def decoder_with_decompression(data):
+        decode = decoder(data)
+        return lambda body: decode(decompress_payload(body))
+
+    return lambda data: compress_payload(encode(data)), decoder_with_decompression
+
+
+def _protobuf_encode(data):
+    """
+    Builds the app_pb2 message the gRPC variant sends for the same operation.
+    Client requests are a Request with the values in order and server replies are a
+    Response, with message rows as Message entries.
+    """
+    info = data["info"]
+    if data["type"] >= Operations.LOGIN.value:
+        return app_pb2.Request(info=list(info[0].values())).SerializeToString()
+
+    operation = app_pb2.Operation.Value(Operations(data["type"]).name)
+    if info and "timestamp" in info[0]:
+        messages = [app_pb2.Message(**row) for row in info]
+        return app_pb2.Response(operation=operation, messages=messages).SerializeToString()
+    values = [value for row in info for value in row.values()]
+    return app_pb2.Response(operation=operation, info=values).SerializeToString()
+
+
+def _protobuf_supports(data):
+    """Returns False for server operations the gRPC variant has no equivalent of"""
+    return data["type"] >= Operations.LOGIN.value or Operations(data["type"]).name in app_pb2.Operation.keys()
+
+
+def _protobuf_decoder(data):
+    """Returns a decoder for the protobuf message _protobuf_encode builds for data"""
+    if data["type"] >= Operations.LOGIN.value:
+        return lambda body: list(app_pb2.Request.FromString(body).info)
+
+    def decode(body):
+        response = app_pb2.Response.FromString(body)
+        messages = [
+            {
+                "sender": message.sender,
+                "receiver": message.receiver,
+                "timestamp": message.timestamp,
+                "message": message.message,
+                "id": message.id,
+            }
+            for message in response.messages
+        ]
+        return messages + list(response.info)
+
+    return decode
+
+
+def _codecs(compression=False):
+    """
+    Returns the codecs to benchmark by name.
+
+    Each codec is (version, encode, decoder factory), where the decoder factory takes
+    the data object and returns the function that decodes its body.
+    """
+    # every codec in the registry, named after its Version member
+    codecs = {}
+    for version, (encode, decode) in sorted(CODECS.items()):
+        name = next((v.name.lower() for v in Version if v.value == version), f"version_{version}")
+        codecs[name] = (version, encode, lambda data, decode=decode: decode)
+    if compression:
+        for name, (version, encode, decoder) in list(codecs.items()):
+            codecs[f"{name}+zlib"] = (version, *_compressed(encode, decoder))
+    if app_pb2 is not None:
+        codecs["protobuf"] = (None, _protobuf_encode, _protobuf_decoder)
+    return codecs
+
+
+def _time_ops(function, argument, min_time):
+    """
+    Calls function(argument) in growing batches until at least min_time has passed.
+
+    Returns:
+        float: calls per second
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function(argument)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return number / elapsed
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed * 1.2))
+
+
+def _allocations(function, argument):
+    """
+    Traces a single call of function(argument).
+
+    Returns:
+        tuple: the number of memory blocks the call allocated and kept, and the
+        peak memory in bytes it used on top of what was allocated before
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start_size, _ = tracemalloc.get_traced_memory()
+        result = function(argument)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return blocks, peak - start_size
+
+
+def _materialize(decoded):
+    """Touches every decoded row, since the columnar decoder builds rows lazily"""
+    info = decoded["info"] if isinstance(decoded, dict) else decoded
+    return [row for row in info]
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, codec_names=None, min_time=DEFAULT_MIN_TIME, compression=False):
+    """
+    Runs every payload through every codec.
+
+    Args:
+        sizes: number of rows in the list replies
+        codec_names: names of the codecs to run, all of them if None
+        min_time: minimum time spent timing each encode and decode
+        compression: also run every wire codec through the compression envelope
+
+    Returns:
+        list: one result dictionary per codec and payload
+    """
+    codecs = _codecs(compression)
+    results = []
+    for case, size, template in build_payloads(sizes):
+        for name, (version, encode, decoder) in codecs.items():
+            if codec_names and name not in codec_names:
+                continue
+            data = dict(template, version=version or Version.WIRE_PROTOCOL.value)
+            if name == "protobuf" and not _protobuf_supports(data):
+                continue
+            decode = decoder(data)
+            body = encode(data)
+            decode_all = lambda body: _materialize(decode(body))
+
+            encode_blocks, encode_peak = _allocations(encode, data)
+            decode_blocks, decode_peak = _allocations(decode_all, body)
+            results.append(
+                {
+                    "codec": name,
+                    "case": case,
+                    "size": size,
+                    "bytes": len(body),
+                    # gRPC prefixes every message with a 5-byte length header
+                    "framed_bytes": len(encode_frame(body, version)) if version else len(body) + 5,
+                    "encode_ops": _time_ops(encode, data, min_time),
+                    "decode_ops": _time_ops(decode_all, body, min_time),
+                    "encode_blocks": encode_blocks,
+                    "encode_peak": encode_peak,
+                    "decode_blocks": decode_blocks,
+                    "decode_peak": decode_peak,
+                }
+            )
+    return results
+
+
+def print_results(results):
+    """Prints the results as a table"""
+    print(
+        f"{'CASE':<20} {'SIZE':>5} {'CODEC':<18} {'BYTES':>9} {'FRAMED':>9} "
+        f"{'ENCODE OPS/S':>13} {'DECODE OPS/S':>13} {'ENC BLOCKS':>10} {'ENC PEAK':>9} "
+        f"{'DEC BLOCKS':>10} {'DEC PEAK':>9}"
+    )
+    for result in results:
+        print(
+            f"{result['case']:<20} {result['size']:>5} {result['codec']:<18} "
+            f"{result['bytes']:>9} {result['framed_bytes']:>9} "
+            f"{result['encode_ops']:>13,.0f} {result['decode_ops']:>13,.0f} "
+            f"{result['encode_blocks']:>10} {result['encode_peak']:>9} "
+            f"{result['decode_blocks']:>10} {result['decode_peak']:>9}"
+        )
+
+
+def save_baseline(results, path):
+    """
+    Saves the results as a JSON baseline for later comparison.
+
+    Args:
+        results: results from run_benchmarks
+        path: file to write
+    """
+    baseline = {
+        "created": str(datetime.now()),
+        "python": platform.python_version(),
+        "json_backend": JSON_BACKEND,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(path, "w", encoding=FORMAT) as f:
+        json.dump(baseline, f, indent=2)
+    print(f"Saved baseline with {len(results)} results to {path}")
+
+
+def compare_baseline(results, path, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the results with a saved baseline and prints every regression.
+
+    Throughput only counts as regressed when it drops by more than the tolerance,
+    since timings are noisy, while any growth in the encoded size counts.
+
+    Args:
+        results: results from run_benchmarks
+        path: baseline file written by save_baseline
+        tolerance: relative throughput drop that is still accepted
+
+    Returns:
+        list: descriptions of the regressions found
+    """
+    with open(path, encoding=FORMAT) as f:
+        baseline = json.load(f)
+    previous = {(r["codec"], r["case"], r["size"]): r for r in baseline["results"]}
+
+    regressions = []
+    for result in results:
+        old = previous.get((result["codec"], result["case"], result["size"]))
+        if old is None:
+            continue
+        label = f"{result['case']} size {result['size']} {result['codec']}"
+        if result["bytes"] > old["bytes"]:
+            regressions.append(f"{label}: bytes {old['bytes']} -> {result['bytes']}")
+        for key in ("encode_ops", "decode_ops"):
+            if result[key] < old[key] * (1 - tolerance):
+                regressions.append(f"{label}: {key} {old[key]:,.0f} -> {result[key]:,.0f}")
+
+    print(f"Compared {len(results)} results with baseline from {baseline['created']}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the encodings used by the chat app")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="rows in list replies")
+    parser.add_argument("--codecs", nargs="+", help="codecs to run (default: all available)")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="seconds spent per measurement")
+    parser.add_argument("--compress", action="store_true", help="also run the codecs with compression")
+    parser.add_argument("--save", metavar="PATH", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="accepted throughput drop")
+    args = parser.parse_args(argv)
+
+    if app_pb2 is None:
+        print("protobuf is not installed, skipping the protobuf codec")
+    print(f"JSON backend: {JSON_BACKEND}")
+
+    results = run_benchmarks(args.sizes, args.codecs, args.min_time, args.compress)
+    print_results(results)
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        return 1 if compare_baseline(results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
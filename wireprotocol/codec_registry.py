@@ -0,0 +1,110 @@
+import json
+import logging
+from framing import COMPACT_VERSIONS
+from operations import Version
+from schema_protocol import (
+    packing_schema,
+    unpacking_schema,
+    packing_columnar,
+    unpacking_columnar,
+)
+from wire_protocol import packing, unpacking
+
+FORMAT = "utf-8"
+
+# encode and decode functions of every protocol version, keyed by the version byte
+CODECS = {}
+
+# orjson is several times faster than the standard library and produces the same JSON
+# values, so peers using either backend can talk to each other
+try:
+    import orjson
+
+    JSON_BACKEND = "orjson"
+
+    def json_dumps(data):
+        return orjson.dumps(data)
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+except ImportError:
+    JSON_BACKEND = "json"
+
+    def json_dumps(data):
+        return json.dumps(data).encode(FORMAT)
+
+    def json_loads(data):
+        # the json module does not read memoryviews of pooled frame buffers
+        return json.loads(bytes(data))
+
+
+def register_codec(version, encode, decode, compact_framing=True):
+    """
+    Registers the functions that serialize a protocol version, so that the client and
+    the server can send and receive it without knowing about it.
+
+    Args:
+        version: the version byte at the start of every body of this version
+        encode: function taking a data object and an optional scratch bytearray and
+            returning the serialized body, starting with the version byte
+        decode: function taking a serialized body and returning the data object
+        compact_framing: send bodies of this version behind the 4-byte length header
+            instead of the 64-byte ASCII header
+    """
+    CODECS[version] = (encode, decode)
+    if compact_framing:
+        COMPACT_VERSIONS.add(version)
+
+
+def supported_versions():
+    """Returns the registered protocol versions in order"""
+    return sorted(CODECS)
+
+
+def encode(data, buffer=None):
+    """
+    Serializes a data object with the codec of its version.
+
+    Args:
+        data: the data object, whose "version" selects the codec
+        buffer: optional bytearray reused as scratch space between frames
+
+    Returns:
+        bytes: the serialized body
+    """
+    encode_function, _ = CODECS[data["version"]]
+    return encode_function(data, buffer)
+
+
+def decode(body):
+    """
+    Deserializes a body with the codec of the version in its first byte.
+
+    Args:
+        body: the serialized body
+
+    Returns:
+        dict: the data object, or None if the version is unknown
+    """
+    version = str(body[0:1], FORMAT)
+    codec = CODECS.get(version)
+    if codec is None:
+        logging.error(f"Unknown protocol indicator: {version}")
+        return None
+    return codec[1](body)
+
+
+def _json_encode(data, buffer=None):
+    return data["version"].encode(FORMAT) + json_dumps(data)
+
+
+def _json_decode(body):
+    return json_loads(body[1:])
+
+
+register_codec(Version.WIRE_PROTOCOL.value, packing, unpacking, compact_framing=False)
+register_codec(Version.JSON.value, _json_encode, _json_decode, compact_framing=False)
+register_codec(Version.COMPACT.value, packing, unpacking)
+register_codec(Version.SCHEMA.value, packing_schema, unpacking_schema)
+register_codec(Version.COLUMNAR.value, packing_columnar, unpacking_columnar)
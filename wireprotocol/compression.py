@@ -0,0 +1,97 @@
+import zlib
+from framing import MAX_FRAME_SIZE
+
+FORMAT = "utf-8"
+
+# first byte of a compressed frame body, which never collides with a version byte
+COMPRESSION_FLAG = b"Z"
+# second byte of a compressed frame body
+STORED = 0
+DEFLATED = 1
+
+# frame bodies smaller than this are sent stored, since deflate would not shrink them
+COMPRESSION_THRESHOLD = 256
+
+# preset dictionary shared by both sides. zlib matches against it as if it had been sent
+# right before every frame, so even small frames compress. Strings that are most likely
+# to appear are placed last, where they are cheapest to reference.
+ZDICT = "".join(
+    [
+        "how are you doing today? I am good thanks, what about you? see you later tonight ",
+        "sounds good to me, let me know when you are free. ok talk soon, bye! ",
+        "hello hey hi there yes no maybe tomorrow morning afternoon lunch dinner meeting ",
+        '{"version": "2", "type": "00", "info": [{"message": "',
+        '{"sender": "", "receiver": "", "timestamp": "", "message": ""}, ',
+        '{"username": ""}, {"username": "',
+        "Account created",
+        "deleted message successfully",
+        "Deletion successful",
+        "message from  has been sent to ",
+        "From : ",
+        "\x00\x00\x00\x08username\x00\x00\x00",
+        "\x00\x00\x00\x07message\x00\x00\x00",
+        "\x00\x00\x00\x08receiver\x00\x00\x00",
+        "\x00\x00\x00\x06sender\x00\x00\x00",
+        "\x00\x00\x00\x09timestamp\x00\x00\x00\x1a20",
+    ]
+).encode(FORMAT)
+
+
+def compress_payload(body, threshold=COMPRESSION_THRESHOLD):
+    """
+    Wraps a serialized frame body in the compression envelope.
+    Format:
+    - flag: [1 byte] ("Z")
+    - method: [1 byte] (0 for stored, 1 for deflate with ZDICT)
+    - payload: the body itself or its raw deflate stream
+
+    Bodies under the threshold, or that deflate would make larger, are stored so
+    the peer still sees that this side understands compressed frames.
+
+    Args:
+        body: the serialized frame body
+        threshold: smallest body size that is worth deflating
+
+    Returns:
+        bytes: the wrapped body
+    """
+    if len(body) >= threshold:
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=ZDICT
+        )
+        deflated = compressor.compress(body) + compressor.flush()
+        if len(deflated) < len(body):
+            return COMPRESSION_FLAG + bytes([DEFLATED]) + deflated
+    return COMPRESSION_FLAG + bytes([STORED]) + body
+
+
+def decompress_payload(data, max_size=MAX_FRAME_SIZE):
+    """
+    Unwraps a frame body produced by compress_payload.
+
+    Args:
+        data: the received frame body, starting with the compression flag
+        max_size: largest body the payload may inflate to, so a small frame cannot
+            expand into gigabytes
+
+    Returns:
+        bytes: the original serialized frame body
+
+    Raises:
+        ValueError: if the method is unknown or the body would be larger than max_size
+    """
+    method = data[1]
+    if method == STORED:
+        return bytes(data[2:])
+    if method == DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=ZDICT)
+        body = decompressor.decompress(data[2:], max_size + 1)
+        if decompressor.unconsumed_tail or len(body) > max_size:
+            raise ValueError(f"compressed frame inflates to more than {max_size} bytes")
+        return body + decompressor.flush()
+    raise ValueError(f"Unknown compression method: {method}")
+
+
+def is_compressed(data):
+    """Returns True if the frame body is wrapped by compress_payload."""
+    return data[0:1] == COMPRESSION_FLAG
@@ -0,0 +1,132 @@
+import os
+from collections import deque
+from itertools import islice
+from framing import FrameDecoder
+
+# most buffers a single sendmsg call accepts
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+# a connection with this many unsent bytes queued is backlogged: the server stops
+# reading its requests and stores messages for its user as unread instead of delivering
+# them instantly, until the queue drains to LOW_WATER bytes
+HIGH_WATER = 1024 * 1024
+LOW_WATER = 256 * 1024
+
+
+def send_buffers(sock, buffers):
+    """
+    Sends the leading buffers of a queue with a single scatter/gather write and drops
+    whatever was sent from the queue, so a partial send resumes where it stopped.
+
+    Args:
+        sock: the socket to send on
+        buffers: deque of memoryviews to send in order
+
+    Returns:
+        int: the number of bytes sent
+
+    Raises:
+        BlockingIOError: if the socket cannot accept any bytes right now
+    """
+    if hasattr(sock, "sendmsg"):
+        sent = sock.sendmsg(list(islice(buffers, IOV_MAX)))
+    else:
+        sent = sock.send(buffers[0])
+
+    remaining = sent
+    while remaining:
+        head = buffers[0]
+        if remaining >= len(head):
+            remaining -= len(head)
+            buffers.popleft()
+        else:
+            # slicing the memoryview keeps the unsent rest without copying it
+            buffers[0] = head[remaining:]
+            remaining = 0
+    return sent
+
+
+class Connection:
+    """
+    State of a single client connection on the server.
+
+    The socket is never blocked on: received bytes are fed to the frame decoder, which
+    keeps partially received requests, and replies are appended to the outbound queue,
+    which is sent as far as the socket accepts and finished on later write events.
+    """
+
+    def __init__(self, sock, addr, decode, header_size, read_buffer=None, pool=None):
+        """
+        Args:
+            sock: the non-blocking client socket
+            addr: the address of the client
+            decode: callable turning a frame body into a data object
+            header_size: size of the ASCII length header used by versions "1" and "2"
+            read_buffer: bytearray shared by the connections of a server that received
+                bytes are read into before they are decoded
+            pool: BufferPool large bodies are received into, shared by the connections
+                of a thread
+        """
+        self.sock = sock
+        self.addr = addr
+        # data object of the reply that is waiting to be serialized
+        self.outb = None
+        # instantly delivered messages collected until the delivery window passes
+        self.deliveries = []
+        # scratch buffer reused when encoding replies
+        self.scratch = bytearray()
+        # inbound bytes and the parse state of the request being received
+        self.decoder = FrameDecoder(decode, header_size, read_buffer, pool)
+        # headers and bodies of replies that have not been fully sent yet and their size
+        self.outbound = deque()
+        self.outbound_bytes = 0
+        # replies are compressed once the client sent a compressed request
+        self.compression = False
+        # whether the socket is registered for write events, which is only the case
+        # while the outbound queue is not empty, and for read events, which is the case
+        # unless the connection is backlogged
+        self.write_interest = False
+        self.read_interest = True
+        self.backlogged = False
+        self.closed = False
+        # username logged in on this connection, the reverse of the server's active_users
+        self.username = None
+
+    def queue(self, *buffers):
+        """
+        Appends the buffers of a reply, usually its header and body, to the outbound queue.
+
+        Args:
+            buffers: the bytes to send in order
+        """
+        for buffer in buffers:
+            if buffer:
+                self.outbound.append(memoryview(buffer))
+                self.outbound_bytes += len(buffer)
+
+    def flush(self):
+        """
+        Sends as much of the outbound queue as the socket accepts without blocking.
+
+        Returns:
+            bool: True if the outbound queue is empty afterwards
+
+        Raises:
+            OSError: if the connection was lost
+        """
+        while self.outbound:
+            try:
+                self.outbound_bytes -= send_buffers(self.sock, self.outbound)
+            except BlockingIOError:
+                return False
+        return True
+
+    def over_water_mark(self):
+        """
+        Returns whether the connection should be backlogged, which starts once HIGH_WATER
+        bytes are queued and ends once the queue drains to LOW_WATER, so that the state
+        does not flip back and forth around a single limit.
+        """
+        if self.backlogged:
+            return self.outbound_bytes > LOW_WATER
+        return self.outbound_bytes >= HIGH_WATER
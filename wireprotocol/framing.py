@@ -0,0 +1,333 @@
+import logging
+import struct
+from operations import Version
+
+FORMAT = "utf-8"
+HEADER = 64
+
+# versions whose frames use the compact 4-byte big-endian length prefix, which codecs
+# registered in codec_registry are added to
+COMPACT_VERSIONS = {Version.COMPACT.value, Version.SCHEMA.value, Version.COLUMNAR.value}
+COMPACT_HEADER = struct.Struct(">I")
+# an ASCII header always starts with a digit, so compact lengths are capped to keep
+# the first byte below b"0" and the two framings distinguishable on the wire
+MAX_COMPACT_FRAME_SIZE = 0x30000000 - 1
+DIGITS = b"0123456789"
+# largest body a decoder accepts, so a header cannot make a peer buffer without limit
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# most bytes read from a socket at once
+RECV_SIZE = 65536
+# bodies at least this large are received straight into a pooled buffer
+LARGE_FRAME_SIZE = 65536
+# number and largest size of the buffers kept in the pool for reuse
+POOL_BUFFERS = 4
+MAX_POOLED_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def encode_header(body_length, version, header_size=HEADER):
+    """
+    Builds the length header that is sent in front of a frame body.
+
+    Args:
+        body_length: size of the serialized frame body in bytes
+        version: the protocol version of the body, which decides the framing
+        header_size: size of the ASCII length header for the older versions
+
+    Returns:
+        bytes: the header
+    """
+    if version in COMPACT_VERSIONS:
+        if body_length > MAX_COMPACT_FRAME_SIZE:
+            raise ValueError(f"frame of {body_length} bytes is too large")
+        return COMPACT_HEADER.pack(body_length)
+    return f"{body_length:<{header_size}}".encode(FORMAT)
+
+
+def encode_frame(body, version, header_size=HEADER):
+    """
+    Prepends the length header to a frame body so it can be sent in a single write.
+
+    Args:
+        body: the serialized frame body
+        version: the protocol version of the body, which decides the framing
+        header_size: size of the ASCII length header for the older versions
+
+    Returns:
+        bytes: the header followed by the body
+    """
+    return encode_header(len(body), version, header_size) + body
+
+
+class BufferPool:
+    """
+    Small pool of reusable bytearrays that large frame bodies are received into.
+
+    Buffers are handed out in power-of-two sizes so a buffer released after one large
+    frame can be reused for the next one of a similar size instead of allocating again.
+    """
+
+    def __init__(self, max_buffers=POOL_BUFFERS, max_buffer_size=MAX_POOLED_BUFFER_SIZE):
+        """
+        Args:
+            max_buffers: number of released buffers kept for reuse
+            max_buffer_size: largest buffer kept for reuse, larger ones are freed
+        """
+        self.max_buffers = max_buffers
+        self.max_buffer_size = max_buffer_size
+        self.buffers = []
+
+    def acquire(self, size):
+        """
+        Returns a buffer of at least size bytes, reusing a released one if possible.
+
+        Args:
+            size: the number of bytes needed
+
+        Returns:
+            bytearray: a buffer whose contents are undefined
+        """
+        for index, buffer in enumerate(self.buffers):
+            if len(buffer) >= size:
+                return self.buffers.pop(index)
+        return bytearray(max(LARGE_FRAME_SIZE, 1 << (size - 1).bit_length()))
+
+    def release(self, buffer):
+        """
+        Gives a buffer back to the pool once nothing refers to its contents anymore.
+
+        Args:
+            buffer: a buffer returned by acquire
+        """
+        if len(self.buffers) < self.max_buffers and len(buffer) <= self.max_buffer_size:
+            self.buffers.append(buffer)
+
+
+# pool shared by the frame decoders of a process
+BUFFER_POOL = BufferPool()
+
+
+class FrameDecoder:
+    """
+    Resumable decoder for the length-prefixed frames sent between client and server.
+
+    Bytes can be fed in arbitrary chunks as they arrive from a non-blocking socket.
+    Every frame that has been fully received is decoded and returned, and any
+    partial header or body is kept until the rest of it arrives. The framing of
+    each frame is detected from its first byte: an ASCII digit starts the 64-byte
+    header of versions "1" and "2", anything else the compact 4-byte header.
+
+    Bodies of at least LARGE_FRAME_SIZE bytes are collected in a buffer from the pool,
+    and receive reads the rest of such a body straight into that buffer, so large
+    mailboxes are not copied chunk by chunk. The buffer grows with the bytes that
+    arrive rather than being sized by the header, and a header declaring more than
+    max_frame_size bytes is rejected, so a few bytes cannot make the decoder allocate
+    a huge buffer.
+    """
+
+    def __init__(self, decode=None, header_size=HEADER, read_buffer=None, pool=None, max_frame_size=MAX_FRAME_SIZE):
+        """
+        Args:
+            decode: callable turning a frame body into a data object (raw bytes if None)
+            header_size: size of the ASCII length header used by versions "1" and "2"
+            read_buffer: preallocated bytearray receive reads into while no large body is
+                pending, which decoders used from the same thread can share since its
+                contents are consumed before receive returns (a new one of RECV_SIZE
+                bytes if None)
+            pool: the BufferPool large bodies are received into (BUFFER_POOL if None)
+            max_frame_size: largest body length a header may declare
+        """
+        self.decode = decode
+        self.header_size = header_size
+        self.max_frame_size = min(max_frame_size, MAX_COMPACT_FRAME_SIZE)
+        self.pool = pool if pool is not None else BUFFER_POOL
+        self.read_buffer = read_buffer if read_buffer is not None else bytearray(RECV_SIZE)
+        self.buffer = bytearray()
+        # read position in buffer, compacted once per feed
+        self.pos = 0
+        # body length of the frame being received, None while waiting for a header
+        self.body_length = None
+        # pooled buffer of the large body being received and how much of it is filled
+        self.body = None
+        self.filled = 0
+
+    def receive(self, sock):
+        """
+        Reads whatever is available from the socket with recv_into and decodes every
+        frame it completes.
+
+        Args:
+            sock: the socket to read from
+
+        Returns:
+            list: decoded frames as returned by feed, or None if the peer closed the
+            connection
+
+        Raises:
+            BlockingIOError: if nothing can be read from a non-blocking socket
+            ValueError: if a header is not a valid length or declares a body larger
+            than max_frame_size
+        """
+        with self.get_buffer() as buffer:
+            received = sock.recv_into(buffer)
+        if not received:
+            return None
+        return self.buffer_updated(received)
+
+    def get_buffer(self):
+        """
+        Returns the writable memoryview the next received bytes should be placed in:
+        the rest of a pending large body, or the read buffer otherwise.
+        """
+        if self.body is not None:
+            if self.filled == len(self.body):
+                self.grow_body(self.filled + 1)
+            return memoryview(self.body)[self.filled : min(len(self.body), self.body_length)]
+        return memoryview(self.read_buffer)
+
+    def buffer_updated(self, received):
+        """
+        Decodes the frames completed by bytes placed in the buffer from get_buffer.
+
+        Args:
+            received: the number of bytes placed at the start of the buffer
+
+        Returns:
+            list: decoded frames as returned by feed
+        """
+        if self.body is not None:
+            self.filled += received
+            return [self.finish_body()] if self.filled == self.body_length else []
+        with memoryview(self.read_buffer) as view:
+            return self.feed(view[:received])
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of received bytes and decodes every frame it completes.
+
+        Args:
+            chunk: bytes received from the socket
+
+        Returns:
+            list: decoded frames in the order they were received; a frame whose
+            body cannot be decoded is returned as None
+
+        Raises:
+            ValueError: if a header is not a valid length or declares a body larger
+            than max_frame_size, since the stream can no longer be split into frames
+        """
+        frames = []
+
+        # the start of the chunk may complete a large body that is being received
+        if self.body is not None:
+            needed = min(self.body_length - self.filled, len(chunk))
+            self.grow_body(self.filled + needed)
+            self.body[self.filled : self.filled + needed] = chunk[:needed]
+            self.filled += needed
+            if self.filled < self.body_length:
+                return frames
+            frames.append(self.finish_body())
+            chunk = chunk[needed:]
+
+        self.buffer += chunk
+
+        while True:
+            available = len(self.buffer) - self.pos
+
+            # waiting for the header with the length of the next body
+            if self.body_length is None:
+                if not available:
+                    break
+                if self.buffer[self.pos] in DIGITS:
+                    if available < self.header_size:
+                        break
+                    header = self.buffer[self.pos : self.pos + self.header_size]
+                    self.body_length = int(header.decode(FORMAT))
+                    self.pos += self.header_size
+                else:
+                    if available < COMPACT_HEADER.size:
+                        break
+                    (self.body_length,) = COMPACT_HEADER.unpack_from(self.buffer, self.pos)
+                    self.pos += COMPACT_HEADER.size
+                if self.body_length > self.max_frame_size:
+                    raise ValueError(f"frame of {self.body_length} bytes is too large")
+                continue
+
+            # large bodies move to a pooled buffer that the rest is received into
+            if self.body_length >= LARGE_FRAME_SIZE:
+                self.filled = min(available, self.body_length)
+                self.body = self.pool.acquire(max(self.filled, LARGE_FRAME_SIZE))
+                self.body[: self.filled] = self.buffer[self.pos : self.pos + self.filled]
+                self.pos += self.filled
+                if self.filled < self.body_length:
+                    break
+                frames.append(self.finish_body())
+                continue
+
+            # waiting for the rest of the body
+            if available < self.body_length:
+                break
+
+            with memoryview(self.buffer) as view:
+                body = bytes(view[self.pos : self.pos + self.body_length])
+            self.pos += self.body_length
+            self.body_length = None
+            frames.append(self.decode_body(body))
+
+        # drop the consumed bytes once per chunk instead of once per frame
+        if self.pos:
+            del self.buffer[: self.pos]
+            self.pos = 0
+
+        return frames
+
+    def grow_body(self, size):
+        """
+        Moves the large body being received to a pooled buffer of at least size bytes,
+        at least doubling it so a body is copied a logarithmic number of times.
+
+        Args:
+            size: the number of bytes the buffer must hold, at most the body length
+        """
+        if len(self.body) >= size:
+            return
+        body = self.pool.acquire(min(self.body_length, max(size, 2 * len(self.body))))
+        body[: self.filled] = self.body[: self.filled]
+        self.pool.release(self.body)
+        self.body = body
+
+    def finish_body(self):
+        """
+        Decodes the completed large body and gives its buffer back to the pool.
+
+        Returns:
+            the decoded data object, or None on failure
+        """
+        body, length = self.body, self.body_length
+        self.body = None
+        self.body_length = None
+        self.filled = 0
+        with memoryview(body) as view:
+            frame = self.decode_body(view[:length])
+        self.pool.release(body)
+        return frame
+
+    def decode_body(self, body):
+        """
+        Decodes a single frame body, returning None if it is malformed. Large bodies are
+        passed as a memoryview into a pooled buffer that is reused afterwards, so decode
+        functions must not keep references to it.
+
+        Args:
+            body: the bytes of one complete frame body
+
+        Returns:
+            the decoded data object, or None on failure
+        """
+        if self.decode is None:
+            return bytes(body)
+        try:
+            return self.decode(body)
+        except Exception as e:
+            logging.error(f"Error decoding frame: {e}")
+            return None
@@ -0,0 +1,89 @@
+import argparse
+import contextlib
+import io
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from codec_registry import encode
+from framing import encode_frame
+from operations import Operations, Version
+from protocol_server import Server
+
+DEFAULT_CLIENTS = 200
+# seconds over which the CPU time of the idle server is measured
+DEFAULT_DURATION = 5.0
+
+
+def _free_port():
+    """Returns a TCP port that is currently free on the loopback interface"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _connect(address):
+    """Connects to the server, waiting for it to start listening"""
+    for _ in range(100):
+        try:
+            return socket.create_connection(address)
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    return socket.create_connection(address)
+
+
+def measure_idle_cpu(clients=DEFAULT_CLIENTS, duration=DEFAULT_DURATION):
+    """
+    Starts a server in this process, connects clients that never send anything and
+    measures how much CPU time the process uses while they are idle.
+
+    Args:
+        clients: number of idle connections
+        duration: seconds to measure for
+
+    Returns:
+        float: CPU seconds used per wall-clock second, where 1.0 is a full core
+    """
+    os.environ["HOST"] = "127.0.0.1"
+    os.environ["PORT"] = str(_free_port())
+    server = Server()
+    # the server prints every reply it sends, which is not part of the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=server.handle_client, daemon=True).start()
+
+        address = (os.environ["HOST"], int(os.environ["PORT"]))
+        sockets = [_connect(address) for _ in range(clients)]
+        # waits until the server has accepted every client and answered its HELLO
+        hello = {"version": Version.COMPACT.value, "type": Operations.HELLO.value, "info": [{}]}
+        for sock in sockets:
+            sock.sendall(encode_frame(encode(hello), Version.COMPACT.value))
+            sock.recv(4096)
+
+    # the server logs every connection that is closed at the end
+    logging.disable(logging.ERROR)
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    time.sleep(duration)
+    cpu = time.process_time() - start_cpu
+    elapsed = time.perf_counter() - start
+
+    for sock in sockets:
+        sock.close()
+    return cpu / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the CPU used by a server with idle clients")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS, help="number of idle connections")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds to measure for")
+    args = parser.parse_args(argv)
+
+    usage = measure_idle_cpu(args.clients, args.duration)
+    print(f"IDLE CLIENTS: {args.clients} CPU: {usage * 100:.1f}% of a core over {args.duration:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from codec_registry import decode, encode
+from framing import FrameDecoder, encode_frame
+from operations import Operations, Version
+
+HOST = "127.0.0.1"
+SERVERS = {
+    "selectors": "from protocol_server import Server",
+    "asyncio": "from async_server import AsyncServer as Server",
+    "sharded": "from sharded_server import ShardedServer as Server",
+    "threaded": "from threaded_server import ThreadedServer as Server",
+}
+DEFAULT_CLIENTS = 5000
+DEFAULT_REQUESTS = 20
+DEFAULT_PROCESSES = 4
+# most connections a client process opens at the same time during setup
+CONNECT_CONCURRENCY = 100
+
+
+def _free_port():
+    """Returns a TCP port that is currently free on the loopback interface"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, version, port):
+    """
+    Starts a server of the given kind in a separate process, so that the load
+    generating clients do not compete with it for the interpreter.
+
+    Args:
+        kind: "selectors" for Server.handle_client, "asyncio" for AsyncServer,
+            "sharded" for ShardedServer or "threaded" for ThreadedServer
+        version: protocol version the server replies with
+        port: port to listen on
+
+    Returns:
+        subprocess.Popen: the server process, once it accepts connections
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    code = f"import sys; sys.path.insert(0, {directory!r}); {SERVERS[kind]}; Server({version!r}).handle_client()"
+    env = dict(os.environ, HOST=HOST, PORT=str(port))
+    # the server prints every reply and logs every closed connection, which goes nowhere here
+    # the server runs in its own process group so that stop_server also stops its workers
+    process = subprocess.Popen(
+        [sys.executable, "-c", code],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    for _ in range(200):
+        try:
+            socket.create_connection((HOST, port)).close()
+            return process
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    stop_server(process)
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def stop_server(process):
+    """Kills a server started by start_server along with any worker processes it started"""
+    os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+
+
+class LoadClient:
+    """A client that sends requests over asyncio streams and times every round trip"""
+
+    def __init__(self, index, version):
+        self.username = f"load{index}"
+        self.version = version
+        self.decoder = FrameDecoder(decode)
+        self.frames = []
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection(HOST, port)
+
+    async def request(self, operation, info):
+        """
+        Sends a request and waits for its response, skipping messages delivered
+        instantly by the server.
+
+        Returns:
+            dict: the response
+        """
+        data = {"version": self.version, "type": operation, "info": [info]}
+        self.writer.write(encode_frame(encode(data), self.version))
+        while True:
+            while self.frames:
+                frame = self.frames.pop(0)
+                if frame["type"] != Operations.DELIVER_MESSAGE_NOW.value:
+                    return frame
+            chunk = await self.reader.read(65536)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            self.frames += self.decoder.feed(chunk)
+
+    def close(self):
+        self.writer.close()
+
+
+async def _run_clients(indexes, clients, requests, version, port, barrier):
+    """
+    Connects and logs in the clients of one process, waits for every process to be
+    ready and then sends the timed requests.
+
+    Returns:
+        list: the round trip latency of every timed request in seconds
+    """
+    connect_limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def setup(index):
+        client = LoadClient(index, version)
+        async with connect_limit:
+            await client.connect(port)
+            await client.request(Operations.CREATE_ACCOUNT.value, {"username": client.username, "password": "password"})
+            await client.request(Operations.LOGIN.value, {"username": client.username, "password": "password"})
+        return client
+
+    load_clients = await asyncio.gather(*(setup(index) for index in indexes))
+    await asyncio.to_thread(barrier.wait)
+
+    async def run(client, index):
+        latencies = []
+        receiver = f"load{(index + 1) % clients}"
+        for i in range(requests):
+            start = time.perf_counter()
+            await client.request(
+                Operations.SEND_MESSAGE.value,
+                {"sender": client.username, "receiver": receiver, "message": f"load test message {i}"},
+            )
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    results = await asyncio.gather(*(run(client, index) for client, index in zip(load_clients, indexes)))
+    for client in load_clients:
+        client.close()
+    return [latency for latencies in results for latency in latencies]
+
+
+def _client_process(indexes, clients, requests, version, port, barrier, results):
+    results.put(asyncio.run(_run_clients(indexes, clients, requests, version, port, barrier)))
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_load(kind, clients=DEFAULT_CLIENTS, requests=DEFAULT_REQUESTS, processes=DEFAULT_PROCESSES, version=None):
+    """
+    Runs the load against a fresh server of the given kind.
+
+    Args:
+        kind: "selectors", "asyncio", "sharded" or "threaded"
+        clients: number of concurrent clients
+        requests: SEND_MESSAGE requests per client, sent one after another
+        processes: number of processes the clients are spread over
+        version: protocol version of the requests and replies
+
+    Returns:
+        dict: throughput in requests per second and latency percentiles in milliseconds
+    """
+    version = version or Version.COMPACT.value
+    port = _free_port()
+    server = start_server(kind, version, port)
+    try:
+        barrier = multiprocessing.Barrier(processes + 1)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=_client_process,
+                args=(range(i, clients, processes), clients, requests, version, port, barrier, results),
+            )
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        # every client is connected and logged in once the barrier opens
+        barrier.wait()
+        start = time.perf_counter()
+        latencies = []
+        for _ in workers:
+            latencies += results.get()
+        elapsed = time.perf_counter() - start
+        for worker in workers:
+            worker.join()
+    finally:
+        stop_server(server)
+
+    latencies.sort()
+    return {
+        "server": kind,
+        "clients": clients,
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": _percentile(latencies, 0.5) * 1000,
+        "p99": _percentile(latencies, 0.99) * 1000,
+        "p999": _percentile(latencies, 0.999) * 1000,
+        "max": latencies[-1] * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the selectors, asyncio, sharded and threaded servers under load")
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVERS), default=list(SERVERS))
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS, help="number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="requests per client")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help="client processes")
+    parser.add_argument("--version", default=Version.COMPACT.value, help="protocol version")
+    args = parser.parse_args(argv)
+
+    print(f"{'SERVER':<10} {'CLIENTS':>7} {'REQUESTS':>9} {'REQ/S':>9} {'P50 MS':>8} {'P99 MS':>8} {'P99.9 MS':>9} {'MAX MS':>8}")
+    for kind in args.servers:
+        result = run_load(kind, args.clients, args.requests, args.processes, args.version)
+        print(
+            f"{result['server']:<10} {result['clients']:>7} {result['requests']:>9} {result['throughput']:>9,.0f} "
+            f"{result['p50']:>8.2f} {result['p99']:>8.2f} {result['p999']:>9.2f} {result['max']:>8.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
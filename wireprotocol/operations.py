@@ -5,6 +5,9 @@ class Operations(Enum):
     SUCCESS = "00"
     FAILURE = "01"
     DELIVER_MESSAGE_NOW = "02"
+    # sent by a client to ask which versions the server can decode, and sent back by the
+    # server in reply with those versions; the server never sends it unasked
+    HELLO = "03"
 
     # client-side operations
     LOGIN = "10"
@@ -18,12 +21,27 @@ class Operations(Enum):
 class Version(Enum): 
     WIRE_PROTOCOL = "1"
     JSON = "2"
+    # wire protocol body behind a 4-byte length prefix instead of the 64-byte ASCII header
+    COMPACT = "3"
+    # compact framing with known fields encoded by their ID in OperationSchemas
+    SCHEMA = "4"
+    # schema encoding with message lists sent column by column
+    COLUMNAR = "5"
+
+VersionNames = {
+    Version.WIRE_PROTOCOL.value: "WIRE PROTOCOL",
+    Version.JSON.value: "JSON",
+    Version.COMPACT.value: "COMPACT WIRE PROTOCOL",
+    Version.SCHEMA.value: "SCHEMA WIRE PROTOCOL",
+    Version.COLUMNAR.value: "COLUMNAR WIRE PROTOCOL",
+}
 
 OperationNames = {
     # server-side operations
     Operations.SUCCESS.value: "Success",
     Operations.FAILURE.value: "Failure", 
     Operations.DELIVER_MESSAGE_NOW.value: "Deliver Message Now",
+    Operations.HELLO.value: "Hello",
 
     # client-side operations
     Operations.LOGIN.value: "Login",
@@ -34,3 +52,23 @@ OperationNames = {
     Operations.READ_MESSAGE.value: "Read Message",
     Operations.DELETE_MESSAGE.value: "Delete Message"
 }
+
+# fields of the info dictionaries sent with each operation, where a field's position is its ID
+# in the schema wire protocol. Fields may only be appended so that older peers keep decoding
+# the IDs they know, and keys missing from a schema fall back to the key/value encoding.
+OperationSchemas = {
+    # server-side operations
+    Operations.SUCCESS.value: ("message", "username", "sender", "receiver", "timestamp", "id", "cursor", "total"),
+    Operations.FAILURE.value: ("message",),
+    Operations.DELIVER_MESSAGE_NOW.value: ("message",),
+    Operations.HELLO.value: ("versions", "json"),
+
+    # client-side operations
+    Operations.LOGIN.value: ("username", "password"),
+    Operations.CREATE_ACCOUNT.value: ("username", "password"),
+    Operations.DELETE_ACCOUNT.value: ("username",),
+    Operations.LIST_ACCOUNTS.value: ("search_string", "limit", "after"),
+    Operations.SEND_MESSAGE.value: ("sender", "receiver", "message"),
+    Operations.READ_MESSAGE.value: ("username", "limit", "before_id", "since_id"),
+    Operations.DELETE_MESSAGE.value: ("sender", "receiver", "timestamp", "message", "id"),
+}
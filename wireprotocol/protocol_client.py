@@ -1,14 +1,18 @@
 import socket
+import select
 import types
+from collections import deque
 from consolemenu import *
 from consolemenu.items import *
 import os
-from wire_protocol import packing, unpacking
-from operations import Operations, OperationNames, Version
+from codec_registry import decode, encode, supported_versions, JSON_BACKEND
+from compression import compress_payload, decompress_payload, is_compressed
+from connection import send_buffers
+from framing import FrameDecoder, encode_header
+from operations import Operations, OperationNames, Version, VersionNames
 from util import hash_password
 import threading
 import logging
-import json
 from dotenv import load_dotenv
 
 
@@ -16,29 +20,48 @@ class Client:
     # global variables consistent across all instances of the Client class
     FORMAT = "utf-8"
     HEADER = 64
+    # maximum number of bytes read from the socket per recv call
+    RECV_SIZE = 65536
+    # seconds to wait on the socket before checking for a queued response again
+    POLL_INTERVAL = 0.1
 
     # polling thread to handle incoming messages from the server
     CLIENT_LOCK = threading.Lock()
 
 
-    def __init__(self, conn_id, sel, protocol_version=None):
+    def __init__(self, conn_id, sel, protocol_version=None, compression=False):
         load_dotenv()
         self.host = os.getenv("HOST")
         self.port = int(os.getenv("PORT"))
         # client socket to connect to the server for this specific client
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_socket.setblocking(False)
+        # requests are written in a single call, so Nagle's algorithm would only delay them
+        self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.conn_id = conn_id
         self.data = types.SimpleNamespace(connid=self.conn_id, outb=b"")
+        # scratch buffer reused by the wire protocol encoder between requests
+        self.scratch = bytearray()
+        # frame decoder that buffers partially received frames from the server
+        self.decoder = FrameDecoder(self.wire_protocol_receive, self.HEADER, bytearray(self.RECV_SIZE))
+        # decoded responses to requests and messages delivered instantly by the server
+        self.responses = deque()
+        self.delivered_messages = deque()
         # shared selector to register the client socket with the server
         self.sel = sel
 
+        # protocol versions the server advertised in reply to hello
+        self.server_versions = []
+
         # username of the current client
         self.username = ""
 
         # feedin the protocol version to the client if provided 
         self.protocol_version = protocol_version if protocol_version else Version.WIRE_PROTOCOL.value       
 
+        # compresses requests, which also tells the server to compress its replies
+        self.compression = compression
+
     def create_data_object(self, version, operation, info):
         """
         Creates a data object with the given version, operation, and info.
@@ -68,6 +91,29 @@ class Client:
             data["info"] = data["info"][0]
         return data
 
+    def hello(self):
+        """
+        Asks the server for the protocol versions it can decode and stores them in
+        server_versions. Servers that predate HELLO do not answer it, so it is only sent
+        when the client wants to pick a version.
+
+        Returns:
+            list: The versions the server advertised, None if the request failed
+        """
+        data = self.create_data_object(
+            self.protocol_version,
+            Operations.HELLO.value,
+            {"versions": ",".join(supported_versions()), "json": JSON_BACKEND},
+        )
+        data_received = self.unwrap_data_object(self.client_send(data))
+
+        if data_received and data_received["type"] == Operations.HELLO.value:
+            self.server_versions = data_received["info"]["versions"].split(",")
+            return self.server_versions
+
+        logging.error("Hello failed")
+        return
+
     def login(self, username, password):
         """
         Handles the login process for the client application.
@@ -176,6 +222,40 @@ class Client:
 
         return
 
+    def list_accounts_page(self, search_string, limit, after=None):
+        """
+        Gets a page of the accounts that start with the search string, in alphabetical order.
+
+        Args:
+            search_string: The search string to search for in the accounts
+            limit: The most accounts to return
+            after: The cursor returned with the previous page, None for the first page
+
+        Returns:
+            tuple: The accounts of the page and the cursor of the next page, which is None
+                after the last page, or None if the listing failed
+        """
+        info = {"search_string": search_string, "limit": limit}
+        if after is not None:
+            info["after"] = after
+        data = self.create_data_object(self.protocol_version, Operations.LIST_ACCOUNTS.value, info)
+
+        data_received = self.client_send(data)
+
+        if data_received and data_received["type"] == Operations.SUCCESS.value:
+            accounts = [account for account in data_received["info"] if account]
+            # the server ends a page with a cursor row if more accounts match
+            if accounts and "cursor" in accounts[-1]:
+                return accounts[:-1], accounts[-1]["cursor"]
+            return accounts, None
+
+        elif data_received and data_received["type"] == Operations.FAILURE.value:
+            logging.error(f"Cannot List Accounts: {data_received['info']}")
+        else:
+            logging.error("Listing accounts failed. Try again.")
+
+        return
+
     def send_message(self, receiver, msg):
         """
         Handles the message sending process for the client application.
@@ -215,7 +295,8 @@ class Client:
         Sends a request to the server to read all messages for the current user.
 
         Returns:
-            list: The list of messages for the current user
+            list: The list of messages for the current user. With the columnar protocol this
+            is a MessageTable that only decodes the messages that are accessed.
         """
         try:
             data = self.create_data_object(
@@ -248,6 +329,46 @@ class Client:
             logging.error(f"Unexpected error in read_message: {e}")
             return
 
+    def read_message_page(self, limit, before_id=None, since_id=None):
+        """
+        Gets the latest messages of the current user between two message IDs, in time order.
+
+        Args:
+            limit: The most messages to return
+            before_id: The cursor returned with the previous page, None for the latest messages
+            since_id: Only messages newer than this message ID are returned
+
+        Returns:
+            tuple: The messages of the page, the cursor of the page of older messages, which
+                is None after the oldest page, and the number of messages of the user, or
+                None if reading failed
+        """
+        info = {"username": self.username, "limit": limit}
+        if before_id is not None:
+            info["before_id"] = before_id
+        if since_id is not None:
+            info["since_id"] = since_id
+        data = self.create_data_object(self.protocol_version, Operations.READ_MESSAGE.value, info)
+
+        try:
+            data_received = self.client_send(data)
+        except (ConnectionError, socket.timeout) as e:
+            logging.error(f"Connection error while reading messages: {e}")
+            return
+
+        if data_received and data_received["type"] == Operations.SUCCESS.value:
+            messages = data_received["info"]
+            # the server ends a page with a row holding the total and the cursor
+            page_info = messages[-1]
+            return messages[:-1], page_info.get("cursor"), int(page_info["total"])
+
+        elif data_received and data_received["type"] == Operations.FAILURE.value:
+            logging.error(f"Reading message failed: {data_received['info']}")
+        else:
+            logging.error("Reading message failed")
+
+        return
+
     def delete_messages(self, messages):
         """
         Deletes a list of messages from the server.
@@ -265,7 +386,7 @@ class Client:
                 receiver = message["receiver"]
                 timestamp = message["timestamp"]
                 msg = message["message"]
-                if not self.delete_message(sender, receiver, msg, timestamp):
+                if not self.delete_message(sender, receiver, msg, timestamp, message.get("id")):
                     logging.error(
                         f"message from {sender} to {receiver} on {timestamp} could not be deleted"
                     )
@@ -276,7 +397,7 @@ class Client:
 
         return True
 
-    def delete_message(self, sender, receiver, msg, timestamp):
+    def delete_message(self, sender, receiver, msg, timestamp, message_id=None):
         """
         Deletes a single message from the server.
 
@@ -285,19 +406,20 @@ class Client:
             receiver: The receiver of the message
             msg: The message content
             timestamp: The timestamp of the message
+            message_id: The ID the server assigned to the message, if it sent one
 
         Returns:
             bool: True if the message is deleted successfully, False otherwise
         """
+        # the server finds a message by its ID without comparing the other fields
+        if message_id is not None:
+            info = {"sender": sender, "receiver": receiver, "id": message_id}
+        else:
+            info = {"sender": sender, "receiver": receiver, "timestamp": timestamp, "message": msg}
         data = self.create_data_object(
             self.protocol_version,
             Operations.DELETE_MESSAGE.value,
-            {
-                "sender": sender,
-                "receiver": receiver,
-                "timestamp": timestamp,
-                "message": msg,
-            },
+            info,
         )
         # sends the data object to the server and receives the response in data_received
         data_received = self.client_send(data)
@@ -345,7 +467,9 @@ class Client:
     
     def wire_protocol_receive(self, recv_data):
         """
-        Checks the first byte of the received data to determine the protocol version and unpacks accordingly. 
+        Unpacks the received data with the codec registered for the protocol version in its first byte.
+        Compressed frames are decompressed first and marked with "compressed" so the
+        other side knows compression can be used in return.
 
         Args:
             recv_data: The data to send to the server
@@ -353,29 +477,27 @@ class Client:
         Returns:
             dict: The response received from the server
         """
-        first_byte = recv_data[0:1].decode(self.FORMAT)
-        if first_byte == Version.WIRE_PROTOCOL.value:
-            return unpacking(recv_data)
-        elif first_byte == Version.JSON.value:
-            return json.loads(recv_data[1:].decode(self.FORMAT))
-        else:
-            print(f"Unknown protocol indicator: {first_byte}")
-            return None 
-        
-    def wire_protocol_send(self, data):
+        compressed = is_compressed(recv_data)
+        if compressed:
+            recv_data = decompress_payload(recv_data)
+
+        decoded = decode(recv_data)
+        if decoded is None:
+            return None
+
+        if compressed:
+            decoded["compressed"] = True
+        return decoded
+
+    def wire_protocol_send(self, data, buffer=None):
         """
-        Checks the version of the data object and packs it accordingly.
+        Packs the data object with the codec registered for its version.
 
         Args:
             data: The data object to send to the server
+            buffer: Optional scratch bytearray reused by the wire protocol encoder
         """
-        if data["version"] == Version.WIRE_PROTOCOL.value:
-            return packing(data)
-        else:
-            json_data = json.dumps(data).encode(self.FORMAT)
-            return (
-                data["version"].encode(self.FORMAT) + json_data
-            )
+        return encode(data, buffer)
 
 
     def client_send(self, data):
@@ -395,88 +517,104 @@ class Client:
         try:
 
             # serializes the data to be sent to the server
-            serialized_data = self.wire_protocol_send(data)
+            serialized_data = self.wire_protocol_send(data, self.scratch)
             # calculates the length of the serialized data
             data_length = len(serialized_data)
 
             # prints the operation and length of the serialized data for experimentation 
             print("--------------------------------")
             print(f"OPERATION: {OperationNames[data['type']]}")
-            print(f"SERIALIZED DATA LENGTH: {data_length} {'WIRE PROTOCOL' if self.protocol_version == '1' else 'JSON'}")
+            print(f"SERIALIZED DATA LENGTH: {data_length} {VersionNames[data['version']]}")
+            if self.compression:
+                serialized_data = compress_payload(serialized_data)
+                print(f"COMPRESSED DATA LENGTH: {len(serialized_data)} RATIO: {data_length / len(serialized_data):.2f}")
+            # the header with the length of the serialized data and the data itself go out
+            # together in one scatter/gather write
+            header = encode_header(len(serialized_data), data["version"], self.HEADER)
+            print(f"FRAMED DATA LENGTH: {len(header) + len(serialized_data)}")
             print("--------------------------------")
-            # creates the header data with the length of the serialized data
-            header_data = f"{data_length:<{self.HEADER}}".encode(self.FORMAT)
-
-            self.data.outb = serialized_data
 
-            self.client_socket.send(header_data)
-            self.client_socket.send(self.data.outb)
-
-            # Temporarily set socket to blocking for response
-            self.client_socket.setblocking(True)
-            try:
-                header_response = self.client_socket.recv(self.HEADER).decode(
-                    self.FORMAT
-                )
-
-                if header_response:
-                    message_length = int(header_response)
-                    recv_data = b""
-                    while len(recv_data) < message_length:
-                        chunk = self.client_socket.recv(message_length - len(recv_data))
-                        recv_data += chunk
-                    try:
-                        return self.wire_protocol_receive(recv_data)
-                    except Exception as e:
-                        print(f"Error decoding data: {e}")
+            self.send_all(header, serialized_data)
+
+            # waits for the response while keeping the socket non-blocking, since the
+            # polling thread may read the response first and queue it for us
+            while True:
+                with self.CLIENT_LOCK:
+                    if self.responses:
+                        return self.responses.popleft()
+                    if not self.receive_available():
+                        # connection closed by server
+                        self.cleanup(self.client_socket)
                         return None
-
-            finally:
-                # Set back to non-blocking
-                self.client_socket.setblocking(False)
+                    if self.responses:
+                        return self.responses.popleft()
+                select.select([self.client_socket], [], [], self.POLL_INTERVAL)
 
         except Exception as e:
             logging.error(f"Error in sending data: {e}")
             self.cleanup(self.client_socket)
             return None
 
+    def send_all(self, *buffers):
+        """
+        Sends the buffers in order over the non-blocking socket with scatter/gather writes,
+        resuming after partial sends and waiting for the socket to become writable
+        whenever the kernel send buffer is full.
+
+        Args:
+            buffers: The bytes to send, usually the header and the body of a frame
+        """
+        queue = deque(memoryview(buffer) for buffer in buffers if buffer)
+        while queue:
+            try:
+                send_buffers(self.client_socket, queue)
+            except BlockingIOError:
+                select.select([], [self.client_socket], [], self.POLL_INTERVAL)
+
+    def receive_available(self):
+        """
+        Reads all data currently available on the socket without blocking and sorts the
+        decoded frames into instantly delivered messages and responses to requests.
+        Partially received frames stay buffered in the frame decoder.
+
+        Returns:
+            bool: False if the server closed the connection, True otherwise
+        """
+        while True:
+            try:
+                # the decoder reads with recv_into into its own preallocated buffers
+                frames = self.decoder.receive(self.client_socket)
+            except BlockingIOError:
+                return True
+            if frames is None:
+                return False
+
+            for frame in frames:
+                if frame and frame["type"] == Operations.DELIVER_MESSAGE_NOW.value:
+                    # the server merges the messages delivered within a short window into one frame
+                    self.delivered_messages.extend(item["message"] for item in frame["info"])
+                else:
+                    self.responses.append(frame)
+
     def client_receive(self):
         """
         Receives data from the server. Specifically used to poll for incoming messages.
 
         Returns:
-            dict: The data received from the server
+            list: Every message delivered since the last call, None if there are none
         """
         try:
-            # receives the header data from the server non-blcoking
-            msg_length = self.client_socket.recv(self.HEADER, socket.MSG_DONTWAIT)
-            if not msg_length:
-                # Connection closed by server
-                self.cleanup(self.client_socket)
-                return None
-
-            msg_length = msg_length.decode(self.FORMAT).strip()
-            if not msg_length:
-                return None
-
-            message_length = int(msg_length)
-            if message_length > 0:
-                recv_data = b""
-                while len(recv_data) < message_length:
-                    chunk = self.client_socket.recv(message_length - len(recv_data))
-                    recv_data += chunk
-
-                if recv_data:
-                    unpacked_data = self.wire_protocol_receive(recv_data)
-                    # unpacked_data = unpacking(recv_data)
-                    unpacked_data = self.unwrap_data_object(unpacked_data)
-                    message = unpacked_data["info"]["message"]
-                    if unpacked_data["type"] == Operations.DELIVER_MESSAGE_NOW.value:
-                        return message
+            with self.CLIENT_LOCK:
+                if not self.delivered_messages and not self.receive_available():
+                    # Connection closed by server
+                    self.cleanup(self.client_socket)
+                    return None
+                if self.delivered_messages:
+                    messages = list(self.delivered_messages)
+                    self.delivered_messages.clear()
+                    return messages
             return None
 
-        except BlockingIOError:
-            return None
         except Exception as e:
             self.cleanup(self.client_socket)
             return None
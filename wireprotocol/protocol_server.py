@@ -1,33 +1,78 @@
 import socket
 import os
 import selectors
+import time
 import types
+from collections import deque
 from dotenv import load_dotenv
-from wire_protocol import unpacking, packing
-from operations import Operations, OperationNames, Version
-from user import User
-from message import Message
+from codec_registry import decode, encode, supported_versions, JSON_BACKEND
+from compression import compress_payload, decompress_payload, is_compressed
+from connection import Connection
+from framing import RECV_SIZE, encode_frame, encode_header
+from operations import Operations, OperationNames, Version, VersionNames
+from account_index import AccountIndex
+from user import Mailbox, User
+from message import Message, MessageIds
 from datetime import datetime
-import json
 import logging
 
 
 class Server:
     HEADER = 64
     FORMAT = "utf-8"
+    # maximum number of bytes read from a client socket per read event
+    RECV_SIZE = RECV_SIZE
+    # seconds instant deliveries to a client are collected for before they are sent
+    # together in one DELIVER_MESSAGE_NOW frame
+    DELIVERY_WINDOW = 0.01
+    # most rows a paginated reply holds, whatever limit the request asks for
+    MAX_PAGE_SIZE = 1000
+    # (operation, message) of the replies whose frames are cached once they are first sent
+    CONSTANT_REPLIES = frozenset(
+        [
+            (Operations.SUCCESS.value, "Account created"),
+            (Operations.SUCCESS.value, "deleted message successfully"),
+            (Operations.SUCCESS.value, "Deletion successful"),
+            (Operations.FAILURE.value, "unable to login"),
+            (Operations.FAILURE.value, "username is taken"),
+            (Operations.FAILURE.value, "must supply username and password"),
+            (Operations.FAILURE.value, "Listing accounts failed"),
+            (Operations.FAILURE.value, "Cannot send a message to yourself"),
+            (Operations.FAILURE.value, "message is empty"),
+            (Operations.FAILURE.value, "Read message failed"),
+            (Operations.FAILURE.value, "Delete message failed"),
+            (Operations.FAILURE.value, "Deletion of account unsuccessful"),
+        ]
+    )
 
     def __init__(self, protocol_version=None):
         load_dotenv()
         # all users and their associated data stored in the User object
         self.user_login_database = {}
+        # usernames of user_login_database in sorted order for prefix searches
+        self.account_index = AccountIndex()
 
-        # all active users and their sockets
+        # all active users and their sockets, while the connection object of each socket
+        # holds the username logged in on it
         self.active_users = {}
         self.sel = selectors.DefaultSelector()
 
         # feedin the protocol version to the server if provided 
         self.protocol_version = protocol_version if protocol_version else Version.WIRE_PROTOCOL.value
 
+        # every connection reads into this buffer, which is decoded before the next read
+        self.read_buffer = bytearray(self.RECV_SIZE)
+
+        # fully framed replies that never change, keyed by (version, operation, message)
+        self.reply_cache = {}
+
+        # (deadline, socket, connection) of the connections with deliveries waiting for
+        # their window to pass, in deadline order since every window is the same length
+        self.delivery_queue = deque()
+
+        # assigns the IDs of the messages stored by this server
+        self.message_ids = MessageIds()
+
     def accept_wrapper(self, sock):
         """
         Accept new clients and register them with the selector.
@@ -36,11 +81,54 @@ class Server:
         """
         conn, addr = sock.accept()
         conn.setblocking(False)
+        # replies are written in one call per batch, so waiting to coalesce them only adds latency
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.register_connection(conn, addr)
+
+    def register_connection(self, conn, addr):
+        """
+        Registers an accepted client socket with the selector.
+
+        conn: the non-blocking client socket
+        addr: the address of the client
+        """
+        # store connection info along with its inbound and outbound buffers
+        data = Connection(conn, addr, self.wire_protocol_receive, self.HEADER, self.read_buffer)
+        # write interest is only added while replies are waiting to be sent, since an
+        # idle socket is always writable and would wake up the selector on every loop
+        self.sel.register(conn, selectors.EVENT_READ, data=data)
+
+    def send_hello(self, sock, data):
+        """
+        Advertises the versions this server can decode, comma separated, and its JSON
+        backend in reply to a HELLO request. Clients that never send one, such as those
+        written before HELLO existed, never receive it.
+
+        sock: The socket object
+        data: The connection object
+        """
+        data.outb = self.create_data_object(
+            self.protocol_version,
+            Operations.HELLO.value,
+            {"versions": ",".join(supported_versions()), "json": JSON_BACKEND},
+        )
+        self.service_writes(sock, data)
+
+    def connection_data(self, sock):
+        """
+        Returns the connection object of a client socket, such as one in active_users.
 
-        # store connection info
-        data = types.SimpleNamespace(addr=addr, inb=b"", outb=b"")
-        events = selectors.EVENT_READ | selectors.EVENT_WRITE
-        self.sel.register(conn, events, data=data)
+        sock: The socket object
+        """
+        return self.selector(sock).get_key(sock).data
+
+    def selector(self, sock):
+        """
+        Returns the selector a client socket is registered with.
+
+        sock: The socket object
+        """
+        return self.sel
 
     def check_valid_user(self, username):
         """
@@ -72,6 +160,38 @@ class Server:
         else:
             return {"version": version, "type": operation, "info": info}
 
+    def cached_reply(self, outb):
+        """
+        Returns the cached frames of a reply with a fixed message, encoding and framing
+        it the first time it is sent so that later replies skip packing the data object.
+
+        Args:
+            outb: The data object of the reply
+
+        Returns:
+            SimpleNamespace: the reply's serialized and compressed lengths and the framed
+            bytes both as they are and compressed, or None if the reply is not one of
+            CONSTANT_REPLIES
+        """
+        info = outb["info"]
+        if len(info) != 1 or len(info[0]) != 1 or "message" not in info[0]:
+            return None
+        key = (outb["version"], outb["type"], info[0]["message"])
+        reply = self.reply_cache.get(key)
+        if reply is None:
+            if key[1:] not in self.CONSTANT_REPLIES:
+                return None
+            serialized_data = self.wire_protocol_send(outb)
+            compressed_data = compress_payload(serialized_data)
+            reply = types.SimpleNamespace(
+                length=len(serialized_data),
+                compressed_length=len(compressed_data),
+                frame=encode_frame(serialized_data, outb["version"], self.HEADER),
+                compressed_frame=encode_frame(compressed_data, outb["version"], self.HEADER),
+            )
+            self.reply_cache[key] = reply
+        return reply
+
     def unwrap_data_object(self, data):
         """
         Unwraps the data object if it is a list with only one element.
@@ -117,6 +237,25 @@ class Server:
                 {"message": "unable to login"},
             )
 
+    def login_session(self, sock, data, username, password):
+        """
+        Logs in the user and, if the login succeeded, marks the user as logged in on the
+        connection.
+
+        Args:
+            sock: The socket object
+            data: The connection object
+            username: The username of the user
+            password: The password of the user
+
+        Returns:
+            dict: the reply of login
+        """
+        reply = self.login(username, password)
+        if reply["type"] == Operations.SUCCESS.value:
+            self.start_session(sock, data, username)
+        return reply
+
     def create_account(self, username, password):
         """
         Creates an account if the username and password are not taken.
@@ -145,31 +284,51 @@ class Server:
         # create the account
         else:
             self.user_login_database[username] = User(username, password)
+            self.account_index.add(username)
             return self.create_data_object(
                 self.protocol_version,
                 Operations.SUCCESS.value,
                 {"message": "Account created"},
             )
 
-    def list_accounts(self, search_string):
+    def page_limit(self, limit):
         """
-        Lists all accounts that start with the search string.
+        Returns the number of rows a paginated request asks for.
+
+        limit: The limit field of the request, None if it has none
+
+        Returns:
+            int: The limit capped at MAX_PAGE_SIZE, None if the request asks for every row
+
+        Raises:
+            ValueError: If the limit is not a positive number
+        """
+        if limit is None or limit == "":
+            return None
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError(f"invalid limit {limit}")
+        return min(limit, self.MAX_PAGE_SIZE)
+
+    def list_accounts(self, search_string, limit=None, after=None):
+        """
+        Lists the accounts that start with the search string in alphabetical order. If a
+        limit is given and more accounts match than fit on the page, the reply ends with
+        a {"cursor": username} row, which is sent as after to get the next page.
 
         search_string: The string to search for
+        limit: The most accounts to return, every account if None
+        after: Only accounts after this username are returned
 
         Returns:
             dict: A dictionary representing the data object
         """
         try:
-            return self.create_data_object(
-                self.protocol_version,
-                Operations.SUCCESS.value,
-                [   
-                    {"username": username}
-                    for username in self.user_login_database.keys()
-                    if username.startswith(search_string)
-                ],
-            )
+            usernames, more = self.account_index.page(search_string, after or None, self.page_limit(limit))
+            accounts = [{"username": username} for username in usernames]
+            if more:
+                accounts.append({"cursor": usernames[-1]})
+            return self.create_data_object(self.protocol_version, Operations.SUCCESS.value, accounts)
 
         except:
             return self.create_data_object(
@@ -221,16 +380,17 @@ class Server:
                 {"message": "message is empty"},
             )
 
-        message = Message(sender, receiver, msg)
+        message = self.new_message(sender, receiver, msg)
 
-        # check if the receiver is active and appends to unread messages if not active and regular messages otherwise
-        if receiver not in self.active_users:
-            self.user_login_database[receiver].unread_messages.append(message)
+        # check if the receiver can take the message instantly and appends to unread messages if not and
+        # regular messages otherwise
+        if not self.is_deliverable(receiver):
+            self.user_login_database[receiver].unread_messages.add(message)
         else:
-            self.user_login_database[receiver].messages.append(message)
+            self.user_login_database[receiver].messages.add(message)
 
         # append the message to the sender's messages
-        self.user_login_database[sender].messages.append(message)
+        self.user_login_database[sender].messages.add(message)
 
         return self.create_data_object(
             self.protocol_version,
@@ -238,11 +398,33 @@ class Server:
             {"message": f"message from {sender} has been sent to {receiver}"},
         )
 
-    def read_message(self, username):
+    def new_message(self, sender, receiver, msg):
+        """
+        Creates a message with a new ID assigned by this server.
+
+        Args:
+            sender: The username of the sender
+            receiver: The username of the receiver
+            msg: The message
+
+        Returns:
+            Message: the new message
         """
-        Reads the messages of the user.
+        timestamp = datetime.now()
+        return Message(sender, receiver, msg, timestamp, self.message_ids.assign(timestamp))
+
+    def read_message(self, username, limit=None, before_id=None, since_id=None):
+        """
+        Reads the messages of the user in time order. If a limit or message ID is given,
+        only the latest messages between the IDs are read and the reply ends with a
+        {"cursor": id, "total": count} row, where total counts every message of the user
+        and cursor, present if older messages did not fit on the page, is sent as
+        before_id to get the previous page.
 
         username: The username of the user
+        limit: The most messages to return, every message if None
+        before_id: Only messages older than this message ID are returned
+        since_id: Only messages newer than this message ID are returned
 
         Returns:
             dict: A dictionary representing the data object
@@ -259,11 +441,15 @@ class Server:
             user = self.user_login_database[username]
             # check if the user has unread messages and appends to messages if they do
             if user.unread_messages:
-                user.messages += user.unread_messages
-                user.unread_messages = []
+                user.messages.extend(user.unread_messages)
+                user.unread_messages = Mailbox()
 
-            # sort the messages by timestamp
-            messages = sorted(user.messages, key=lambda x: x.timestamp)
+            # the mailbox keeps the messages in ID order, which is the order they were sent in
+            paginated = limit or before_id or since_id
+            if paginated:
+                messages, more = user.messages.page(self.page_limit(limit), before_id or None, since_id or None)
+            else:
+                messages = user.messages
 
             # create the data object as a list of dictionaries that represent the messages
             data = [
@@ -272,9 +458,15 @@ class Server:
                     "receiver": msg.receiver,
                     "timestamp": str(msg.timestamp),
                     "message": msg.message,
+                    "id": msg.id,
                 }
                 for msg in messages
             ]
+            if paginated:
+                page_info = {"total": len(user.messages)}
+                if more:
+                    page_info["cursor"] = messages[0].id
+                data.append(page_info)
             return self.create_data_object(
                 self.protocol_version, Operations.SUCCESS.value, data
             )
@@ -286,48 +478,51 @@ class Server:
                 {"message": "Read message failed"},
             )
 
-    def delete_message_from_user(
-        self, user, sender, receiver, msg, timestamp, unread=False
-    ):
+    def find_message_id(self, sender, receiver, msg, timestamp):
         """
-        Deletes a message from the user's messages and unread messages.
+        Finds the ID of a message by its fields, for requests that do not name the
+        message by its ID.
 
         Args:
-            user: The user object
             sender: The username of the sender
             receiver: The username of the receiver
-            msg: The message to delete
+            msg: The message
             timestamp: The timestamp of the message
 
         Returns:
-            list: A list of messages filtered out of the deleted message
+            str: The ID of the message, None if neither user holds it
+        """
+        timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
+        for username in (sender, receiver):
+            user = self.user_login_database.get(username)
+            if user is None:
+                continue
+            for mailbox in (user.messages, user.unread_messages):
+                for message in mailbox:
+                    if (
+                        message.receiver == receiver
+                        and message.sender == sender
+                        and message.message == msg
+                        and message.timestamp == timestamp
+                    ):
+                        return message.id
+        return None
+
+    def delete_message_from_user(self, user, message_id, unread=False):
+        """
+        Deletes a message from the user's messages and unread messages.
+
+        Args:
+            user: The user object
+            message_id: The ID of the message to delete
+            unread: True to also delete the message from the unread messages
         """
         # checks to see if unread messages should also be deleted from the receiver side
         if unread:
-            user.unread_messages = [
-                message
-                for message in user.unread_messages
-                if not (
-                    message.receiver == receiver
-                    and message.sender == sender
-                    and message.message == msg
-                    and message.timestamp
-                    == datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
-                )
-            ]
-        user.messages = [
-            message
-            for message in user.messages
-            if not (
-                message.receiver == receiver
-                and message.sender == sender
-                and message.message == msg
-                and message.timestamp
-                == datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
-            )
-        ]
+            user.unread_messages.remove(message_id)
+        user.messages.remove(message_id)
 
-    def delete_message(self, sender, receiver, msg, timestamp):
+    def delete_message(self, sender, receiver, msg, timestamp, message_id=None):
         """
         Deletes a message from the user's messages and unread messages.
 
@@ -336,23 +531,25 @@ class Server:
             receiver: The username of the receiver
             msg: The message to delete
             timestamp: The timestamp of the message
+            message_id: The ID of the message, which is found by the other fields if not given
 
         Returns:
             dict: A dictionary representing the data object
         """
         try:
+            if message_id is None:
+                message_id = self.find_message_id(sender, receiver, msg, timestamp)
+
             # check if the sender is a valid user
             if sender in self.user_login_database:
                 user = self.user_login_database[sender]
-                # gets the user and searches for the message to delete
-                self.delete_message_from_user(user, sender, receiver, msg, timestamp)
+                # gets the user and deletes the message by its ID
+                self.delete_message_from_user(user, message_id)
 
             # check if the receiver is a valid user and deletes the message from their messages
             if receiver in self.user_login_database:
                 user = self.user_login_database[receiver]
-                self.delete_message_from_user(
-                    user, sender, receiver, msg, timestamp, unread=True
-                )
+                self.delete_message_from_user(user, message_id, unread=True)
 
             return self.create_data_object(
                 self.protocol_version,
@@ -388,8 +585,8 @@ class Server:
         try:
             # deletes the user from the user login database and active users
             self.user_login_database.pop(username)
-            if username in self.active_users:
-                self.active_users.pop(username)
+            self.account_index.remove(username)
+            self.end_session(username)
             return self.create_data_object(
                 self.protocol_version,
                 Operations.SUCCESS.value,
@@ -405,139 +602,281 @@ class Server:
 
     def service_reads(self, sock, data):
         """
-        Reads the data from the client and processes the operation, calling service_writes to send the data back to the client.
+        Reads whatever data is available from the client without blocking and processes
+        every request that has been fully received, calling service_writes to queue the
+        data back to the client. Partial requests stay buffered in the connection's
+        frame decoder until the rest of the bytes arrive.
 
         sock: The socket object
         data: The data object
         """
         try:
-            sock.setblocking(True)
-            header_data = sock.recv(self.HEADER).decode(self.FORMAT)
-
-            if header_data:
-                message_length = int(header_data)
-                # receives the data from the client and appends it to recv data until the message length is reached
-                recv_data = b""
-                while len(recv_data) < message_length:
-                    chunk = sock.recv(message_length - len(recv_data))
-                    recv_data += chunk
-                recv_data = self.wire_protocol_receive(recv_data)
-                # unwraps the data object if it is a list with only one element
-                recv_data = self.unwrap_data_object(recv_data)
-                # gets the operation from the data object
-                recv_operation = recv_data["type"]
-
-                match recv_operation:
-                    case Operations.LOGIN.value:
-                        username = recv_data["info"]["username"]
-                        password = recv_data["info"]["password"]
-                        data.outb = self.login(username, password)
-                        # checks if the login was successful
-                        is_success = data.outb["type"] == Operations.SUCCESS.value
-                        # sends the data back to the client
-                        result = self.service_writes(sock, data)
-                        # checks to see if the login was successful with the write to the client
-                        if result == 0 and is_success:
-                            # adds the user to the active users
-                            self.active_users[username] = sock
-
-                    case Operations.CREATE_ACCOUNT.value:
-                        username = recv_data["info"]["username"]
-                        password = recv_data["info"]["password"]
-                        data.outb = self.create_account(username, password)
-                        # sends the data back to the client
-                        self.service_writes(sock, data)
-
-                    case Operations.LIST_ACCOUNTS.value:
-                        # gets the account search string to find accounts that match the search string
-                        search_string = recv_data["info"]["search_string"]
-                        data.outb = self.list_accounts(search_string)
-                        # sends the data back to the client
-                        self.service_writes(sock, data)
-
-                    case Operations.SEND_MESSAGE.value:
-                        sender = recv_data["info"]["sender"]
-                        receiver = recv_data["info"]["receiver"]
-                        msg = recv_data["info"]["message"]
-                        data.outb = self.send_message(sender, receiver, msg)
-                        # checks to see if the receiver is active and sends the message with the receiver socket
-                        # for instantaneous messaging
-                        if receiver in self.active_users:
-                            receiver_conn = self.active_users[receiver]
-                            # creates the data object to deliver instantaneous messages
-                            msg_data_receiver = self.create_data_object(
-                                self.protocol_version,
-                                Operations.DELIVER_MESSAGE_NOW.value,
-                                {"message": f"From {sender}: {msg}"},
-                            )
-
-                            # serializes the data object and sends it to the receiver
-                            serialized_data = self.wire_protocol_send(msg_data_receiver)
-                            data_length = len(serialized_data)
-                            header_data = f"{data_length:<{self.HEADER}}".encode(
-                                self.FORMAT
-                            )
-                            receiver_conn.send(header_data)
-                            receiver_conn.send(serialized_data)
-                        # sends the data back to the client
-                        self.service_writes(sock, data)
-
-                    case Operations.READ_MESSAGE.value:
-                        username = recv_data["info"]["username"]
-                        data.outb = self.read_message(username)
-                        # sends the data back to the client
-                        self.service_writes(sock, data)
-
-                    case Operations.DELETE_MESSAGE.value:
-                        sender = recv_data["info"]["sender"]
-                        receiver = recv_data["info"]["receiver"]
-                        msg = recv_data["info"]["message"]
-                        timestamp = recv_data["info"]["timestamp"]
-                        data.outb = self.delete_message(
-                            sender, receiver, msg, timestamp
-                        )
-                        # sends the data back to the client
-                        self.service_writes(sock, data)
-
-                    case Operations.DELETE_ACCOUNT.value:
-                        username = recv_data["info"]["username"]
-                        if not self.check_valid_user(username):
-                            # checks to see if the user initiating the action is valid in the edge case
-                            # where the user is not in the user login database
-                            logging.info(f"Closing connection to {data.addr}")
-                            self.sel.unregister(sock)
-                            sock.close()
-                        data.outb = self.delete_account(username)
-                        # sends the data back to the client
-                        self.service_writes(sock, data)
+            # the decoder reads with recv_into into its own preallocated buffers
+            requests = data.decoder.receive(sock)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logging.error(f"Error reading from {data.addr}: {e}")
+            requests = None
+        except ValueError as e:
+            # the header could not be parsed so the stream cannot be split into frames anymore
+            logging.error(f"Invalid frame header from {data.addr}: {e}")
+            requests = None
+
+        if requests is None:
+            self.close_connection(sock, data)
+            return
+
+        self.process_requests(sock, data, requests)
+
+    def process_requests(self, sock, data, requests):
+        """
+        Processes the requests that were fully received from a client in order, replying
+        with a failure to any request that cannot be decoded or processed.
 
-            else:
-                logging.error(f"Closing connection to {data.addr}")
-                # closes the sockets and unregisters the socket from the selector
-                self.sel.unregister(sock)
-                sock.close()
-                # deletes the user from the active users
-                for username, user_sock in self.active_users.items():
-                    if user_sock == sock:
-                        del self.active_users[username]
-                        logging.info(f"{username} has been removed from active users")
-                        break
+        sock: The socket object
+        data: The connection object
+        requests: The decoded requests, None for those that could not be decoded
+        """
+        for request in requests:
+            # an earlier request in the same chunk may have closed the connection
+            if data.closed:
+                return
+            try:
+                if request is None:
+                    raise ValueError("unable to decode request")
+                self.process_request(sock, data, request)
+            except Exception as e:
+                data.outb = self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": f"Exception in service_reads {e}"},
+                )
+                self.service_writes(sock, data)
 
-        except Exception as e:
-            data.outb = self.create_data_object(
-                self.protocol_version,
-                Operations.FAILURE.value,
-                {"message": f"Exception in service_reads {e}"},
-            )
-            self.service_writes(sock, data)
+    def process_request(self, sock, data, recv_data):
+        """
+        Processes a single decoded request and sends the response back to the client.
 
-        finally:
-            if sock and sock.fileno() != -1:
-                sock.setblocking(False)
+        sock: The socket object
+        data: The data object
+        recv_data: The decoded request received from the client
+        """
+        # replies are compressed from now on if the client sent a compressed request
+        if recv_data.get("compressed"):
+            data.compression = True
+        # unwraps the data object if it is a list with only one element
+        recv_data = self.unwrap_data_object(recv_data)
+        # gets the operation from the data object
+        recv_operation = recv_data["type"]
+
+        match recv_operation:
+            case Operations.HELLO.value:
+                self.send_hello(sock, data)
+
+            case Operations.LOGIN.value:
+                username = recv_data["info"]["username"]
+                password = recv_data["info"]["password"]
+                data.outb = self.login_session(sock, data, username, password)
+                # sends the data back to the client, which logs the user out again if
+                # the connection is lost
+                self.service_writes(sock, data)
+
+            case Operations.CREATE_ACCOUNT.value:
+                username = recv_data["info"]["username"]
+                password = recv_data["info"]["password"]
+                data.outb = self.create_account(username, password)
+                # sends the data back to the client
+                self.service_writes(sock, data)
+
+            case Operations.LIST_ACCOUNTS.value:
+                # gets the account search string to find accounts that match the search string
+                search_string = recv_data["info"]["search_string"]
+                # pages are only returned to clients that ask for them with a limit
+                limit = recv_data["info"].get("limit")
+                after = recv_data["info"].get("after")
+                data.outb = self.list_accounts(search_string, limit, after)
+                # sends the data back to the client
+                self.service_writes(sock, data)
+
+            case Operations.SEND_MESSAGE.value:
+                sender = recv_data["info"]["sender"]
+                receiver = recv_data["info"]["receiver"]
+                msg = recv_data["info"]["message"]
+                data.outb = self.send_message(sender, receiver, msg)
+                # checks to see if the receiver is active and not backlogged and sends the message with
+                # the receiver socket for instantaneous messaging
+                receiver_conn = self.active_users.get(receiver)
+                if receiver_conn is not None and self.is_deliverable(receiver):
+                    self.deliver_now(receiver_conn, f"From {sender}: {msg}")
+                # sends the data back to the client
+                self.service_writes(sock, data)
+
+            case Operations.READ_MESSAGE.value:
+                username = recv_data["info"]["username"]
+                # pages are only returned to clients that ask for them
+                limit = recv_data["info"].get("limit")
+                before_id = recv_data["info"].get("before_id")
+                since_id = recv_data["info"].get("since_id")
+                data.outb = self.read_message(username, limit, before_id, since_id)
+                # sends the data back to the client
+                self.service_writes(sock, data)
+
+            case Operations.DELETE_MESSAGE.value:
+                sender = recv_data["info"]["sender"]
+                receiver = recv_data["info"]["receiver"]
+                # clients name the message by its ID, older clients by its fields
+                msg = recv_data["info"].get("message")
+                timestamp = recv_data["info"].get("timestamp")
+                message_id = recv_data["info"].get("id")
+                data.outb = self.delete_message(
+                    sender, receiver, msg, timestamp, message_id
+                )
+                # sends the data back to the client
+                self.service_writes(sock, data)
+
+            case Operations.DELETE_ACCOUNT.value:
+                username = recv_data["info"]["username"]
+                if not self.check_valid_user(username):
+                    # checks to see if the user initiating the action is valid in the edge case
+                    # where the user is not in the user login database
+                    logging.info(f"Closing connection to {data.addr}")
+                    self.close_connection(sock, data)
+                data.outb = self.delete_account(username)
+                # sends the data back to the client
+                self.service_writes(sock, data)
+
+    def is_deliverable(self, username):
+        """
+        Checks if messages to a user can be delivered instantly, which is the case while
+        the user is logged in on a connection that is not backlogged.
+
+        username: the username of the user
+
+        Returns:
+            bool: True if the user is active and its connection keeps up with its replies
+        """
+        sock = self.active_users.get(username)
+        return sock is not None and not self.connection_data(sock).backlogged
+
+    def deliver_now(self, sock, message):
+        """
+        Collects an instantly delivered message for the receiver's connection, where
+        every message arriving within DELIVERY_WINDOW of the first one is sent in the
+        same DELIVER_MESSAGE_NOW frame.
+
+        sock: The socket object of the receiver
+        message: The message to deliver
+        """
+        receiver_data = self.connection_data(sock)
+        if not receiver_data.deliveries:
+            self.schedule_deliveries(sock, receiver_data)
+        receiver_data.deliveries.append({"message": message})
+
+    def schedule_deliveries(self, sock, data):
+        """
+        Sends the deliveries of a connection once the delivery window has passed.
+
+        sock: The socket object
+        data: The connection object
+        """
+        self.delivery_queue.append((time.monotonic() + self.DELIVERY_WINDOW, sock, data))
+
+    def send_deliveries(self, sock, data):
+        """
+        Sends the deliveries collected for a connection as a single frame, without
+        blocking the sender's request.
+
+        sock: The socket object
+        data: The connection object
+        """
+        if data.closed or not data.deliveries:
+            return
+        data.outb = self.create_data_object(
+            self.protocol_version, Operations.DELIVER_MESSAGE_NOW.value, data.deliveries
+        )
+        data.deliveries = []
+        self.service_writes(sock, data)
+
+    def send_due_deliveries(self, queue):
+        """
+        Sends the deliveries whose window has passed.
+
+        queue: the delivery queue of the selector loop
+
+        Returns:
+            float: seconds until the next window passes, None if no deliveries are waiting
+        """
+        now = time.monotonic()
+        while queue and queue[0][0] <= now:
+            _, sock, data = queue.popleft()
+            self.send_deliveries(sock, data)
+        if queue:
+            return queue[0][0] - now
+        return None
+
+    def start_session(self, sock, data, username):
+        """
+        Marks a user as logged in on a connection, ending the session of the user that
+        was logged in on it before, if any.
+
+        sock: The socket object
+        data: The connection object
+        username: The username of the user
+        """
+        if data.username is not None:
+            self.end_session(data.username)
+        self.active_users[username] = sock
+        data.username = username
+
+    def end_session(self, username):
+        """
+        Removes a user from the active users and from the connection it is logged in on.
+
+        username: The username of the user
+
+        Returns: the socket the user was logged in on, None if the user was not active
+        """
+        sock = self.active_users.pop(username, None)
+        if sock is not None:
+            self.connection_data(sock).username = None
+        return sock
+
+    def close_connection(self, sock, data):
+        """
+        Closes the client connection and removes the user from the active users.
+
+        sock: The socket object
+        data: The data object
+        """
+        if data.closed:
+            return
+        logging.error(f"Closing connection to {data.addr}")
+        # closes the sockets and unregisters the socket from the selector
+        data.closed = True
+        self.selector(sock).unregister(sock)
+        sock.close()
+        self.remove_active_user(sock, data)
+
+    def remove_active_user(self, sock, data):
+        """
+        Removes the user logged in on a closed connection from the active users, found
+        through the connection object instead of searching the active users.
+
+        sock: The socket object
+        data: The connection object
+        """
+        username = data.username
+        if username is not None and self.active_users.get(username) is sock:
+            del self.active_users[username]
+            logging.info(f"{username} has been removed from active users")
+        data.username = None
 
     def wire_protocol_receive(self, recv_data):
         """
-        Checks the first byte of the received data to determine the protocol version and unpacks accordingly. 
+        Unpacks the received data with the codec registered for the protocol version in its first byte.
+        Compressed frames are decompressed first and marked with "compressed" so the
+        other side knows compression can be used in return.
 
         Args:
             recv_data: The data to send to the server
@@ -545,62 +884,139 @@ class Server:
         Returns:
             dict: The response received from the server
         """
-        first_byte = recv_data[0:1].decode(self.FORMAT)
-        if first_byte == Version.WIRE_PROTOCOL.value:
-            return unpacking(recv_data)
-        elif first_byte == Version.JSON.value:
-            return json.loads(recv_data[1:].decode(self.FORMAT))
-        else:
-            logging.error(f"Unknown protocol indicator: {first_byte}")
-            return None 
-    
-    def wire_protocol_send(self, data):
+        compressed = is_compressed(recv_data)
+        if compressed:
+            recv_data = decompress_payload(recv_data)
+
+        decoded = decode(recv_data)
+        if decoded is None:
+            return None
+
+        if compressed:
+            decoded["compressed"] = True
+        return decoded
+
+    def wire_protocol_send(self, data, buffer=None):
         """
-        Checks the version of the data object and packs it accordingly.
+        Packs the data object with the codec registered for its version.
 
         Args:
             data: The data object to send to the server
+            buffer: Optional scratch bytearray reused by the wire protocol encoder
         """
-        if data["version"] == Version.WIRE_PROTOCOL.value:
-            return packing(data)
-        else:
-            json_data = json.dumps(data).encode(self.FORMAT)
-            return (
-                data["version"].encode(self.FORMAT) + json_data
-            )
+        return encode(data, buffer)
 
 
     def service_writes(self, sock, data):
         """
-        Writes the data to the client.
+        Serializes the pending data object, if any, into the connection's outbound buffer
+        and sends as much of the buffer as the socket accepts without blocking. Whatever
+        is left is sent on the following write events.
 
         sock: The socket object
-        data: The data object
+        data: The connection object
 
         Returns: 0 upon success 1 if there is an error
         """
+        if data.closed:
+            data.outb = None
+            return 1
+
         try:
-            if data.outb:
+            cached = self.cached_reply(data.outb) if data.outb else None
+            if cached is not None:
+                # constant replies were framed when they were first sent and are sent as they are
+                frame = cached.compressed_frame if data.compression else cached.frame
+                print("--------------------------------")
+                print(f"OPERATION: {OperationNames[data.outb['type']]}")
+                print(f"SERIALIZED DATA LENGTH: {cached.length} {VersionNames[data.outb['version']]} (CACHED)")
+                if data.compression:
+                    print(f"COMPRESSED DATA LENGTH: {cached.compressed_length} RATIO: {cached.length / cached.compressed_length:.2f}")
+                print(f"FRAMED DATA LENGTH: {len(frame)}")
+                print("--------------------------------")
+                data.queue(frame)
+            elif data.outb:
                 # checks to see the versioning of the data object and serializes it accordingly
-                serialized_data = self.wire_protocol_send(data.outb)
+                serialized_data = self.wire_protocol_send(data.outb, data.scratch)
                 data_length = len(serialized_data)
                 print("--------------------------------")
                 print(f"OPERATION: {OperationNames[data.outb['type']]}")
-                print(f"SERIALIZED DATA LENGTH: {data_length} {'WIRE PROTOCOL' if self.protocol_version == '1' else 'JSON'}")
+                print(f"SERIALIZED DATA LENGTH: {data_length} {VersionNames[data.outb['version']]}")
+                # compresses the reply once the client has shown it understands compressed frames
+                if data.compression:
+                    serialized_data = compress_payload(serialized_data)
+                    print(f"COMPRESSED DATA LENGTH: {len(serialized_data)} RATIO: {data_length / len(serialized_data):.2f}")
+                # header and body are queued as separate buffers that go out in a single
+                # scatter/gather write, without copying the body behind the header
+                header = encode_header(len(serialized_data), data.outb["version"], self.HEADER)
+                print(f"FRAMED DATA LENGTH: {len(header) + len(serialized_data)}")
                 print("--------------------------------")
-                header_data = f"{data_length:<{self.HEADER}}".encode(self.FORMAT)
-                sock.send(header_data)
-                sock.send(serialized_data)
-                # Clear the outbound buffer after sending
-                data.outb = None
-                return 0
-            return 0
+                data.queue(header, serialized_data)
 
         except Exception as e:
             logging.error(f"Error in service_writes: {e}")
             data.outb = None
             return 1
 
+        # Clear the pending data object once it is queued
+        data.outb = None
+        return self.flush_connection(sock, data)
+
+    def flush_connection(self, sock, data):
+        """
+        Sends as much of the connection's outbound queue as the socket accepts without
+        blocking and keeps the socket registered for write events until it is empty.
+
+        sock: The socket object
+        data: The connection object
+
+        Returns: 0 upon success 1 if the connection was lost
+        """
+        try:
+            drained = data.flush()
+        except OSError as e:
+            logging.error(f"Error writing to {data.addr}: {e}")
+            self.close_connection(sock, data)
+            return 1
+        backlogged = data.over_water_mark()
+        if backlogged != data.backlogged:
+            self.set_backlogged(sock, data, backlogged)
+        self.set_interest(sock, data, not backlogged, not drained)
+        return 0
+
+    def set_backlogged(self, sock, data, backlogged):
+        """
+        Marks a connection as backlogged once the client stops keeping up with its
+        replies, or as caught up again once they drained.
+
+        sock: The socket object
+        data: The connection object
+        backlogged: True if the outbound queue went above the high-water mark, False if
+            it drained to the low-water mark
+        """
+        data.backlogged = backlogged
+        if backlogged:
+            logging.info(f"Pausing {data.addr}, which is not keeping up with its replies")
+        else:
+            logging.info(f"Resuming {data.addr}")
+
+    def set_interest(self, sock, data, read, write):
+        """
+        Registers the socket for read and write events, only calling into the selector
+        when the interest actually changes.
+
+        sock: The socket object
+        data: The connection object
+        read: True unless the connection is backlogged, which stops reading its requests
+        write: True while the connection has replies waiting to be sent
+        """
+        if data.read_interest == read and data.write_interest == write:
+            return
+        events = (selectors.EVENT_READ if read else 0) | (selectors.EVENT_WRITE if write else 0)
+        self.selector(sock).modify(sock, events, data=data)
+        data.read_interest = read
+        data.write_interest = write
+
     def service_connection(self, key, mask):
         """
         Handles reading and writing for a connected client.
@@ -615,21 +1031,36 @@ class Server:
         if mask & selectors.EVENT_WRITE:
             self.service_writes(sock, data)
 
-    def handle_client(self):
+    def create_listening_socket(self, reuse_port=False):
         """
-        Starts the server and handles client connections.
+        Creates the non-blocking socket that accepts client connections.
+
+        reuse_port: let other processes listen on the same port, with the kernel
+            spreading new connections over them
+
+        Returns: the listening socket
         """
-        # instantiates the listening socket
         lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         lsock.bind((os.getenv("HOST"), int(os.getenv("PORT"))))
         lsock.listen()
         lsock.setblocking(False)
+        return lsock
+
+    def handle_client(self):
+        """
+        Starts the server and handles client connections.
+        """
+        # instantiates the listening socket
+        lsock = self.create_listening_socket()
         self.sel.register(lsock, selectors.EVENT_READ, data=None)
 
         try:
+            timeout = None
             while True:
-                # selects the events from the selector
-                events = self.sel.select(timeout=None)
+                # selects the events from the selector, waking up in time for the next deliveries
+                events = self.sel.select(timeout=timeout)
                 for key, mask in events:
                     # listening socket commands to create a new client connection
                     if key.data is None:
@@ -637,6 +1068,7 @@ class Server:
                     # client socket commands to handle the client connection
                     else:
                         self.service_connection(key, mask)
+                timeout = self.send_due_deliveries(self.delivery_queue)
         except KeyboardInterrupt:
             logging.error("Caught keyboard interrupt, exiting")
         finally:
@@ -0,0 +1,433 @@
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from message import format_message_id, parse_message_id
+from operations import OperationSchemas
+from wire_protocol import FORMAT, INT_SIZE, INT_STRUCT
+
+# columns of a message row, in the order they are written in the columnar layout
+MESSAGE_COLUMNS = ("sender", "receiver", "timestamp", "message")
+MESSAGE_KEYS = frozenset(MESSAGE_COLUMNS)
+# keys of message rows that carry the ID the server assigned, written as one more column
+MESSAGE_ID_KEYS = MESSAGE_KEYS | {"id"}
+# timestamps are sent as microseconds since this epoch
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def packing_schema(data, buffer=None):
+    """
+    Packs the data using the per-operation field schemas.
+    Format:
+    - version: [1 byte] ("4")
+    - type: [2 bytes] ("00" to "16")
+    - info: [varint list length, then each dictionary from _pack_schema_dictionary]
+
+    Args:
+        data: the data object to pack
+        buffer: optional bytearray reused as scratch space between frames
+
+    Returns:
+        bytes: the packed frame
+    """
+    if buffer is None:
+        buffer = bytearray()
+    else:
+        del buffer[:]
+
+    buffer += data["version"].encode(FORMAT)
+    buffer += data["type"].encode(FORMAT)
+
+    schema = OperationSchemas.get(data["type"], ())
+    field_ids = {field: field_id for field_id, field in enumerate(schema)}
+
+    _pack_varint(buffer, len(data["info"]))
+    for item in data["info"]:
+        _pack_schema_dictionary(buffer, item, schema, field_ids)
+
+    return bytes(buffer)
+
+
+def _pack_schema_dictionary(buffer, data, schema, field_ids):
+    """
+    Appends a single dictionary to buffer.
+    Format:
+    - presence: [varint bitmap, bit i set when the field with ID i is present]
+    - known values: [varint length + value for every present field, in field ID order]
+    - extra count: [varint number of keys that are not in the schema]
+    - extra entries: [4-byte key length, key, 4-byte value length, value] as in version 1
+    """
+    presence = 0
+    extras = []
+    for key, value in data.items():
+        field_id = field_ids.get(key)
+        if field_id is None:
+            extras.append((key, value))
+        else:
+            presence |= 1 << field_id
+
+    _pack_varint(buffer, presence)
+    for field_id, field in enumerate(schema):
+        if presence >> field_id & 1:
+            value_bytes = str(data[field]).encode(FORMAT)
+            _pack_varint(buffer, len(value_bytes))
+            buffer += value_bytes
+
+    # keys without a field ID keep the self-describing key/value encoding
+    _pack_varint(buffer, len(extras))
+    for key, value in extras:
+        key_bytes = str(key).encode(FORMAT)
+        value_bytes = str(value).encode(FORMAT)
+        buffer += INT_STRUCT.pack(len(key_bytes))
+        buffer += key_bytes
+        buffer += INT_STRUCT.pack(len(value_bytes))
+        buffer += value_bytes
+
+
+def unpacking_schema(data):
+    """
+    Unpacks the data from the schema format.
+    Format matches packing_schema function above.
+    """
+    view = memoryview(data)
+    decoded_data = {}
+
+    decoded_data["version"] = str(view[0:1], FORMAT)
+    decoded_data["type"] = str(view[1:3], FORMAT)
+
+    schema = OperationSchemas.get(decoded_data["type"], ())
+    list_length, pos = _unpack_varint(view, 3)
+    info = []
+    for _ in range(list_length):
+        item, pos = _unpack_schema_dictionary(view, pos, schema)
+        info.append(item)
+    decoded_data["info"] = info
+
+    return decoded_data
+
+
+def _unpack_schema_dictionary(view, pos, schema):
+    """
+    Unpacks a single dictionary starting at view[pos].
+
+    Returns:
+        tuple: the decoded dictionary and the offset just past it
+    """
+    info_dict = {}
+
+    presence, pos = _unpack_varint(view, pos)
+    for field_id, field in enumerate(schema):
+        if presence >> field_id & 1:
+            value_len, pos = _unpack_varint(view, pos)
+            info_dict[field] = str(view[pos : pos + value_len], FORMAT)
+            pos += value_len
+    # fields appended to the schema by a newer peer come after the known ones and are skipped
+    for _ in range((presence >> len(schema)).bit_count()):
+        value_len, pos = _unpack_varint(view, pos)
+        pos += value_len
+
+    extra_count, pos = _unpack_varint(view, pos)
+    for _ in range(extra_count):
+        (key_len,) = INT_STRUCT.unpack_from(view, pos)
+        pos += INT_SIZE
+        key = str(view[pos : pos + key_len], FORMAT)
+        pos += key_len
+        (value_len,) = INT_STRUCT.unpack_from(view, pos)
+        pos += INT_SIZE
+        info_dict[key] = str(view[pos : pos + value_len], FORMAT)
+        pos += value_len
+
+    return info_dict, pos
+
+
+def packing_columnar(data, buffer=None):
+    """
+    Packs the data like packing_schema, except that a leading run of message rows is
+    written column by column.
+    Format:
+    - version: [1 byte] ("5")
+    - type: [2 bytes] ("00" to "16")
+    - messages: [varint row count, then if there are rows a varint 1 if they carry IDs
+      and 0 otherwise, and the columns from _pack_message_columns]
+    - rows: [varint list length, then each remaining dictionary as in packing_schema]
+
+    Args:
+        data: the data object to pack
+        buffer: optional bytearray reused as scratch space between frames
+
+    Returns:
+        bytes: the packed frame
+    """
+    if buffer is None:
+        buffer = bytearray()
+    else:
+        del buffer[:]
+
+    buffer += data["version"].encode(FORMAT)
+    buffer += data["type"].encode(FORMAT)
+
+    info = data["info"]
+    timestamps, ids = _message_timestamps(info)
+    _pack_varint(buffer, len(timestamps))
+    if timestamps:
+        _pack_varint(buffer, ids is not None)
+        _pack_message_columns(buffer, info, timestamps, ids)
+
+    schema = OperationSchemas.get(data["type"], ())
+    field_ids = {field: field_id for field_id, field in enumerate(schema)}
+    rows = info[len(timestamps) :]
+    _pack_varint(buffer, len(rows))
+    for item in rows:
+        _pack_schema_dictionary(buffer, item, schema, field_ids)
+
+    return bytes(buffer)
+
+
+def _message_timestamps(info):
+    """
+    Finds the leading run of message rows that can be written as columns, which
+    either all carry an ID or all do not, as the first row does.
+
+    Returns:
+        tuple: the timestamps of those rows in microseconds since EPOCH and the values
+            of their IDs, or None for the IDs if the rows carry none
+    """
+    timestamps = []
+    ids = [] if info and info[0].keys() == MESSAGE_ID_KEYS else None
+    keys = MESSAGE_KEYS if ids is None else MESSAGE_ID_KEYS
+    for item in info:
+        if item.keys() != keys:
+            break
+        # only timestamps that come back as the exact same string can be sent as integers
+        try:
+            timestamp = datetime.fromisoformat(item["timestamp"])
+        except (TypeError, ValueError):
+            break
+        if timestamp.tzinfo is not None or str(timestamp) != item["timestamp"]:
+            break
+        if ids is not None:
+            # as can IDs
+            message_id = parse_message_id(item["id"])
+            if message_id is None:
+                break
+            ids.append(message_id)
+        timestamps.append((timestamp - EPOCH) // MICROSECOND)
+    return timestamps, ids
+
+
+def _pack_message_columns(buffer, info, timestamps, ids):
+    """
+    Appends message rows column by column.
+    Format:
+    - names: [varint count, then varint length + name for every distinct sender/receiver]
+    - senders: [varint index into names per row]
+    - receivers: [varint index into names per row]
+    - timestamps: [zigzag varint microseconds of the first row, then zigzag varint deltas]
+    - ids: [only if the rows carry IDs, zigzag varint value of the first row's ID, then
+      zigzag varint deltas]
+    - message lengths: [varint length per row]
+    - messages: [all message bodies back to back]
+    """
+    names = {}
+    senders = [names.setdefault(info[i]["sender"], len(names)) for i in range(len(timestamps))]
+    receivers = [names.setdefault(info[i]["receiver"], len(names)) for i in range(len(timestamps))]
+
+    _pack_varint(buffer, len(names))
+    for name in names:
+        name_bytes = str(name).encode(FORMAT)
+        _pack_varint(buffer, len(name_bytes))
+        buffer += name_bytes
+    for index in senders:
+        _pack_varint(buffer, index)
+    for index in receivers:
+        _pack_varint(buffer, index)
+
+    previous = 0
+    for timestamp in timestamps:
+        _pack_varint(buffer, _zigzag(timestamp - previous))
+        previous = timestamp
+
+    if ids is not None:
+        previous = 0
+        for message_id in ids:
+            _pack_varint(buffer, _zigzag(message_id - previous))
+            previous = message_id
+
+    bodies = [str(info[i]["message"]).encode(FORMAT) for i in range(len(timestamps))]
+    for body in bodies:
+        _pack_varint(buffer, len(body))
+    buffer += b"".join(bodies)
+
+
+def unpacking_columnar(data):
+    """
+    Unpacks the data from the columnar format.
+    Format matches packing_columnar function above. Message rows are returned as a
+    MessageTable that only builds each row's dictionary when it is accessed.
+    """
+    # the MessageTable keeps reading from the body, so a pooled receive buffer that is
+    # reused after decoding is copied first
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    view = memoryview(data)
+    decoded_data = {}
+
+    decoded_data["version"] = str(view[0:1], FORMAT)
+    decoded_data["type"] = str(view[1:3], FORMAT)
+
+    row_count, pos = _unpack_varint(view, 3)
+    if row_count:
+        has_ids, pos = _unpack_varint(view, pos)
+        table, pos = _unpack_message_columns(view, pos, row_count, has_ids)
+
+    schema = OperationSchemas.get(decoded_data["type"], ())
+    list_length, pos = _unpack_varint(view, pos)
+    rows = []
+    for _ in range(list_length):
+        item, pos = _unpack_schema_dictionary(view, pos, schema)
+        rows.append(item)
+
+    if row_count:
+        table.rows = rows
+        decoded_data["info"] = table
+    else:
+        decoded_data["info"] = rows
+
+    return decoded_data
+
+
+def _unpack_message_columns(view, pos, row_count, has_ids):
+    """
+    Reads the message columns starting at view[pos].
+
+    Returns:
+        tuple: the MessageTable and the offset just past the columns
+    """
+    name_count, pos = _unpack_varint(view, pos)
+    names = []
+    for _ in range(name_count):
+        name_len, pos = _unpack_varint(view, pos)
+        names.append(str(view[pos : pos + name_len], FORMAT))
+        pos += name_len
+
+    senders = []
+    for _ in range(row_count):
+        index, pos = _unpack_varint(view, pos)
+        senders.append(names[index])
+    receivers = []
+    for _ in range(row_count):
+        index, pos = _unpack_varint(view, pos)
+        receivers.append(names[index])
+
+    timestamps = []
+    previous = 0
+    for _ in range(row_count):
+        delta, pos = _unpack_varint(view, pos)
+        previous += _unzigzag(delta)
+        timestamps.append(previous)
+
+    ids = None
+    if has_ids:
+        ids = []
+        previous = 0
+        for _ in range(row_count):
+            delta, pos = _unpack_varint(view, pos)
+            previous += _unzigzag(delta)
+            ids.append(previous)
+
+    offsets = []
+    lengths = []
+    for _ in range(row_count):
+        length, pos = _unpack_varint(view, pos)
+        lengths.append(length)
+    for length in lengths:
+        offsets.append(pos)
+        pos += length
+
+    return MessageTable(view, senders, receivers, timestamps, offsets, lengths, ids), pos
+
+
+class MessageTable(Sequence):
+    """
+    Read-only list of message dictionaries decoded from the columnar layout.
+
+    Each row's timestamp and message body are only turned into strings when the row
+    is accessed, so a client that shows the last few messages of a large mailbox does
+    not pay for decoding the rest. Rows that followed the messages in the frame are
+    kept in rows and come after the messages.
+    """
+
+    def __init__(self, view, senders, receivers, timestamps, offsets, lengths, ids=None):
+        self.view = view
+        self.senders = senders
+        self.receivers = receivers
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.lengths = lengths
+        # values of the message IDs, None if the messages were sent without them
+        self.ids = ids
+        self.rows = []
+
+    def __len__(self):
+        return len(self.timestamps) + len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        if index >= len(self.timestamps):
+            return self.rows[index - len(self.timestamps)]
+
+        offset = self.offsets[index]
+        row = {
+            "sender": self.senders[index],
+            "receiver": self.receivers[index],
+            "timestamp": str(EPOCH + self.timestamps[index] * MICROSECOND),
+            "message": str(self.view[offset : offset + self.lengths[index]], FORMAT),
+        }
+        if self.ids is not None:
+            row["id"] = format_message_id(self.ids[index])
+        return row
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+
+def _zigzag(value):
+    """Maps a signed integer onto an unsigned one so small magnitudes stay small"""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    """Reverses _zigzag"""
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def _pack_varint(buffer, value):
+    """Appends an unsigned integer to buffer as a little-endian base-128 varint"""
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _unpack_varint(view, pos):
+    """
+    Reads an unsigned base-128 varint starting at view[pos].
+
+    Returns:
+        tuple: the decoded integer and the offset just past it
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = view[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
@@ -0,0 +1,671 @@
+import logging
+import multiprocessing
+import os
+import selectors
+import socket
+import zlib
+from collections import deque
+from datetime import datetime
+from codec_registry import json_dumps, json_loads
+from connection import Connection
+from framing import encode_header
+from message import Message, MessageIds
+from operations import Operations, Version
+from protocol_server import Server
+
+# worker processes started when no count is given
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# step that handles each request and the field naming the user whose shard it starts on
+ROUTES = {
+    Operations.LOGIN.value: ("login", "username"),
+    Operations.CREATE_ACCOUNT.value: ("create_account", "username"),
+    Operations.READ_MESSAGE.value: ("read_message", "username"),
+    Operations.DELETE_ACCOUNT.value: ("delete_account", "username"),
+    Operations.SEND_MESSAGE.value: ("send_message", "sender"),
+    Operations.DELETE_MESSAGE.value: ("delete_message", "sender"),
+}
+
+
+def shard_of(username, shards):
+    """
+    Returns the shard that owns a user. crc32 is used instead of hash() since string
+    hashes are seeded differently in every process.
+
+    Args:
+        username: the username of the user
+        shards: the number of shards
+
+    Returns:
+        int: the index of the owning shard
+    """
+    return zlib.crc32(username.encode("utf-8")) % shards
+
+
+class ShardServer(Server):
+    """
+    Worker process of a ShardedServer.
+
+    Every worker accepts clients on the shared port, but only stores the accounts and
+    active users of the shard it owns. Requests are run as a chain of steps on the
+    shards owning the users they touch, which are passed to other workers over IPC
+    sockets, and the last step sends the reply back to the worker holding the client
+    connection. Steps on this worker's own shard are run directly without IPC.
+    """
+
+    def __init__(self, protocol_version=None, shard=0, shards=1, peers=None):
+        """
+        Args:
+            protocol_version: protocol version the server replies with
+            shard: the index of the shard this worker owns
+            shards: the number of workers
+            peers: connected IPC sockets to the other workers by shard
+        """
+        super().__init__(protocol_version)
+        self.shard = shard
+        self.shards = shards
+        # the shard is the node number of the IDs, so no two workers assign the same ID
+        self.message_ids = MessageIds(shard)
+
+        # IPC connections to the other workers by shard and their shard by socket
+        self.peers = {}
+        self.peer_shards = {}
+        for peer_shard, sock in (peers or {}).items():
+            sock.setblocking(False)
+            data = Connection(sock, f"shard {peer_shard}", json_loads, self.HEADER, self.read_buffer)
+            self.sel.register(sock, selectors.EVENT_READ, data=data)
+            self.peers[peer_shard] = (sock, data)
+            self.peer_shards[sock] = peer_shard
+
+        # client sockets of this worker by connection ID and the other way around. IDs
+        # are never reused, so replies arriving after a client disconnected are dropped
+        self.clients = {}
+        self.client_ids = {}
+        self.next_client_id = 0
+        # requests received while an earlier request of the connection is still running
+        # on other shards, which are processed once its reply arrives to keep replies in order
+        self.pending = {}
+        # number of the request each client is waiting on, so that a reply arriving after
+        # the request was failed is not taken for the reply of a later request
+        self.in_flight = {}
+        self.next_request = 0
+        # users of this shard logged in on a backlogged connection, as reported by the
+        # worker holding the connection, whose messages are stored as unread
+        self.backlogged_users = set()
+
+    def owner(self, username):
+        """Returns the shard that owns the user"""
+        return shard_of(username, self.shards)
+
+    def client_id(self, sock):
+        """
+        Returns the ID of a client connection of this worker, assigning it on first use.
+
+        sock: The socket object
+        """
+        client = self.client_ids.get(sock)
+        if client is None:
+            client = self.next_client_id
+            self.next_client_id += 1
+            self.client_ids[sock] = client
+            self.clients[client] = sock
+        return client
+
+    def create_listening_socket(self, reuse_port=True):
+        # every worker listens on the same port
+        return super().create_listening_socket(reuse_port)
+
+    def run_step(self, shard, step, info, reply_to):
+        """
+        Runs a step of a request on the worker owning the given shard.
+
+        Args:
+            shard: the shard to run the step on
+            step: the name of the step, run by the method step_<name>
+            info: the arguments of the step, which must be JSON serializable when the
+                step runs on another worker
+            reply_to: [shard, connection ID, request number] of the client waiting for
+                the reply, or None
+        """
+        if shard == self.shard:
+            self.execute_step(step, info, reply_to)
+            return
+        if reply_to is None and shard not in self.peers:
+            # no client waits on the step, such as a reply to a client of the lost worker
+            logging.error(f"Dropping step {step} for lost shard {shard}")
+            return
+        sock, data = self.peer(shard)
+        body = json_dumps({"step": step, "info": info, "reply_to": reply_to})
+        data.queue(encode_header(len(body), Version.COMPACT.value), body)
+        self.flush_connection(sock, data)
+
+    def peer(self, shard):
+        """
+        Returns the IPC socket and connection object of another worker.
+
+        shard: the shard of the worker
+
+        Raises:
+            ConnectionError: if the IPC connection to the worker was lost
+        """
+        if shard not in self.peers:
+            raise ConnectionError(f"Lost the connection to shard {shard}")
+        return self.peers[shard]
+
+    def execute_step(self, step, info, reply_to):
+        """
+        Runs a step on this worker, replying with a failure if it raises.
+        """
+        try:
+            getattr(self, f"step_{step}")(info, reply_to)
+        except Exception as e:
+            logging.error(f"Error in step {step}: {e}")
+            if reply_to is not None:
+                self.reply(
+                    reply_to,
+                    self.create_data_object(
+                        self.protocol_version,
+                        Operations.FAILURE.value,
+                        {"message": f"Exception in service_reads {e}"},
+                    ),
+                )
+
+    def reply(self, reply_to, outb, **flags):
+        """
+        Sends the reply of a request to the worker holding the client connection.
+
+        Args:
+            reply_to: [shard, connection ID, request number] of the client
+            outb: the data object to send
+            flags: login with the username that logged in, close if the connection
+                is closed instead of replying
+        """
+        shard, client, request = reply_to
+        self.run_step(shard, "reply", dict(flags, client=client, request=request, outb=outb), None)
+
+    def process_requests(self, sock, data, requests):
+        """
+        Runs the IPC messages received from other workers, or processes the requests of
+        a client in order, holding back those that arrive while an earlier request of
+        the same client is still running on another shard.
+
+        sock: The socket object
+        data: The connection object
+        requests: The decoded requests or IPC messages
+        """
+        if sock in self.peer_shards:
+            for message in requests:
+                if message is not None:
+                    self.execute_step(message["step"], message["info"], message["reply_to"])
+            return
+
+        client = self.client_id(sock)
+        for index, request in enumerate(requests):
+            if data.closed:
+                return
+            if client in self.pending:
+                self.pending[client].extend(requests[index:])
+                return
+            super().process_requests(sock, data, [request])
+
+    def process_request(self, sock, data, recv_data):
+        """
+        Starts a request of a client on the shard owning the user it refers to.
+
+        sock: The socket object
+        data: The connection object
+        recv_data: The decoded request received from the client
+        """
+        # replies are compressed from now on if the client sent a compressed request
+        if recv_data.get("compressed"):
+            data.compression = True
+        recv_data = self.unwrap_data_object(recv_data)
+        recv_operation = recv_data["type"]
+        info = recv_data["info"]
+
+        if recv_operation == Operations.HELLO.value:
+            # every worker registers the same codecs, so it answers without other shards
+            self.send_hello(sock, data)
+            return
+        elif recv_operation == Operations.LIST_ACCOUNTS.value:
+            # every shard adds its matching accounts, starting with this one
+            shard = self.shard
+            step = "list_accounts"
+            info = {
+                "search_string": info["search_string"],
+                "limit": info.get("limit"),
+                "after": info.get("after"),
+                "accounts": [],
+                "more": False,
+                "visited": 0,
+            }
+        elif recv_operation in ROUTES:
+            step, field = ROUTES[recv_operation]
+            shard = self.owner(info[field])
+        else:
+            return
+
+        if shard != self.shard:
+            # fails the request before it is marked as running if the shard is lost
+            self.peer(shard)
+        client = self.client_id(sock)
+        request = self.next_request
+        self.next_request += 1
+        self.pending[client] = deque()
+        self.in_flight[client] = request
+        self.run_step(shard, step, info, [self.shard, client, request])
+
+    def step_reply(self, info, reply_to):
+        """
+        Sends the reply of a request to the client and processes the requests it sent
+        in the meantime.
+        """
+        client = info["client"]
+        username = info.get("login")
+        sock = self.clients.get(client)
+        if sock is None or self.in_flight.get(client) != info["request"]:
+            # the client disconnected, or the request was failed when a shard was lost,
+            # while the request was running on other shards
+            if username is not None:
+                self.logout(username, client)
+            return
+        del self.in_flight[client]
+
+        data = self.connection_data(sock)
+        if username is not None:
+            # a user logged in before on the connection is logged out on its own shard
+            if data.username not in (None, username):
+                self.logout(data.username, client)
+            data.username = username
+        if info.get("close"):
+            logging.info(f"Closing connection to {data.addr}")
+            self.close_connection(sock, data)
+
+        data.outb = info["outb"]
+        self.service_writes(sock, data)
+
+        pending = self.pending.pop(client, None)
+        if pending:
+            self.process_requests(sock, data, list(pending))
+
+    def step_login(self, info, reply_to):
+        username = info["username"]
+        outb = self.login(username, info["password"])
+        if outb["type"] == Operations.SUCCESS.value:
+            # the user is active on the connection that logged in until it is closed
+            self.active_users[username] = reply_to[:2]
+            self.reply(reply_to, outb, login=username)
+        else:
+            self.reply(reply_to, outb)
+
+    def logout(self, username, client):
+        """
+        Removes a user from the active users of its shard if it is still logged in on a
+        connection of this worker.
+
+        username: The username of the user
+        client: The connection ID the user was logged in on
+        """
+        self.run_step(self.owner(username), "logout", {"username": username, "client": [self.shard, client]}, None)
+
+    def step_logout(self, info, reply_to):
+        username = info["username"]
+        # the user may have logged in again on another connection in the meantime
+        if self.active_users.get(username) == info["client"]:
+            del self.active_users[username]
+            self.backlogged_users.discard(username)
+            logging.info(f"{username} has been removed from active users")
+
+    def end_session(self, username):
+        """
+        Removes a user from the active users of this shard and from the connection it is
+        logged in on, which may belong to another worker.
+
+        username: The username of the user
+
+        Returns: [shard, connection ID] the user was logged in on, None if it was not active
+        """
+        location = self.active_users.pop(username, None)
+        self.backlogged_users.discard(username)
+        if location is not None:
+            shard, client = location
+            self.run_step(shard, "session_ended", {"username": username, "client": client}, None)
+        return location
+
+    def step_session_ended(self, info, reply_to):
+        sock = self.clients.get(info["client"])
+        if sock is not None:
+            data = self.connection_data(sock)
+            if data.username == info["username"]:
+                data.username = None
+
+    def step_create_account(self, info, reply_to):
+        self.reply(reply_to, self.create_account(info["username"], info["password"]))
+
+    def step_read_message(self, info, reply_to):
+        self.reply(
+            reply_to,
+            self.read_message(info["username"], info.get("limit"), info.get("before_id"), info.get("since_id")),
+        )
+
+    def step_delete_account(self, info, reply_to):
+        username = info["username"]
+        # the connection is closed if the user is not logged in, as on a single server
+        close = not self.check_valid_user(username)
+        self.reply(reply_to, self.delete_account(username), close=close)
+
+    def step_list_accounts(self, info, reply_to):
+        try:
+            # every shard adds up to a page of its accounts after the cursor
+            usernames, more = self.account_index.page(
+                info["search_string"], info["after"] or None, self.page_limit(info["limit"])
+            )
+            info["accounts"] += usernames
+            info["more"] = info["more"] or more
+        except:
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": "Listing accounts failed"},
+                ),
+            )
+            return
+
+        info["visited"] += 1
+        if info["visited"] < self.shards:
+            self.run_step((self.shard + 1) % self.shards, "list_accounts", info, reply_to)
+            return
+        # every shard adds its accounts in sorted order, and sorting merges those runs
+        usernames = sorted(info["accounts"])
+        limit = self.page_limit(info["limit"])
+        more = info["more"]
+        if limit is not None and len(usernames) > limit:
+            usernames = usernames[:limit]
+            more = True
+        accounts = [{"username": username} for username in usernames]
+        if more:
+            accounts.append({"cursor": usernames[-1]})
+        self.reply(reply_to, self.create_data_object(self.protocol_version, Operations.SUCCESS.value, accounts))
+
+    def step_send_message(self, info, reply_to):
+        # runs on the sender's shard, then on the receiver's shard to store and deliver
+        # the message and on the sender's shard again to store the sender's copy
+        sender = info["sender"]
+        if sender not in self.user_login_database:
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": f"{sender} is not a valid user"},
+                ),
+            )
+            return
+        self.run_step(self.owner(info["receiver"]), "store_message", info, reply_to)
+
+    def step_store_message(self, info, reply_to):
+        sender = info["sender"]
+        receiver = info["receiver"]
+        msg = info["message"]
+        if receiver not in self.user_login_database:
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": f"{receiver} is not a valid user"},
+                ),
+            )
+            return
+        if sender == receiver:
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": "Cannot send a message to yourself"},
+                ),
+            )
+            return
+        if not msg:
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": "message is empty"},
+                ),
+            )
+            return
+
+        message = self.new_message(sender, receiver, msg)
+        if not self.is_deliverable(receiver):
+            self.user_login_database[receiver].unread_messages.add(message)
+        else:
+            self.user_login_database[receiver].messages.add(message)
+            # delivers the message instantly on the worker the receiver is connected to
+            shard, client = self.active_users[receiver]
+            self.run_step(shard, "deliver", {"client": client, "message": f"From {sender}: {msg}"}, None)
+
+        info = dict(info, timestamp=message.timestamp.isoformat(), id=message.id)
+        self.run_step(self.owner(sender), "message_sent", info, reply_to)
+
+    def step_message_sent(self, info, reply_to):
+        sender = info["sender"]
+        receiver = info["receiver"]
+        # the sender's account may have been deleted while the message was stored
+        if sender in self.user_login_database:
+            message = Message(sender, receiver, info["message"], datetime.fromisoformat(info["timestamp"]), info["id"])
+            self.user_login_database[sender].messages.add(message)
+        self.reply(
+            reply_to,
+            self.create_data_object(
+                self.protocol_version,
+                Operations.SUCCESS.value,
+                {"message": f"message from {sender} has been sent to {receiver}"},
+            ),
+        )
+
+    def step_deliver(self, info, reply_to):
+        sock = self.clients.get(info["client"])
+        if sock is not None:
+            self.deliver_now(sock, info["message"])
+
+    def step_delete_message(self, info, reply_to):
+        # runs on the sender's shard and then on the receiver's shard, and a message
+        # named by its fields is looked up on the first shard holding it
+        try:
+            sender = info["sender"]
+            if info.get("id") is None:
+                info["id"] = self.find_message_id(sender, info["receiver"], info["message"], info["timestamp"])
+            if sender in self.user_login_database:
+                self.delete_message_from_user(self.user_login_database[sender], info["id"])
+        except:
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": "Delete message failed"},
+                ),
+            )
+            return
+        self.run_step(self.owner(info["receiver"]), "delete_received_message", info, reply_to)
+
+    def step_delete_received_message(self, info, reply_to):
+        try:
+            receiver = info["receiver"]
+            if info["id"] is None:
+                info["id"] = self.find_message_id(info["sender"], receiver, info["message"], info["timestamp"])
+            if receiver in self.user_login_database:
+                self.delete_message_from_user(self.user_login_database[receiver], info["id"], unread=True)
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.SUCCESS.value,
+                    {"message": "deleted message successfully"},
+                ),
+            )
+        except:
+            self.reply(
+                reply_to,
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": "Delete message failed"},
+                ),
+            )
+
+    def is_deliverable(self, username):
+        return username in self.active_users and username not in self.backlogged_users
+
+    def flush_connection(self, sock, data):
+        if sock not in self.peer_shards:
+            return super().flush_connection(sock, data)
+        # reading from another worker is never paused, since two workers waiting for each
+        # other to read would never resume
+        try:
+            drained = data.flush()
+        except OSError as e:
+            logging.error(f"Error writing to {data.addr}: {e}")
+            self.close_connection(sock, data)
+            return 1
+        self.set_interest(sock, data, True, not drained)
+        return 0
+
+    def set_backlogged(self, sock, data, backlogged):
+        """
+        Marks a client connection as backlogged or caught up again and tells the shard
+        owning the user logged in on it, which stores messages to the user as unread
+        while it is backlogged.
+
+        sock: The socket object
+        data: The connection object
+        backlogged: True if the outbound queue went above the high-water mark
+        """
+        super().set_backlogged(sock, data, backlogged)
+        if data.username is not None:
+            location = [self.shard, self.client_id(sock)]
+            self.run_step(
+                self.owner(data.username),
+                "backlog",
+                {"username": data.username, "client": location, "backlogged": backlogged},
+                None,
+            )
+
+    def step_backlog(self, info, reply_to):
+        username = info["username"]
+        if self.active_users.get(username) != info["client"]:
+            return
+        if info["backlogged"]:
+            self.backlogged_users.add(username)
+        else:
+            self.backlogged_users.discard(username)
+
+    def remove_active_user(self, sock, data):
+        """
+        Forgets a closed client connection and logs out the user logged in on it on the
+        shard owning the user.
+
+        sock: The socket object
+        data: The connection object
+        """
+        if sock in self.peer_shards:
+            self.lose_peer(sock)
+            return
+        client = self.client_ids.pop(sock, None)
+        if client is None:
+            return
+        del self.clients[client]
+        self.pending.pop(client, None)
+        self.in_flight.pop(client, None)
+        if data.username is not None:
+            self.logout(data.username, client)
+            data.username = None
+
+    def lose_peer(self, sock):
+        """
+        Forgets a worker whose IPC connection closed. Its users can no longer be reached,
+        so the users logged in on its connections are logged out and every request still
+        running fails, since this worker cannot tell which shards a request has reached
+        and the reply of one that reached the lost shard would never arrive.
+
+        sock: The IPC socket of the worker
+        """
+        shard = self.peer_shards.pop(sock)
+        del self.peers[shard]
+        logging.error(f"Lost the IPC connection to shard {shard}")
+        for username, location in list(self.active_users.items()):
+            if location[0] == shard:
+                del self.active_users[username]
+                self.backlogged_users.discard(username)
+        for client, request in list(self.in_flight.items()):
+            self.reply(
+                [self.shard, client, request],
+                self.create_data_object(
+                    self.protocol_version,
+                    Operations.FAILURE.value,
+                    {"message": f"Lost the connection to shard {shard}"},
+                ),
+            )
+
+
+def _run_shard(protocol_version, shard, links):
+    """Runs the worker of a shard, closing the IPC sockets of the other workers"""
+    for other, sockets in enumerate(links):
+        if other != shard:
+            for sock in sockets.values():
+                sock.close()
+    ShardServer(protocol_version, shard, len(links), links[shard]).handle_client()
+
+
+class ShardedServer:
+    """
+    Runs a ShardServer per worker process on the same port using SO_REUSEPORT, so
+    that requests are handled on every core. Users are owned by the shard their
+    username hashes to, and the workers are connected to each other by a pair of Unix
+    sockets each.
+    """
+
+    def __init__(self, protocol_version=None, workers=None):
+        """
+        Args:
+            protocol_version: protocol version the server replies with
+            workers: number of worker processes, one per core by default
+        """
+        self.protocol_version = protocol_version
+        self.workers = workers or DEFAULT_WORKERS
+
+    def handle_client(self):
+        """
+        Starts the worker processes and waits for them to exit.
+        """
+        # links[a][b] is the socket worker a uses to talk to worker b
+        links = [{} for _ in range(self.workers)]
+        for a in range(self.workers):
+            for b in range(a + 1, self.workers):
+                links[a][b], links[b][a] = socket.socketpair()
+
+        # the workers inherit the IPC sockets, which requires fork
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=_run_shard, args=(self.protocol_version, shard, links), daemon=True)
+            for shard in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        for sockets in links:
+            for sock in sockets.values():
+                sock.close()
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            logging.error("Caught keyboard interrupt, exiting")
+        finally:
+            for process in processes:
+                process.terminate()
@@ -1,13 +1,37 @@
 import unittest
+from unittest import mock
 import threading
 import time
 import socket
 import selectors
-from datetime import datetime
+import asyncio
+import contextlib
+import multiprocessing
+import os
+from datetime import datetime, timedelta
 import tkinter as tk
 from app import ChatAppGUI
 from protocol_client import Client
 from protocol_server import Server
+from wire_protocol import packing, unpacking, unpacking_data
+from framing import COMPACT_HEADER, COMPACT_VERSIONS, MAX_FRAME_SIZE, BufferPool, FrameDecoder, encode_frame
+from operations import OperationSchemas, Operations
+import benchmark
+import codec_registry
+from account_index import MAX_CHAR, AccountIndex
+from connection import Connection
+from message import Message, MessageIds, format_message_id, parse_message_id
+from user import Mailbox
+from async_server import AsyncServer
+from sharded_server import ShardServer, shard_of
+from threaded_server import ThreadedServer
+from compression import compress_payload, decompress_payload, is_compressed
+from schema_protocol import (
+    packing_schema,
+    unpacking_schema,
+    packing_columnar,
+    unpacking_columnar,
+)
 
 
 class TestChatIntegration(unittest.TestCase):
@@ -204,5 +228,775 @@ class TestChatIntegration(unittest.TestCase):
         self.assertFalse(login_result)
 
 
+class TestWireProtocol(unittest.TestCase):
+    def test_unpacking_round_trip(self):
+        """Test that unpacking returns exactly what was packed"""
+        data = {
+            "version": "1",
+            "type": "00",
+            "info": [
+                {
+                    "sender": "test_user",
+                    "receiver": "test_user3",
+                    "timestamp": str(datetime.now()),
+                    "message": f"h\u00e9llo {i}",
+                }
+                for i in range(100)
+            ],
+        }
+        self.assertEqual(unpacking(packing(data)), data)
+        self.assertEqual(unpacking(bytearray(packing(data))), data)
+
+    def test_unpacking_empty_info(self):
+        """Test that empty info payloads decode the same way as before"""
+        self.assertIsNone(unpacking_data(b""))
+        data = {"version": "1", "type": "00", "info": [{}]}
+        self.assertEqual(unpacking(packing(data)), data)
+
+    def test_frame_decoder_partial_reads(self):
+        """Test that frames split across arbitrary chunks are decoded once complete"""
+        frames = [
+            {"version": "1", "type": "10", "info": [{"username": "a", "password": "b"}]},
+            {"version": "1", "type": "15", "info": [{"username": "a"}]},
+        ]
+        stream = b""
+        for frame in frames:
+            body = packing(frame)
+            stream += f"{len(body):<64}".encode("utf-8") + body
+
+        decoder = FrameDecoder(unpacking)
+        decoded = []
+        for i in range(len(stream)):
+            decoded += decoder.feed(stream[i : i + 1])
+            if i < len(stream) - 1:
+                self.assertLessEqual(len(decoded), 1)
+        self.assertEqual(decoded, frames)
+
+        # several frames arriving in one chunk
+        self.assertEqual(decoder.feed(stream), frames)
+
+    def test_frame_decoder_mixed_framing(self):
+        """Test that compact version 3 frames and 64-byte header frames coexist"""
+        frames = [
+            {"version": "3", "type": "14", "info": [{"sender": "a", "receiver": "b", "message": "hi"}]},
+            {"version": "1", "type": "15", "info": [{"username": "a"}]},
+            {"version": "3", "type": "15", "info": [{"username": "b"}]},
+        ]
+        encoded = [encode_frame(packing(frame), frame["version"]) for frame in frames]
+        self.assertEqual(len(encoded[0]), len(packing(frames[0])) + 4)
+        self.assertEqual(len(encoded[1]), len(packing(frames[1])) + 64)
+
+        stream = b"".join(encoded)
+        decoder = FrameDecoder(unpacking)
+        decoded = []
+        for i in range(0, len(stream), 3):
+            decoded += decoder.feed(stream[i : i + 3])
+        self.assertEqual(decoded, frames)
+
+    def test_schema_round_trip(self):
+        """Test that schema encoding round-trips known, unknown and missing fields"""
+        data = {
+            "version": "4",
+            "type": "14",
+            "info": [
+                {"sender": "test_user", "receiver": "test_user3", "message": "hi"},
+                {"message": "no sender", "priority": "high"},
+                {},
+            ],
+        }
+        self.assertEqual(unpacking_schema(packing_schema(data)), data)
+
+        # operations without a schema fall back to key/value entries
+        data = {"version": "4", "type": "99", "info": [{"username": "test_user"}]}
+        self.assertEqual(unpacking_schema(packing_schema(data)), data)
+
+    def test_schema_skips_fields_appended_by_newer_peers(self):
+        """Test that fields a newer peer appended to a schema are skipped instead of failing the frame"""
+        schema = OperationSchemas[Operations.SEND_MESSAGE.value]
+        data = {
+            "version": "4",
+            "type": Operations.SEND_MESSAGE.value,
+            "info": [{"sender": "alice", "receiver": "bob", "message": "hi", "priority": "high", "ttl": "60"}],
+        }
+        OperationSchemas[Operations.SEND_MESSAGE.value] = schema + ("priority", "ttl")
+        try:
+            body = packing_schema(data)
+        finally:
+            OperationSchemas[Operations.SEND_MESSAGE.value] = schema
+        self.assertEqual(unpacking_schema(body)["info"], [{"sender": "alice", "receiver": "bob", "message": "hi"}])
+
+    def test_schema_smaller_than_wire_protocol(self):
+        """Test that schema encoding roughly halves a send message request"""
+        info = [{"sender": "test_user", "receiver": "test_user3", "message": "hello"}]
+        wire = packing({"version": "1", "type": "14", "info": info})
+        schema = packing_schema({"version": "4", "type": "14", "info": info})
+        self.assertLess(len(schema) * 2, len(wire))
+
+    def test_columnar_round_trip(self):
+        """Test that columnar message lists decode into the same message dictionaries"""
+        messages = [
+            {
+                "sender": "test_user" if i % 2 else "test_user3",
+                "receiver": "test_user3" if i % 2 else "test_user",
+                "timestamp": str(datetime(2024, 3, 14, 15, 30, i % 60, i * 7)),
+                "message": f"message {i}",
+            }
+            for i in range(200)
+        ]
+        # a row that is not a message and a timestamp without microseconds
+        messages[10]["timestamp"] = str(datetime(2024, 3, 14, 15, 31))
+        data = {"version": "5", "type": "00", "info": messages + [{"message": "done"}]}
+
+        decoded = unpacking_columnar(packing_columnar(data))
+        self.assertEqual(len(decoded["info"]), len(data["info"]))
+        self.assertEqual(decoded["info"][-3:], data["info"][-3:])
+        self.assertEqual(list(decoded["info"]), data["info"])
+
+        wire = packing({"version": "1", "type": "00", "info": messages})
+        self.assertLess(len(packing_columnar(data)) * 3, len(wire))
+
+        # rows that carry the IDs assigned by the server keep them as a column
+        ids = MessageIds()
+        for message in messages:
+            message["id"] = ids.assign(datetime.fromisoformat(message["timestamp"]))
+        data = {"version": "5", "type": "00", "info": messages}
+        decoded = unpacking_columnar(packing_columnar(data))
+        self.assertEqual(len(decoded["info"].timestamps), len(messages))
+        self.assertEqual(list(decoded["info"]), messages)
+
+    def test_compression_round_trip(self):
+        """Test that large frames are deflated and small frames are stored"""
+        accounts = [{"username": f"test_user{i}"} for i in range(500)]
+        body = packing({"version": "1", "type": "00", "info": accounts})
+        compressed = compress_payload(body)
+        self.assertTrue(is_compressed(compressed))
+        self.assertLess(len(compressed) * 5, len(body))
+        self.assertEqual(decompress_payload(compressed), body)
+
+        body = packing({"version": "1", "type": "00", "info": [{"message": "Account created"}]})
+        stored = compress_payload(body)
+        self.assertTrue(is_compressed(stored))
+        self.assertEqual(len(stored), len(body) + 2)
+        self.assertEqual(decompress_payload(stored), body)
+        self.assertFalse(is_compressed(body))
+
+        # a small frame that would inflate past the limit is rejected
+        bomb = compress_payload(b"1" + bytes(8 << 20))
+        self.assertLess(len(bomb), 10000)
+        self.assertEqual(len(decompress_payload(bomb)), (8 << 20) + 1)
+        with self.assertRaises(ValueError):
+            decompress_payload(bomb, max_size=1 << 20)
+
+    def test_benchmark_covers_every_operation(self):
+        """Test that the benchmark generates every operation and runs every codec"""
+        payloads = benchmark.build_payloads(sizes=(3,))
+        self.assertEqual({data["type"] for _, _, data in payloads}, {op.value for op in Operations})
+
+        results = benchmark.run_benchmarks(sizes=(3,), min_time=0)
+        self.assertEqual({result["codec"] for result in results}, set(benchmark._codecs()))
+        for result in results:
+            self.assertGreater(result["bytes"], 0)
+            self.assertGreater(result["encode_ops"], 0)
+
+    def test_constant_reply_cache(self):
+        """Test that fixed replies are framed once and decode like a packed data object"""
+        server = Server(protocol_version="4")
+        expected = {"version": "4", "type": "01", "info": [{"message": "must supply username and password"}]}
+        self.assertEqual(server.create_account("", ""), expected)
+        reply = server.cached_reply(server.create_account("", ""))
+        self.assertIs(server.cached_reply(expected), reply)
+
+        self.assertEqual(reply.compressed_length, len(reply.compressed_frame) - len(reply.frame) + reply.length)
+        frames = FrameDecoder(server.wire_protocol_receive).feed(reply.frame + reply.compressed_frame)
+        self.assertEqual(frames[0], expected)
+        self.assertEqual(frames[1], dict(expected, compressed=True))
+
+        # replies built from user data are never cached
+        server.create_account("alice", "pw")
+        self.assertIsNone(server.cached_reply(server.login("alice", "pw")))
+        self.assertNotIn(("4", "00", "0"), server.reply_cache)
+
+    def test_codec_registry(self):
+        """Test that a registered codec is used for encoding, decoding and framing"""
+        def encode(data, buffer=None):
+            return ("9" + data["type"] + data["info"][0]["message"]).encode("utf-8")
+
+        def decode(body):
+            text = body.decode("utf-8")
+            return {"version": text[0], "type": text[1:3], "info": [{"message": text[3:]}]}
+
+        codec_registry.register_codec("9", encode, decode)
+        try:
+            data = {"version": "9", "type": "00", "info": [{"message": "hello"}]}
+            body = codec_registry.encode(data)
+            self.assertEqual(codec_registry.decode(body), data)
+            self.assertEqual(len(encode_frame(body, "9")), len(body) + 4)
+            self.assertIn("9", codec_registry.supported_versions())
+        finally:
+            del codec_registry.CODECS["9"]
+            COMPACT_VERSIONS.discard("9")
+
+        body = codec_registry.encode({"version": "2", "type": "00", "info": [{"message": "hi"}]})
+        self.assertEqual(codec_registry.decode(body)["info"], [{"message": "hi"}])
+        self.assertIsNone(codec_registry.decode(b"8"))
+
+    def test_connection_flush_resumes_partial_sends(self):
+        """Test that queued buffers are drained in order across partial sends without blocking"""
+        server_sock, client_sock = socket.socketpair()
+        try:
+            server_sock.setblocking(False)
+            connection = Connection(server_sock, "test", None, 64)
+            payload = bytes(range(256)) * 8192
+            connection.queue(payload[:10], b"", payload[10:500000])
+            connection.queue(payload[500000:])
+            self.assertFalse(connection.flush())
+
+            received = bytearray()
+            while not connection.flush() or len(received) < len(payload):
+                received += client_sock.recv(65536)
+            self.assertEqual(received, payload)
+            self.assertFalse(connection.outbound)
+        finally:
+            server_sock.close()
+            client_sock.close()
+
+    def test_write_interest_only_while_replies_are_queued(self):
+        """Test that a connection is only registered for write events while it has unsent replies"""
+        server = Server()
+        server_sock, client_sock = socket.socketpair()
+        try:
+            server_sock.setblocking(False)
+            data = Connection(server_sock, "test", None, 64)
+            server.sel.register(server_sock, selectors.EVENT_READ, data=data)
+
+            # larger than the socket buffer but below the high-water mark
+            data.outb = server.create_data_object("1", "00", [{"username": f"user{i}"} for i in range(30000)])
+            self.assertEqual(server.service_writes(server_sock, data), 0)
+            self.assertTrue(data.write_interest)
+            self.assertEqual(server.sel.get_key(server_sock).events, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+            client_sock.setblocking(False)
+            while data.outbound:
+                try:
+                    client_sock.recv(1 << 20)
+                except BlockingIOError:
+                    pass
+                server.service_writes(server_sock, data)
+            self.assertFalse(data.write_interest)
+            self.assertEqual(server.sel.get_key(server_sock).events, selectors.EVENT_READ)
+        finally:
+            server.sel.close()
+            server_sock.close()
+            client_sock.close()
+
+    def test_frame_decoder_receives_large_frames_into_pool(self):
+        """Test that large bodies are received into pooled buffers that are reused"""
+        messages = [
+            {"sender": "alice", "receiver": "bob", "timestamp": str(datetime(2026, 1, 1, 12, 0, i % 60)), "message": f"hi {i}"}
+            for i in range(20000)
+        ]
+        small = {"version": "3", "type": "00", "info": [{"message": "Account created"}]}
+        stream = encode_frame(packing_columnar(dict(version="5", type="00", info=messages)), "5") + encode_frame(
+            packing(small), "3"
+        )
+
+        server_sock, client_sock = socket.socketpair()
+        try:
+            server_sock.setblocking(False)
+            pool = BufferPool()
+            decode = lambda body: unpacking_columnar(body) if body[0:1] == b"5" else unpacking(body)
+            decoder = FrameDecoder(decode, pool=pool)
+            frames = []
+            pooled = []
+            for _ in range(2):
+                for i in range(0, len(stream), 20000):
+                    client_sock.sendall(stream[i : i + 20000])
+                    while True:
+                        try:
+                            frames += decoder.receive(server_sock)
+                        except BlockingIOError:
+                            break
+                pooled.append({id(buffer) for buffer in pool.buffers})
+            client_sock.close()
+            self.assertIsNone(decoder.receive(server_sock))
+        finally:
+            server_sock.close()
+
+        self.assertEqual(len(frames), 4)
+        self.assertEqual(frames[0]["info"], messages)
+        self.assertEqual(frames[2]["info"], messages)
+        self.assertEqual(frames[3], small)
+        # the buffers of the first large body were released and reused for the second
+        self.assertTrue(pooled[0])
+        self.assertEqual(pooled[0], pooled[1])
+
+    def test_frame_decoder_rejects_oversized_headers(self):
+        """Test that a header declaring a huge body is rejected before anything is allocated"""
+        for header in (COMPACT_HEADER.pack(0x10000000), f"{1 << 30:<64}".encode()):
+            pool = BufferPool()
+            decoder = FrameDecoder(pool=pool)
+            with self.assertRaises(ValueError):
+                decoder.feed(header)
+            self.assertIsNone(decoder.body)
+
+        # bodies that are allowed only grow their buffer as their bytes arrive
+        decoder = FrameDecoder()
+        decoder.feed(COMPACT_HEADER.pack(MAX_FRAME_SIZE) + b"x" * 1000)
+        self.assertLess(len(decoder.body), MAX_FRAME_SIZE // 100)
+
+    def listen_on_free_port(self):
+        """
+        Points the HOST and PORT the servers listen on at a free local port until the
+        test ends, restoring the environment afterwards.
+
+        Returns: the port
+        """
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        environment = mock.patch.dict(os.environ, {"HOST": "127.0.0.1", "PORT": str(port)})
+        environment.start()
+        self.addCleanup(environment.stop)
+        return port
+
+    def test_async_server_round_trip(self):
+        """Test that the asyncio server runs the same handlers as the selectors server"""
+        port = self.listen_on_free_port()
+
+        async def exchange():
+            server_task = asyncio.create_task(AsyncServer("3").serve())
+            try:
+                for _ in range(100):
+                    try:
+                        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                        break
+                    except OSError:
+                        await asyncio.sleep(0.01)
+                decoder = FrameDecoder(unpacking)
+                frames = []
+                # the server only advertises its versions to clients that ask
+                writer.write(encode_frame(packing({"version": "3", "type": "03", "info": [{}]}), "3"))
+                for info in ({"username": "alice", "password": "pw"}, {"username": "", "password": ""}):
+                    writer.write(encode_frame(packing({"version": "3", "type": "11", "info": [info]}), "3"))
+                while len(frames) < 3:
+                    frames += decoder.feed(await reader.read(65536))
+                writer.close()
+                return frames
+            finally:
+                # closes the listening socket before the event loop ends
+                server_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await server_task
+
+        frames = asyncio.run(exchange())
+        self.assertEqual(frames[0]["type"], "03")
+        self.assertIn("3", frames[0]["info"][0]["versions"].split(","))
+        self.assertEqual(frames[1]["info"], [{"message": "Account created"}])
+        self.assertEqual(frames[2]["info"], [{"message": "must supply username and password"}])
+
+    def test_sharded_server_routes_between_shards(self):
+        """Test that requests about users owned by the other worker are run on its shard"""
+        port = self.listen_on_free_port()
+        self.assertNotEqual(shard_of("alice", 2), shard_of("bob", 2))
+
+        # the workers run in their own processes, like those of ShardedServer, so that
+        # they can be stopped once the test ends
+        links = socket.socketpair()
+        context = multiprocessing.get_context("fork")
+        for shard in range(2):
+            server = ShardServer("3", shard, 2, {1 - shard: links[shard]})
+            worker = context.Process(target=server.handle_client, daemon=True)
+            worker.start()
+            self.addCleanup(worker.join)
+            self.addCleanup(worker.terminate)
+            server.sel.close()
+        for sock in links:
+            sock.close()
+
+        def connect():
+            for _ in range(100):
+                try:
+                    return socket.create_connection(("127.0.0.1", port))
+                except OSError:
+                    time.sleep(0.01)
+
+        clients = {"alice": connect(), "bob": connect()}
+        decoders = {name: FrameDecoder(unpacking) for name in clients}
+        delivered = []
+
+        def request(name, operation, info):
+            clients[name].sendall(encode_frame(packing({"version": "3", "type": operation, "info": [info]}), "3"))
+            while True:
+                for frame in decoders[name].feed(clients[name].recv(65536)):
+                    if frame["type"] == "02":
+                        delivered.append(frame["info"])
+                    else:
+                        return frame["info"]
+
+        try:
+            self.assertIn("3", request("alice", "03", {})[0]["versions"].split(","))
+            for name in clients:
+                self.assertEqual(request(name, "11", {"username": name, "password": "pw"}), [{"message": "Account created"}])
+            self.assertEqual(request("alice", "11", {"username": "bob", "password": "pw"}), [{"message": "username is taken"}])
+            for name in clients:
+                self.assertEqual(request(name, "10", {"username": name, "password": "pw"}), [{"message": "0"}])
+            self.assertEqual(
+                request("alice", "14", {"sender": "alice", "receiver": "bob", "message": "hi"}),
+                [{"message": "message from alice has been sent to bob"}],
+            )
+            self.assertEqual(request("alice", "14", {"sender": "alice", "receiver": "carol", "message": "hi"}), [{"message": "carol is not a valid user"}])
+            self.assertEqual(sorted(account["username"] for account in request("alice", "13", {"search_string": ""})), ["alice", "bob"])
+            self.assertEqual([message["message"] for message in request("bob", "15", {"username": "bob"})], ["hi"])
+            self.assertEqual([message["message"] for message in request("alice", "15", {"username": "alice"})], ["hi"])
+            # the delivery is sent to bob once the delivery window has passed
+            time.sleep(ShardServer.DELIVERY_WINDOW * 5)
+            request("bob", "13", {"search_string": "bob"})
+            self.assertEqual(delivered, [[{"message": "From alice: hi"}]])
+        finally:
+            for sock in clients.values():
+                sock.close()
+
+    def test_sharded_server_fails_requests_of_lost_shard(self):
+        """Test that requests waiting on another worker fail once its IPC connection closes"""
+        remote = next(name for name in ("alice", "bob", "carol") if shard_of(name, 2) == 1)
+        local = next(name for name in ("alice", "bob", "carol") if shard_of(name, 2) == 0)
+        links = socket.socketpair()
+        server = ShardServer("3", 0, 2, {1: links[0]})
+        server_sock, client_sock = socket.socketpair()
+        try:
+            server_sock.setblocking(False)
+            server.register_connection(server_sock, "test")
+            data = server.connection_data(server_sock)
+            decoder = FrameDecoder(unpacking)
+
+            def request(operation, info):
+                server.process_requests(server_sock, data, [{"version": "3", "type": operation, "info": [info]}])
+                return decoder.feed(client_sock.recv(65536))
+
+            # the request runs on the other worker, which never replies before it is lost
+            server.process_requests(server_sock, data, [{"version": "3", "type": "11", "info": [{"username": remote, "password": "pw"}]}])
+            links[1].close()
+            server.close_connection(*server.peers[1])
+            self.assertEqual(decoder.feed(client_sock.recv(65536))[0]["info"], [{"message": "Lost the connection to shard 1"}])
+
+            self.assertEqual(
+                request("11", {"username": remote, "password": "pw"})[0]["info"],
+                [{"message": "Exception in service_reads Lost the connection to shard 1"}],
+            )
+            self.assertEqual(request("11", {"username": local, "password": "pw"})[0]["info"], [{"message": "Account created"}])
+            # a late reply of the failed request is dropped
+            late = server.create_data_object("3", "00", {"message": "Account created"})
+            server.step_reply({"client": server.client_id(server_sock), "request": 0, "outb": late}, None)
+            client_sock.setblocking(False)
+            with self.assertRaises(BlockingIOError):
+                client_sock.recv(65536)
+        finally:
+            server.sel.close()
+            server_sock.close()
+            client_sock.close()
+
+    def test_threaded_server_hands_deliveries_to_other_reactors(self):
+        """Test that clients on different reactor threads can message each other"""
+        server = ThreadedServer("3", 2)
+        for reactor in server.reactors:
+            reactor.thread.start()
+            self.addCleanup(reactor.thread.join)
+            self.addCleanup(reactor.call_soon, reactor.stop)
+
+        # clients are accepted on this thread instead of by handle_client, whose
+        # acceptor blocks in accept until the process exits
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+        clients = {}
+        for name in ("alice", "bob"):
+            clients[name] = socket.create_connection(listener.getsockname())
+            server.accept_wrapper(listener)
+        decoders = {name: FrameDecoder(unpacking) for name in clients}
+
+        def frames(name, count):
+            received = []
+            while len(received) < count:
+                received += decoders[name].feed(clients[name].recv(65536))
+            return received
+
+        try:
+            for name in clients:
+                for operation in ("11", "10"):
+                    clients[name].sendall(
+                        encode_frame(packing({"version": "3", "type": operation, "info": [{"username": name, "password": "pw"}]}), "3")
+                    )
+                self.assertEqual([frame["type"] for frame in frames(name, 2)], ["00", "00"])
+            # the server marks a user active right after sending the login reply
+            while "bob" not in server.active_users:
+                time.sleep(0.01)
+
+            clients["alice"].sendall(
+                encode_frame(packing({"version": "3", "type": "14", "info": [{"sender": "alice", "receiver": "bob", "message": "hi"}]}), "3")
+            )
+            self.assertEqual(frames("alice", 1)[0]["info"], [{"message": "message from alice has been sent to bob"}])
+            self.assertEqual(frames("bob", 1)[0]["info"], [{"message": "From alice: hi"}])
+            # round-robin placed the two clients on different reactors
+            reactors = [server.reactors_by_sock[server.active_users[name]] for name in clients]
+            self.assertIsNot(reactors[0], reactors[1])
+        finally:
+            for sock in clients.values():
+                sock.close()
+
+    def test_reactor_survives_failing_callbacks(self):
+        """Test that an exception in a reactor callback is logged instead of ending the reactor thread"""
+        server = ThreadedServer("3", 1)
+        reactor = server.reactors[0]
+        reactor.thread.start()
+        self.addCleanup(reactor.thread.join)
+        self.addCleanup(reactor.call_soon, reactor.stop)
+        done = threading.Event()
+
+        def fail():
+            raise KeyError("gone")
+
+        with self.assertLogs(level="ERROR"):
+            reactor.call_soon(fail)
+            reactor.call_soon(done.set)
+            self.assertTrue(done.wait(5))
+        self.assertTrue(reactor.thread.is_alive())
+
+    def test_sessions_index_active_users_both_ways(self):
+        """Test that logins, account deletions and disconnects keep active_users and the connections in sync"""
+        server = Server()
+        pairs = [socket.socketpair() for _ in range(2)]
+        try:
+            socks = [server_sock for server_sock, _ in pairs]
+            connections = []
+            for sock in socks:
+                sock.setblocking(False)
+                connections.append(Connection(sock, "test", None, 64))
+                server.sel.register(sock, selectors.EVENT_READ, data=connections[-1])
+            for username in ("alice", "bob", "carol"):
+                server.create_account(username, "pw")
+
+            server.start_session(socks[0], connections[0], "alice")
+            server.start_session(socks[1], connections[1], "bob")
+            # logging in as another user on the same connection ends the previous session
+            server.start_session(socks[0], connections[0], "carol")
+            self.assertEqual(server.active_users, {"bob": socks[1], "carol": socks[0]})
+            self.assertEqual([data.username for data in connections], ["carol", "bob"])
+
+            server.delete_account("bob")
+            self.assertIsNone(connections[1].username)
+            server.close_connection(socks[0], connections[0])
+            self.assertEqual(server.active_users, {})
+            self.assertIsNone(connections[0].username)
+        finally:
+            server.sel.close()
+            for pair in pairs:
+                for sock in pair:
+                    sock.close()
+
+    def test_backlogged_connection_pauses_reads_and_diverts_deliveries(self):
+        """Test that a client that stops reading is paused and gets its messages as unread until it catches up"""
+        server = Server()
+        pairs = [socket.socketpair() for _ in range(2)]
+        try:
+            socks = [server_sock for server_sock, _ in pairs]
+            connections = []
+            for sock, username in zip(socks, ("alice", "bob")):
+                sock.setblocking(False)
+                connections.append(Connection(sock, username, None, 64))
+                server.sel.register(sock, selectors.EVENT_READ, data=connections[-1])
+                server.create_account(username, "pw")
+                server.start_session(sock, connections[-1], username)
+            bob_sock, bob = socks[1], connections[1]
+
+            bob.outb = server.create_data_object("1", "00", [{"username": f"user{i}"} for i in range(100000)])
+            server.service_writes(bob_sock, bob)
+            self.assertTrue(bob.backlogged)
+            self.assertEqual(server.sel.get_key(bob_sock).events, selectors.EVENT_WRITE)
+            self.assertFalse(server.is_deliverable("bob"))
+            server.send_message("alice", "bob", "while backlogged")
+            self.assertEqual([message.message for message in server.user_login_database["bob"].unread_messages], ["while backlogged"])
+
+            pairs[1][1].setblocking(False)
+            while bob.backlogged:
+                try:
+                    pairs[1][1].recv(1 << 20)
+                except BlockingIOError:
+                    pass
+                server.service_writes(bob_sock, bob)
+            self.assertEqual(server.sel.get_key(bob_sock).events & selectors.EVENT_READ, selectors.EVENT_READ)
+            self.assertTrue(server.is_deliverable("bob"))
+        finally:
+            server.sel.close()
+            for pair in pairs:
+                for sock in pair:
+                    sock.close()
+
+    def test_deliveries_within_window_share_one_frame(self):
+        """Test that messages delivered to a client within the delivery window are sent in one frame"""
+        server = Server("3")
+        server_sock, client_sock = socket.socketpair()
+        try:
+            server_sock.setblocking(False)
+            data = Connection(server_sock, "test", None, 64)
+            server.sel.register(server_sock, selectors.EVENT_READ, data=data)
+
+            for i in range(3):
+                server.deliver_now(server_sock, f"From alice: {i}")
+            self.assertEqual(len(server.delivery_queue), 1)
+            self.assertGreater(server.send_due_deliveries(server.delivery_queue), 0)
+            self.assertFalse(data.outbound)
+
+            time.sleep(server.DELIVERY_WINDOW)
+            self.assertIsNone(server.send_due_deliveries(server.delivery_queue))
+            frames = FrameDecoder(codec_registry.decode).feed(client_sock.recv(65536))
+            self.assertEqual([frame["type"] for frame in frames], ["02"])
+            self.assertEqual(frames[0]["info"], [{"message": f"From alice: {i}"} for i in range(3)])
+        finally:
+            server.sel.close()
+            server_sock.close()
+            client_sock.close()
+
+    def test_mailbox_keeps_time_order(self):
+        """Test that the mailbox keeps messages in timestamp order however they are added"""
+        timestamps = [datetime(2025, 1, 1, 12, 0, second) for second in range(6)]
+        mailbox = Mailbox()
+        for second in (0, 2, 4):
+            mailbox.add(Message("alice", "bob", f"m{second}", timestamps[second], f"id{second}"))
+        # unread messages merged in after newer messages were delivered
+        mailbox.extend(Message("carol", "bob", f"m{second}", timestamps[second], f"id{second}") for second in (1, 3, 5))
+        self.assertEqual([message.message for message in mailbox], [f"m{second}" for second in range(6)])
+
+        # removed messages stay behind as tombstones until half of the list is removed
+        self.assertEqual(mailbox.remove("id1").message, "m1")
+        self.assertIsNone(mailbox.remove("id1"))
+        self.assertEqual(len(mailbox.messages), 6)
+        self.assertEqual([message.message for message in mailbox], ["m0", "m2", "m3", "m4", "m5"])
+        mailbox.remove("id3")
+        mailbox.remove("id5")
+        self.assertEqual(len(mailbox.messages), 6)
+        mailbox.remove("id0")
+        self.assertEqual([message.message for message in mailbox.messages], ["m2", "m4"])
+        self.assertEqual(len(mailbox), 2)
+        self.assertNotIn("id0", mailbox)
+        self.assertEqual(mailbox[-1].timestamp, timestamps[4])
+
+    def test_mailbox_pages_after_clock_is_set_back(self):
+        """Test that a message sent after the clock went back keeps its place by ID in pages"""
+        ids = MessageIds()
+        mailbox = Mailbox()
+        for second in range(4):
+            timestamp = datetime(2025, 1, 1, 12, 0, second)
+            mailbox.add(Message("alice", "bob", f"m{second}", timestamp, ids.assign(timestamp)))
+        # the clock went back a minute, so the newest message has the oldest timestamp
+        timestamp = datetime(2025, 1, 1, 11, 59, 0)
+        latest = Message("alice", "bob", "m4", timestamp, ids.assign(timestamp))
+        mailbox.add(latest)
+        self.assertIs(mailbox[-1], latest)
+
+        messages, more = mailbox.page(2, before_id=latest.id)
+        self.assertEqual([message.message for message in messages], ["m2", "m3"])
+        self.assertTrue(more)
+        messages, more = mailbox.page(since_id=messages[-1].id)
+        self.assertEqual([message.message for message in messages], ["m4"])
+        self.assertFalse(more)
+
+    def test_message_ids_sort_by_timestamp(self):
+        """Test that message IDs are unique, sort in timestamp order and keep the node apart"""
+        ids = MessageIds(3)
+        timestamp = datetime(2025, 1, 1, 12, 0, 0, 5)
+        assigned = [ids.assign(timestamp) for _ in range(3)] + [ids.assign(timestamp + timedelta(microseconds=1))]
+        self.assertEqual(len(set(assigned)), 4)
+        self.assertEqual(sorted(assigned), assigned)
+        self.assertNotIn(MessageIds(4).assign(timestamp), assigned)
+        # the clock being set back does not make IDs go back
+        self.assertGreater(ids.assign(timestamp - timedelta(seconds=1)), assigned[-1])
+        self.assertEqual(format_message_id(parse_message_id(assigned[0])), assigned[0])
+        self.assertIsNone(parse_message_id("not an id"))
+
+    def test_delete_message_by_id_or_fields(self):
+        """Test that messages are deleted by their ID and, for older clients, by their fields"""
+        server = Server("3")
+        for username in ("alice", "bob"):
+            server.create_account(username, "pw")
+        for i in range(3):
+            server.send_message("alice", "bob", f"m{i}")
+        messages = server.read_message("bob")["info"]
+        self.assertEqual(len({message["id"] for message in messages}), 3)
+
+        server.delete_message("alice", "bob", None, None, messages[0]["id"])
+        server.delete_message("alice", "bob", messages[1]["message"], messages[1]["timestamp"])
+        for username in ("alice", "bob"):
+            self.assertEqual([message["message"] for message in server.read_message(username)["info"]], ["m2"])
+        reply = server.delete_message("alice", "bob", "m2", "not a timestamp")
+        self.assertEqual(reply["type"], Operations.FAILURE.value)
+
+    def test_account_index_prefix_search(self):
+        """Test that the account index finds exactly the usernames starting with a prefix, in order"""
+        usernames = ["bob", "alice", "al", "alfred", "b" + MAX_CHAR, "b" + MAX_CHAR + "x", "carol", "ally"]
+        index = AccountIndex(usernames)
+        for prefix in ("", "al", "ali", "b", "b" + MAX_CHAR, "c", "d", MAX_CHAR):
+            self.assertEqual(index.search(prefix), sorted(u for u in usernames if u.startswith(prefix)))
+
+        server = Server("3")
+        for username in usernames:
+            server.create_account(username, "pw")
+        server.delete_account("alice")
+        self.assertNotIn("alice", server.account_index)
+        self.assertEqual([account["username"] for account in server.list_accounts("al")["info"]], ["al", "alfred", "ally"])
+
+    def test_list_accounts_pages(self):
+        """Test that LIST_ACCOUNTS with a limit returns pages that continue after the cursor"""
+        server = Server("3")
+        usernames = [f"user{i:02}" for i in range(25)] + ["other"]
+        for username in usernames:
+            server.create_account(username, "pw")
+
+        pages = []
+        after = None
+        while True:
+            info = server.list_accounts("user", 10, after)["info"]
+            after = info.pop()["cursor"] if "cursor" in info[-1] else None
+            pages.append([account["username"] for account in info])
+            if after is None:
+                break
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), usernames[:-1])
+
+        # without a limit every account is returned and no cursor is added
+        self.assertEqual(len(server.list_accounts("")["info"]), 26)
+        server.MAX_PAGE_SIZE = 4
+        self.assertEqual(len(server.list_accounts("", "100")["info"]), 5)
+        self.assertEqual(server.list_accounts("", "0")["type"], Operations.FAILURE.value)
+
+    def test_read_message_pages(self):
+        """Test that READ_MESSAGE with a limit returns the latest messages and pages back by cursor"""
+        server = Server("3")
+        for username in ("alice", "bob"):
+            server.create_account(username, "pw")
+        for i in range(25):
+            server.send_message("alice", "bob", f"m{i}")
+        server.delete_message("alice", "bob", None, None, server.read_message("bob")["info"][20]["id"])
+        expected = [f"m{i}" for i in range(25) if i != 20]
+
+        pages = []
+        before_id = None
+        while True:
+            info = server.read_message("bob", 10, before_id)["info"]
+            page_info = info.pop()
+            self.assertEqual(page_info["total"], 24)
+            before_id = page_info.get("cursor")
+            pages.insert(0, [message["message"] for message in info])
+            if before_id is None:
+                break
+        self.assertEqual([len(page) for page in pages], [4, 10, 10])
+        self.assertEqual(sum(pages, []), expected)
+
+        # since_id only returns the messages after it, and no limit reads every message
+        since_id = server.read_message("bob")["info"][-3]["id"]
+        info = server.read_message("bob", None, None, since_id)["info"]
+        self.assertEqual([message.get("message") for message in info], ["m23", "m24", None])
+        self.assertEqual(len(server.read_message("bob")["info"]), 24)
+
+
 if __name__ == "__main__":
     unittest.main()
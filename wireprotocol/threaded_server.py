@@ -0,0 +1,317 @@
+import itertools
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from connection import Connection
+from framing import RECV_SIZE, BufferPool
+from protocol_server import Server
+
+# reactor threads started when no count is given
+DEFAULT_REACTORS = os.cpu_count() or 1
+# number of locks the mailboxes of the users are spread over
+LOCK_STRIPES = 64
+
+
+class Reactor:
+    """
+    Thread running its own selector loop over the client connections handed to it.
+
+    Other threads never touch the connections of a reactor directly, but hand it
+    callbacks with call_soon, which are run on the reactor's thread the next time it
+    wakes up.
+    """
+
+    def __init__(self, server, index):
+        """
+        Args:
+            server: the ThreadedServer whose handlers serve the connections
+            index: the number of the reactor, used to name its thread
+        """
+        self.server = server
+        self.sel = selectors.DefaultSelector()
+        # connections of a reactor are only read from its thread, so they share a
+        # read buffer and buffer pool that no other thread uses
+        self.read_buffer = bytearray(RECV_SIZE)
+        self.pool = BufferPool()
+        # callbacks handed over by other threads and the socket pair that wakes up the
+        # selector when one is added
+        self.callbacks = deque()
+        # deliveries of the reactor's connections waiting for their window to pass
+        self.delivery_queue = deque()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.sel.register(self.wakeup_recv, selectors.EVENT_READ, data=None)
+        # cleared by stop to end the loop of run
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"reactor-{index}", daemon=True)
+
+    def call_soon(self, callback, *args):
+        """
+        Runs a callback on the reactor's thread, which can be called from any thread.
+
+        Args:
+            callback: the function to run
+            args: the arguments to call it with
+        """
+        self.callbacks.append((callback, args))
+        try:
+            self.wakeup_send.send(b"\0")
+        except BlockingIOError:
+            # the reactor has plenty of wakeups pending already
+            pass
+
+    def stop(self):
+        """
+        Closes the reactor's connections and ends its loop. It must run on the reactor's
+        thread, so other threads hand it over with call_soon.
+        """
+        for key in list(self.sel.get_map().values()):
+            if key.data is not None:
+                self.server.close_connection(key.fileobj, key.data)
+        self.running = False
+
+    def in_thread(self):
+        """Returns True if called from the reactor's thread"""
+        return threading.current_thread() is self.thread
+
+    def register(self, conn, addr):
+        """
+        Registers a client socket handed over by the acceptor.
+
+        conn: the non-blocking client socket
+        addr: the address of the client
+        """
+        data = Connection(
+            conn, addr, self.server.wire_protocol_receive, self.server.HEADER, self.read_buffer, self.pool
+        )
+        self.server.reactors_by_sock[conn] = self
+        self.server.connections[conn] = data
+        self.sel.register(conn, selectors.EVENT_READ, data=data)
+
+    def run(self):
+        """
+        Serves the reactor's connections and runs the callbacks of other threads. An
+        error serving a connection closes only that connection, and an error in a
+        callback is logged, so neither ends the thread and strands its other clients.
+        """
+        timeout = None
+        while self.running:
+            for key, mask in self.sel.select(timeout=timeout):
+                if key.data is None:
+                    try:
+                        while self.wakeup_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    while self.callbacks:
+                        callback, args = self.callbacks.popleft()
+                        try:
+                            callback(*args)
+                        except Exception as e:
+                            logging.error(f"Error in {callback.__name__} on {self.thread.name}: {e}")
+                else:
+                    try:
+                        self.server.service_connection(key, mask)
+                    except Exception as e:
+                        logging.error(f"Error serving {key.data.addr}: {e}")
+                        self.server.close_connection(key.fileobj, key.data)
+            timeout = self.server.send_due_deliveries(self.delivery_queue)
+        self.sel.close()
+
+
+class HeldLocks:
+    """Context manager holding a list of locks, taken in order and released in reverse"""
+
+    __slots__ = ("locks",)
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+class ThreadedServer(Server):
+    """
+    Server that accepts clients on one thread and hands them round-robin to a number
+    of reactor threads, each running its own selector loop.
+
+    Socket calls release the GIL, so the reactors read and write concurrently while the
+    handlers run one at a time. The accounts and active users are protected by one lock
+    and the mailboxes of the users by striped locks, so requests about different users
+    do not wait for each other. Instant deliveries to a client of another reactor are
+    handed to that reactor, and whether a user's connection is backlogged is kept in
+    backlogged_users under the user's lock, so no thread reads the connections or
+    selector of another reactor.
+    """
+
+    def __init__(self, protocol_version=None, reactors=None):
+        """
+        Args:
+            protocol_version: protocol version the server replies with
+            reactors: number of reactor threads, one per core by default
+        """
+        super().__init__(protocol_version)
+        self.reactors = [Reactor(self, index) for index in range(reactors or DEFAULT_REACTORS)]
+        self.next_reactor = itertools.cycle(self.reactors)
+        # reactor serving each client socket and the connection object of each socket
+        self.reactors_by_sock = {}
+        self.connections = {}
+        # active users whose connection is backlogged, whose messages are stored as unread
+        self.backlogged_users = set()
+        # guards adding, removing and listing accounts and active users, reentrant since
+        # closing a connection while deleting an account removes the active user
+        self.accounts_lock = threading.RLock()
+        self.user_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def locked_users(self, *usernames):
+        """
+        Returns a context manager holding the locks of the mailboxes of the given users,
+        which are always taken in the same order so two requests about the same users
+        cannot deadlock.
+        """
+        stripes = sorted({hash(username) % LOCK_STRIPES for username in usernames})
+        return HeldLocks([self.user_locks[stripe] for stripe in stripes])
+
+    def register_connection(self, conn, addr):
+        """
+        Hands an accepted client socket to the next reactor.
+
+        conn: the non-blocking client socket
+        addr: the address of the client
+        """
+        reactor = next(self.next_reactor)
+        reactor.call_soon(reactor.register, conn, addr)
+
+    def selector(self, sock):
+        return self.reactors_by_sock[sock].sel
+
+    def connection_data(self, sock):
+        return self.connections[sock]
+
+    def is_deliverable(self, username):
+        return username in self.active_users and username not in self.backlogged_users
+
+    def set_backlogged(self, sock, data, backlogged):
+        super().set_backlogged(sock, data, backlogged)
+        username = data.username
+        if username is None:
+            return
+        with self.locked_users(username):
+            # the user may have logged in on another connection in the meantime
+            if self.active_users.get(username) is not sock:
+                return
+            if backlogged:
+                self.backlogged_users.add(username)
+            else:
+                self.backlogged_users.discard(username)
+
+    def start_session(self, sock, data, username):
+        super().start_session(sock, data, username)
+        with self.locked_users(username):
+            if data.backlogged:
+                self.backlogged_users.add(username)
+            else:
+                self.backlogged_users.discard(username)
+
+    def end_session(self, username):
+        # deleting an account already holds the user's lock, and a set update is atomic
+        self.backlogged_users.discard(username)
+        return super().end_session(username)
+
+    def deliver_now(self, sock, message):
+        """
+        Collects an instantly delivered message for the receiver's connection on the
+        thread of the reactor serving it.
+
+        sock: The socket object of the receiver
+        message: The message to deliver
+        """
+        reactor = self.reactors_by_sock.get(sock)
+        if reactor is None:
+            return
+        if reactor.in_thread():
+            super().deliver_now(sock, message)
+        else:
+            reactor.call_soon(self.deliver_if_connected, sock, message)
+
+    def deliver_if_connected(self, sock, message):
+        # the receiver may have disconnected before its reactor ran the delivery
+        if sock in self.reactors_by_sock:
+            super().deliver_now(sock, message)
+
+    def schedule_deliveries(self, sock, data):
+        reactor = self.reactors_by_sock[sock]
+        reactor.delivery_queue.append((time.monotonic() + self.DELIVERY_WINDOW, sock, data))
+
+    def login_session(self, sock, data, username, password):
+        # checking the password and marking the user active has to happen at once, while
+        # the reply is written after the lock is released
+        with self.accounts_lock:
+            return super().login_session(sock, data, username, password)
+
+    def create_account(self, username, password):
+        with self.accounts_lock:
+            return super().create_account(username, password)
+
+    def list_accounts(self, search_string, limit=None, after=None):
+        with self.accounts_lock:
+            return super().list_accounts(search_string, limit, after)
+
+    def send_message(self, sender, receiver, msg):
+        with self.locked_users(sender, receiver):
+            return super().send_message(sender, receiver, msg)
+
+    def read_message(self, username, limit=None, before_id=None, since_id=None):
+        with self.locked_users(username):
+            return super().read_message(username, limit, before_id, since_id)
+
+    def delete_message(self, sender, receiver, msg, timestamp, message_id=None):
+        with self.locked_users(sender, receiver):
+            return super().delete_message(sender, receiver, msg, timestamp, message_id)
+
+    def delete_account(self, username):
+        with self.accounts_lock, self.locked_users(username):
+            return super().delete_account(username)
+
+    def close_connection(self, sock, data):
+        # the user is logged out before the socket is closed, so other threads never find
+        # a closed socket among the active users
+        self.remove_active_user(sock, data)
+        super().close_connection(sock, data)
+        self.reactors_by_sock.pop(sock, None)
+        self.connections.pop(sock, None)
+
+    def remove_active_user(self, sock, data):
+        with self.accounts_lock:
+            if data.username is not None and self.active_users.get(data.username) is sock:
+                self.backlogged_users.discard(data.username)
+            super().remove_active_user(sock, data)
+
+    def handle_client(self):
+        """
+        Starts the reactors and accepts client connections on this thread.
+        """
+        for reactor in self.reactors:
+            reactor.thread.start()
+
+        lsock = self.create_listening_socket()
+        # the acceptor only waits for new clients, so it can block in accept
+        lsock.setblocking(True)
+        try:
+            while True:
+                self.accept_wrapper(lsock)
+        except KeyboardInterrupt:
+            logging.error("Caught keyboard interrupt, exiting")
+        finally:
+            lsock.close()
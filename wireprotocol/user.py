@@ -1,6 +1,123 @@
+from bisect import bisect_left, bisect_right, insort
+from operator import attrgetter
+
+# the list is kept in ID order, so it can be searched by ID
+_message_id = attrgetter("id")
+
+
+class Mailbox:
+    """
+    Messages of a user kept in ID order as they are added, so reading them needs
+    neither a sort nor a copy, and indexed by ID, so removing one does not scan the
+    others. IDs follow the message timestamps, except that they keep increasing when
+    the clock is set back, so the list is ordered by the same key the page cursors
+    search it by.
+
+    Messages are almost always added in the order they are created and are simply
+    appended. A message with a lower ID than the latest one, such as unread messages
+    merged in after newer messages were delivered, is inserted at its place instead.
+
+    A removed message is only dropped from the index and stays in the list as a
+    tombstone that reads skip, until tombstones make up half of the list and it is
+    compacted.
+    """
+
+    def __init__(self):
+        self.messages = []
+        # live messages by ID
+        self.ids = {}
+        # number of removed messages still in the list
+        self.tombstones = 0
+
+    def add(self, message):
+        """
+        Adds a message at its place in ID order.
+
+        Args:
+            message: the Message to add
+        """
+        if self.messages and message.id < self.messages[-1].id:
+            insort(self.messages, message, key=_message_id)
+        else:
+            self.messages.append(message)
+        self.ids[message.id] = message
+
+    def extend(self, messages):
+        """
+        Adds every message of an iterable.
+
+        Args:
+            messages: the Message objects to add
+        """
+        for message in messages:
+            self.add(message)
+
+    def remove(self, message_id):
+        """
+        Removes a message by its ID.
+
+        Args:
+            message_id: the ID of the message
+
+        Returns:
+            Message: the removed message, None if the mailbox does not hold it
+        """
+        message = self.ids.pop(message_id, None)
+        if message is not None:
+            self.tombstones += 1
+            if self.tombstones * 2 > len(self.messages):
+                self.compact()
+        return message
+
+    def compact(self):
+        """Drops the tombstones of removed messages from the list"""
+        ids = self.ids
+        self.messages = [message for message in self.messages if ids.get(message.id) is message]
+        self.tombstones = 0
+
+    def page(self, limit=None, before_id=None, since_id=None):
+        """
+        Returns the latest messages between two message IDs, in time order.
+
+        Args:
+            limit: the most messages to return, every message between the IDs if None
+            before_id: only messages older than this ID are returned
+            since_id: only messages newer than this ID are returned
+
+        Returns:
+            tuple: the messages of the page and whether older messages between the IDs
+                did not fit on it
+        """
+        if self.tombstones:
+            self.compact()
+        messages = self.messages
+        start = bisect_right(messages, since_id, key=_message_id) if since_id else 0
+        end = bisect_left(messages, before_id, key=_message_id) if before_id else len(messages)
+        if limit is not None and end - start > limit:
+            return messages[end - limit : end], True
+        return messages[start:end], False
+
+    def __iter__(self):
+        if not self.tombstones:
+            return iter(self.messages)
+        ids = self.ids
+        return (message for message in self.messages if ids.get(message.id) is message)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, message_id):
+        return message_id in self.ids
+
+    def __getitem__(self, index):
+        if self.tombstones:
+            self.compact()
+        return self.messages[index]
+
+
 class User:
     def __init__(self, username, password):
         self.username = username
         self.password = password
-        self.unread_messages = []
-        self.messages = []
+        self.unread_messages = Mailbox()
+        self.messages = Mailbox()
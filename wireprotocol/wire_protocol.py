@@ -1,23 +1,39 @@
+import struct
+
 FORMAT = "utf-8"
 INT_SIZE = 4
+# big-endian unsigned int used for every length prefix
+INT_STRUCT = struct.Struct(">I")
 
 
-def packing(data):
+def packing(data, buffer=None):
     """
     Packs the data into a format that can be sent over the network.
     Format:
     - version: [1 byte] ("1" or "2")
     - type: [2 bytes] ("00" to "16")
     - info: [list/dicakonary bytes from packing_data]
+
+    Args:
+        data: the data object to pack
+        buffer: optional bytearray reused as scratch space between frames
+
+    Returns:
+        bytes: the packed frame
     """
-    version_byte = data["version"].encode(FORMAT)
-    type_bytes = data["type"].encode(FORMAT)
-    
+    if buffer is None:
+        buffer = bytearray()
+    else:
+        # reuse the scratch buffer's allocation for this frame
+        del buffer[:]
+
+    buffer += data["version"].encode(FORMAT)
+    buffer += data["type"].encode(FORMAT)
+
     # Pack the info field, which can be a dictionary, list, or string
-    info_bytes = packing_data(data["info"])
-    
-    ret_data = version_byte + type_bytes + info_bytes
-    return ret_data
+    _pack_list(buffer, data["info"])
+
+    return bytes(buffer)
 
 
 def packing_data(data):
@@ -27,105 +43,148 @@ def packing_data(data):
     - If data is a dictionary: packs as a single dictionary
     - If data is a string: packs as a string
     """
+    buffer = bytearray()
+    _pack_list(buffer, data)
+    return bytes(buffer)
+
+
+def packing_dictionary(data):
+    """Packs a single dictionary into bytes"""
+    buffer = bytearray()
+    _pack_dictionary(buffer, data)
+    return bytes(buffer)
+
+
+def _pack_list(buffer, data):
+    """
+    Appends a list of dictionaries to buffer.
+
+    Each dictionary is prefixed with its packed length, which is not known until
+    it has been written, so a placeholder is reserved and filled in afterwards.
+    """
     # Pack list length first
-    packed_data = len(data).to_bytes(INT_SIZE, "big")
+    buffer += INT_STRUCT.pack(len(data))
     # Pack each dictionary in the list
     for item in data:
-        item_bytes = packing_dictionary(item)
-        # Pack the length of the dictionary bytes first
-        packed_data += len(item_bytes).to_bytes(INT_SIZE, "big")
-        packed_data += item_bytes
-    return packed_data
+        length_pos = len(buffer)
+        buffer += b"\x00" * INT_SIZE
+        _pack_dictionary(buffer, item)
+        # Pack the length of the dictionary bytes in front of it
+        INT_STRUCT.pack_into(buffer, length_pos, len(buffer) - length_pos - INT_SIZE)
 
 
-
-def packing_dictionary(data): 
-    """Packs a single dictionary into bytes"""
-    packed_data = b""
+def _pack_dictionary(buffer, data):
+    """Appends a single dictionary to buffer"""
+    pack = INT_STRUCT.pack
     for key, value in data.items():
         # Convert key and value to bytes
         key_bytes = str(key).encode(FORMAT)
         value_bytes = str(value).encode(FORMAT)
-        
+
         # Pack key_length, key, value_length, value
-        packed_data += len(key_bytes).to_bytes(INT_SIZE, "big")
-        packed_data += key_bytes
-        packed_data += len(value_bytes).to_bytes(INT_SIZE, "big")
-        packed_data += value_bytes
-    
-    return packed_data
+        buffer += pack(len(key_bytes))
+        buffer += key_bytes
+        buffer += pack(len(value_bytes))
+        buffer += value_bytes
 
 
 def unpacking(data):
     """
     Unpacks the data from the network format.
     Format matches packing function above.
+
+    The frame is walked through a single memoryview with struct offsets so that
+    no intermediate byte strings are created for the length prefixes, keys or values.
     """
+    view = memoryview(data)
     decoded_data = {}
-    
+
     # Get version (1 byte)
-    decoded_data["version"] = data[0:1].decode(FORMAT)
+    decoded_data["version"] = str(view[0:1], FORMAT)
     # Get type (2 bytes)
-    decoded_data["type"] = data[1:3].decode(FORMAT)
-    # Get remaining data for info
-    remaining = data[3:]
-    # Try to unpack the info field
-    decoded_data["info"] = unpacking_data(remaining)
-    
+    decoded_data["type"] = str(view[1:3], FORMAT)
+    # Try to unpack the info field from the remaining data
+    decoded_data["info"] = _unpack_list(view, 3, len(view))
+
     return decoded_data
 
+
 def unpacking_data(data):
     """
     Unpacks data based on its format:
     - If it starts with a list length: unpacks as list of dictionaries
     - Otherwise: tries to unpack as dictionary
     """
-    if not data:
+    view = memoryview(data)
+    return _unpack_list(view, 0, len(view))
+
+
+def unpacking_dictionary(data):
+    """Unpacks a single dictionary from bytes"""
+    view = memoryview(data)
+    return _unpack_dictionary(view, 0, len(view))
+
+
+def _unpack_list(view, pos, end):
+    """
+    Unpacks a list of dictionaries from view[pos:end] without copying.
+
+    Args:
+        view: memoryview over the whole frame
+        pos: offset of the list length prefix
+        end: offset one past the last byte of the list
+
+    Returns:
+        list: the decoded dictionaries, or None if there is no data
+    """
+    if pos >= end:
         return None
-        
-    
-    # Try to read as a list first
-    list_length = int.from_bytes(data[0:INT_SIZE], "big")
-    pos = INT_SIZE
+
+    # Read the list length first
+    (list_length,) = INT_STRUCT.unpack_from(view, pos)
+    pos += INT_SIZE
     result = []
-    
+
     # Read each dictionary in the list
     for _ in range(list_length):
         # Read dictionary length
-        dict_length = int.from_bytes(data[pos:pos+INT_SIZE], "big")
+        (dict_length,) = INT_STRUCT.unpack_from(view, pos)
         pos += INT_SIZE
-        # Read and unpack dictionary
-        dict_data = data[pos:pos+dict_length]
-        result.append(unpacking_dictionary(dict_data))
+        # Read and unpack dictionary in place
+        result.append(_unpack_dictionary(view, pos, pos + dict_length))
         pos += dict_length
-        
+
     return result
-   
 
-def unpacking_dictionary(data): 
-    """Unpacks a single dictionary from bytes"""
+
+def _unpack_dictionary(view, pos, end):
+    """
+    Unpacks a single dictionary from view[pos:end] without copying.
+
+    Args:
+        view: memoryview over the whole frame
+        pos: offset of the first key length prefix
+        end: offset one past the last byte of the dictionary
+
+    Returns:
+        dict: the decoded dictionary
+    """
     info_dict = {}
-    dict_pos = 0
-    
-    while dict_pos < len(data):
-        # Read key length
-        key_len = int.from_bytes(data[dict_pos:dict_pos+INT_SIZE], "big")
-        dict_pos += INT_SIZE
-        
-        # Read key
-        key = data[dict_pos:dict_pos+key_len].decode(FORMAT)
-        dict_pos += key_len
-        
-        # Read value length
-        value_len = int.from_bytes(data[dict_pos:dict_pos+INT_SIZE], "big")
-        dict_pos += INT_SIZE
-        
-        # Read value
-        value = data[dict_pos:dict_pos+value_len].decode(FORMAT)
-        dict_pos += value_len
-        
+    unpack_from = INT_STRUCT.unpack_from
+
+    while pos < end:
+        # Read key length and key
+        (key_len,) = unpack_from(view, pos)
+        pos += INT_SIZE
+        key = str(view[pos : pos + key_len], FORMAT)
+        pos += key_len
+
+        # Read value length and value
+        (value_len,) = unpack_from(view, pos)
+        pos += INT_SIZE
+        value = str(view[pos : pos + value_len], FORMAT)
+        pos += value_len
+
         info_dict[key] = value
 
     return info_dict
-            
-    
\ No newline at end of file